@@ -0,0 +1,155 @@
+"""
+Асинхронный режим API под ASGI.
+Синхронные представления оборачиваются в асинхронные: цикл событий
+принимает тело запроса и отдает ответ медленным клиентам, а view,
+SQL-запросы и чтение потоковых ответов выполняются в пуле потоков
+ограниченного размера (ASYNC_VIEWS_THREADS).
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import URLPattern, URLResolver
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Общий пул потоков для синхронного кода асинхронных представлений."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_VIEWS_THREADS,
+                thread_name_prefix='api-sync'
+            )
+    return _executor
+
+
+def shutdown_executor():
+    """Остановка пула потоков, следующий вызов создаст новый пул."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def run_with_connections(func, *args, **kwargs):
+    """
+    Выполнение func в потоке пула. Соединения с базой данных
+    проверяются до и после вызова, как при обработке запроса.
+    """
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def sync_to_async(func):
+    """
+    Аналог asgiref.sync.sync_to_async, выполняющий func в пуле потоков
+    get_executor(). Одновременно выполняется не больше
+    ASYNC_VIEWS_THREADS вызовов, остальные ждут в очереди, не занимая
+    цикл событий.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        call = functools.partial(contextvars.copy_context().run,
+                                 run_with_connections, func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(), call
+        )
+
+    return wrapper
+
+
+def run_in_background(func, *args):
+    """
+    Выполнение func без ожидания результата в асинхронном режиме,
+    в синхронном -- сразу.
+    """
+    if settings.ASYNC_VIEWS:
+        get_executor().submit(run_with_connections, func, *args)
+    else:
+        func(*args)
+
+
+def stream_without_database(response):
+    """
+    Отметка потокового ответа, генератор которого не обращается
+    к базе данных: такой ответ передается циклу событий по частям.
+    """
+    response.reads_database = False
+    return response
+
+
+def read_streaming_response(response):
+    """
+    Чтение потокового ответа в потоке пула.
+    Django 3.2 перебирает streaming_content под ASGI в цикле событий,
+    где запросы к базе данных запрещены, поэтому ответ собирается
+    в памяти целиком. Ответы, отмеченные stream_without_database,
+    сюда не попадают.
+    """
+    try:
+        content = b''.join(response.streaming_content)
+    finally:
+        response.close()
+    result = HttpResponse(content, status=response.status_code)
+    for header, value in response.items():
+        result[header] = value
+    result.cookies = response.cookies
+    return result
+
+
+def call_view(view, request, *args, **kwargs):
+    stats = getattr(request, 'metrics', None)
+    with stats.track() if stats is not None else nullcontext():
+        response = view(request, *args, **kwargs)
+        if response.streaming and getattr(response, 'reads_database', True):
+            response = read_streaming_response(response)
+    return response
+
+
+def async_view(view):
+    """Асинхронное представление, выполняющее view в пуле потоков."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(call_view)(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_urlpatterns(urlpatterns):
+    """Копия urlpatterns с асинхронными представлениями."""
+    result = []
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver):
+            result.append(URLResolver(
+                pattern.pattern,
+                async_urlpatterns(pattern.url_patterns),
+                pattern.default_kwargs,
+                pattern.app_name,
+                pattern.namespace
+            ))
+        elif asyncio.iscoroutinefunction(pattern.callback):
+            result.append(pattern)
+        else:
+            result.append(URLPattern(
+                pattern.pattern,
+                async_view(pattern.callback),
+                pattern.default_args,
+                pattern.name
+            ))
+    return result
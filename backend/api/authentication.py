@@ -0,0 +1,148 @@
+"""
+Аутентификация по токену с кэшем.
+Токен с пользователем хранится в LRU-кэше процесса и, при
+TOKEN_CACHE_SHARED, в общем кэше Django, поэтому повторные запросы
+не обращаются к таблицам authtoken_token и users_foodgramuser.
+Записи удаляются при удалении токена и сохранении пользователя
+(смена пароля, деактивация). В других процессах копия в LRU-кэше
+живет не дольше AuthConstants.LOCAL_TTL. Пользователь из кэша может
+быть старой копией, поэтому сохраняется только с update_fields.
+"""
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram_backend.constants import AuthConstants
+
+TOKEN_KEY = 'api:token:{digest}'
+REVOKED_SUFFIX = ':revoked'
+
+
+class TokenCache:
+    """LRU-кэш процесса с ограничением времени жизни записей."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Счетчик удалений: запись, прочитанная из базы до удаления,
+        # не должна попасть в кэш после него.
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+token_cache = TokenCache(AuthConstants.LOCAL_CACHE_SIZE,
+                         AuthConstants.LOCAL_TTL)
+
+
+def get_shared_key(key):
+    """Ключ общего кэша: сам токен в ключах кэша не хранится."""
+    return TOKEN_KEY.format(digest=hashlib.sha256(key.encode()).hexdigest())
+
+
+def invalidate_tokens(*keys):
+    """
+    Удаление токенов из кэшей.
+    Выполняется сразу и повторно после фиксации транзакции,
+    чтобы запрос, прочитавший токен до фиксации, не вернул его в кэш.
+    """
+    if not keys:
+        return
+
+    def invalidate():
+        token_cache.delete(*keys)
+        if settings.TOKEN_CACHE_SHARED:
+            shared_keys = [get_shared_key(key) for key in keys]
+            # Отметка удаления не дает записать в общий кэш токен,
+            # прочитанный из базы до удаления (set_shared).
+            revoked = time.time_ns()
+            cache.set_many(
+                {shared_key + REVOKED_SUFFIX: revoked
+                 for shared_key in shared_keys},
+                AuthConstants.SHARED_TTL
+            )
+            cache.delete_many(shared_keys)
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def set_shared(shared_key, data, revoked):
+    """
+    Запись токена в общий кэш, если его не удаляли после чтения
+    из базы: revoked -- отметка удаления, прочитанная до запроса к базе.
+    Отметка проверяется и после записи, поскольку удаление могло
+    выполниться между проверкой и записью.
+    """
+    revoked_key = shared_key + REVOKED_SUFFIX
+    if cache.get(revoked_key) != revoked:
+        return
+    cache.set(shared_key, data, AuthConstants.SHARED_TTL)
+    if cache.get(revoked_key) != revoked:
+        cache.delete(shared_key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кэшем токенов и пользователей."""
+
+    def authenticate_credentials(self, key):
+        shared = settings.TOKEN_CACHE_SHARED
+        data = token_cache.get(key)
+        if data is None and shared:
+            shared_key = get_shared_key(key)
+            entries = cache.get_many([shared_key,
+                                      shared_key + REVOKED_SUFFIX])
+            data = entries.get(shared_key)
+            if data is not None:
+                token_cache.set(key, data)
+        if data is not None:
+            # Каждый запрос получает свою копию пользователя.
+            token = pickle.loads(data)
+            return token.user, token
+        generation = token_cache.generation
+        user, token = super().authenticate_credentials(key)
+        data = pickle.dumps(token, pickle.HIGHEST_PROTOCOL)
+        token_cache.set(key, data, generation)
+        if shared:
+            set_shared(shared_key, data,
+                       entries.get(shared_key + REVOKED_SUFFIX))
+        return user, token
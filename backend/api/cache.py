@@ -0,0 +1,251 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.routers import read_primary_if_changed
+from foodgram_backend.constants import CacheConstants
+
+VERSION_KEY = 'api:version:{scope}'
+RESPONSE_KEY = 'api:response:{view}:{digest}'
+LOCK_SUFFIX = ':lock'
+USER_SCOPE = 'user:{user_id}'
+
+
+def is_shared_cache() -> bool:
+    """Кэш по умолчанию общий для всех процессов."""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def check_shared_cache():
+    """
+    Проверка при запуске: версии областей данных, от которых зависят
+    ETag и кэш ответов, и закрепления клиентов за основной базой
+    (api.routers) должны быть общими для всех процессов. Иначе другие
+    процессы отдают 304 и старые ответы после изменения данных, а клиент
+    после своего изменения читает из отстающей реплики.
+    Реплики PostgreSQL требуют общего кэша при любом числе процессов:
+    число процессов gunicorn задается не только WEB_CONCURRENCY.
+    """
+    if is_shared_cache():
+        return
+    if settings.WEB_CONCURRENCY > 1:
+        raise ImproperlyConfigured(
+            f'WEB_CONCURRENCY={settings.WEB_CONCURRENCY} требует общего '
+            'кэша: укажите CACHE_BACKEND и CACHE_LOCATION.'
+        )
+    if settings.DATABASE_REPLICAS and settings.DB_PROD:
+        raise ImproperlyConfigured(
+            'DB_REPLICAS требует общего кэша: укажите CACHE_BACKEND '
+            'и CACHE_LOCATION.'
+        )
+
+
+def get_versions(*scopes):
+    """
+    Версии областей данных.
+    Версия -- время последнего изменения в наносекундах. Если версия
+    вытеснена из кэша, она создается заново текущим временем,
+    поэтому старые ответы не могут совпасть с новой версией.
+    """
+    keys = [VERSION_KEY.format(scope=scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    """
+    Изменение версий областей данных.
+    Версии меняются сразу и повторно после фиксации транзакции,
+    чтобы ответ, построенный до фиксации, не попал в кэш
+    под новой версией.
+    """
+    def bump():
+        version = time.time_ns()
+        cache.set_many(
+            {VERSION_KEY.format(scope=scope): version for scope in scopes},
+            timeout=None
+        )
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def user_scope(user_id):
+    """Область данных, зависящих от пользователя."""
+    return USER_SCOPE.format(user_id=user_id)
+
+
+def normalize_query(request):
+    """Параметры запроса без учета порядка ключей и значений."""
+    return sorted(
+        (key, sorted(request.query_params.getlist(key)))
+        for key in request.query_params
+    )
+
+
+class AnonymousCacheMixin:
+    """
+    Кэширование ответов list и retrieve для анонимных пользователей.
+    Ключ строится из схемы и хоста запроса (ответы содержат абсолютные
+    ссылки next и previous), действия, параметров URL, нормализованной
+    строки запроса и версий областей cache_scopes, поэтому изменение
+    данных делает старые ответы недоступными.
+    Устаревший ответ отдается еще STALE_TTL секунд, пока его
+    пересчитывает один процесс, получивший блокировку. Сразу после
+    изменения данных ответ для кэша читается из основной базы.
+    """
+
+    cache_scopes = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request,
+                                        *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request,
+                                        *args, **kwargs)
+
+    def get_cache_key(self, request, versions):
+        parts = (request.scheme, request.get_host(), self.action,
+                 sorted(self.kwargs.items()), normalize_query(request),
+                 versions)
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+        return RESPONSE_KEY.format(view=self.basename, digest=digest)
+
+    def get_cached_response(self, view, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        versions = get_versions(*self.cache_scopes)
+        key = self.get_cache_key(request, versions)
+        lock_key = key + LOCK_SUFFIX
+        locked = cache.add(lock_key, True, CacheConstants.LOCK_TTL)
+        entry = cache.get(key)
+        if entry is None and not locked:
+            entry = self.wait_for_entry(key)
+        if entry is not None:
+            data, expires_at = entry
+            if time.time() < expires_at or not locked:
+                if locked:
+                    cache.delete(lock_key)
+                return Response(data)
+        try:
+            with read_primary_if_changed(max(versions, default=0) / 10 ** 9):
+                response = view(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(
+                    key,
+                    (response.data,
+                     time.time() + CacheConstants.RESPONSE_TTL),
+                    CacheConstants.RESPONSE_TTL + CacheConstants.STALE_TTL
+                )
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return response
+
+    @staticmethod
+    def wait_for_entry(key):
+        """Ожидание ответа, который строит другой процесс."""
+        deadline = time.monotonic() + CacheConstants.LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(CacheConstants.LOCK_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы для list и retrieve.
+    ETag строится из действия, параметров URL и запроса, формата ответа,
+    версий областей get_etag_scopes, поля object_version_field объекта
+    и версии данных текущего пользователя. Last-Modified -- самая поздняя
+    из этих версий, если с нее прошло не меньше секунды. На совпавшие
+    If-None-Match и If-Modified-Since отдается 304 без обращения
+    к сериализатору. Версии хранятся в кэше, поэтому несколько процессов
+    требуют общего кэша (check_shared_cache). Сразу после изменения
+    данных ответ читается из основной базы, а не из отстающей реплики.
+    """
+
+    object_version_field = None
+    # Время последнего изменения областей данных запроса, с.
+    changed_at = 0.0
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request,
+                                             *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request,
+                                             *args, **kwargs)
+
+    def get_etag_scopes(self):
+        return self.cache_scopes
+
+    def get_object_version(self):
+        """
+        Время изменения запрошенного объекта одним запросом по ключу.
+        None, если объект не найден.
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return self.queryset.model.objects.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            ).values_list(self.object_version_field, flat=True).first()
+        except (ValueError, ValidationError):
+            return None
+
+    def get_validators(self, request):
+        scopes = list(self.get_etag_scopes())
+        if request.user.is_authenticated:
+            scopes.append(user_scope(request.user.id))
+        versions = [version / 10 ** 9 for version in get_versions(*scopes)]
+        self.changed_at = max(versions, default=0)
+        if self.action == 'retrieve' and self.object_version_field:
+            object_version = self.get_object_version()
+            if object_version is None:
+                return None, None
+            versions.append(object_version.timestamp())
+        parts = (self.action, sorted(self.kwargs.items()),
+                 normalize_query(request), request.accepted_media_type,
+                 versions)
+        etag = quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest())
+        last_modified = max(versions, default=0)
+        # Last-Modified с точностью до секунды не отличает изменения
+        # в пределах секунды, поэтому отдается, только когда эта секунда
+        # прошла (RFC 7232, 2.2.2), до этого проверяется только ETag.
+        if time.time() - last_modified < 1:
+            return etag, None
+        return etag, int(last_modified)
+
+    def get_conditional_response(self, view, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return view(request, *args, **kwargs)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            with read_primary_if_changed(self.changed_at):
+                response = view(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
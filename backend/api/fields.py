@@ -1,19 +1,95 @@
 import base64
+import binascii
+from io import BytesIO
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from PIL import Image
 from rest_framework import serializers
 
+from foodgram_backend.constants import RecipeImageConstants
+
 
 class Base64ImageField(serializers.ImageField):
     """
     Поле обработки изображений для сериализатора создания рецептов.
-    Преобразует изображение в base64.
+    Принимает изображение в base64 (data URI) или загруженный файл.
+    base64 декодируется частями во временный файл с ограничением размера.
+    Формат и размеры изображения проверяются по заголовку
+    до полной проверки изображения.
     """
-    def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format_, img_str = data.split(';base64,')
-            ext = format_.split('/')[-1]
 
-            data = ContentFile(base64.b64decode(img_str), name='temp.' + ext)
+    default_error_messages = {
+        'max_size': 'Размер изображения больше {max_size} байт.',
+        'invalid_format': 'Недопустимый формат изображения: {format}.',
+        'max_pixels': 'Слишком большое изображение: {width}x{height}.',
+    }
+    base64_prefix = 'data:image'
+    base64_separator = ';base64,'
 
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data.startswith(self.base64_prefix):
+            data = self.decode_base64(data)
+        if isinstance(data, File):
+            self.check_image(data)
         return super().to_internal_value(data)
+
+    def decode_base64(self, data: str):
+        """
+        Декодирование data URI частями во временный файл.
+        Файлы больше FILE_UPLOAD_MAX_MEMORY_SIZE сохраняются на диск.
+        """
+        separator_index = data.find(self.base64_separator, 0,
+                                    RecipeImageConstants.MAX_HEADER_LEN)
+        if separator_index == -1:
+            self.fail('invalid')
+        ext = data[len(self.base64_prefix) + 1:separator_index]
+        start = separator_index + len(self.base64_separator)
+        size = (len(data) - start) * 3 // 4
+        if size > RecipeImageConstants.MAX_SIZE:
+            self.fail('max_size', max_size=RecipeImageConstants.MAX_SIZE)
+
+        name = f'temp.{ext}'
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            file = TemporaryUploadedFile(name, f'image/{ext}', size, None)
+        else:
+            file = InMemoryUploadedFile(BytesIO(), None, name,
+                                        f'image/{ext}', size, None)
+        rest = ''
+        chunk_size = RecipeImageConstants.DECODE_CHUNK_SIZE
+        try:
+            for offset in range(start, len(data), chunk_size):
+                chunk = data[offset:offset + chunk_size]
+                chunk = rest + ''.join(chunk.split())
+                usable = len(chunk) - len(chunk) % 4
+                file.write(base64.b64decode(chunk[:usable], validate=True))
+                rest = chunk[usable:]
+        except binascii.Error:
+            self.fail('invalid')
+        if rest:
+            self.fail('invalid')
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
+    def check_image(self, file: File):
+        """
+        Проверка размера файла, формата и размеров изображения.
+        Pillow читает только заголовок, изображение не декодируется.
+        """
+        if file.size and file.size > RecipeImageConstants.MAX_SIZE:
+            self.fail('max_size', max_size=RecipeImageConstants.MAX_SIZE)
+        try:
+            with Image.open(file) as image:
+                image_format = image.format
+                width, height = image.size
+        except Exception:
+            self.fail('invalid_image')
+        finally:
+            file.seek(0)
+        if image_format not in RecipeImageConstants.ALLOWED_FORMATS:
+            self.fail('invalid_format', format=image_format)
+        if width * height > RecipeImageConstants.MAX_PIXELS:
+            self.fail('max_pixels', width=width, height=height)
@@ -1,9 +1,11 @@
-import django_filters
 from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe
+from api.indexes import tag_index
+from api.rankings import RANKINGS, rank_recipes
+from api.search import search_recipes
+from recipes.models import Favorites, Recipe, ShoppingList
 
 
 class NoValidationMultipleChoiceField(forms.MultipleChoiceField):
@@ -12,15 +14,10 @@ class NoValidationMultipleChoiceField(forms.MultipleChoiceField):
         pass
 
 
-class CustomTagFilter(django_filters.AllValuesMultipleFilter):
+class CustomTagFilter(filters.MultipleChoiceFilter):
     field_class = NoValidationMultipleChoiceField
 
 
-class IngredientNameSearchFilter(SearchFilter):
-    """Фильтр поиска по имени ингредиента."""
-    search_param = 'name'
-
-
 class CustomRecipeFilter(FilterSet):
     """
     Фильтр поиска рецептов.
@@ -30,27 +27,60 @@ class CustomRecipeFilter(FilterSet):
     - author=<id> -- Только рецепты выбранного автора
     - tags=<slug> -- Только рецепты с выбранными тегами
         Пример: tags=lunch&tags=breakfast
+    - search=<str> -- Полнотекстовый поиск по названию и описанию,
+        результаты упорядочены по релевантности.
+    - ordering=<popular или trending> -- Сортировка по рейтингу
+        за все время или за последние дни вместо даты публикации.
+    Все фильтры по связанным таблицам -- подзапросы Exists, поэтому
+    рецепты не повторяются и DISTINCT не нужен.
     """
-    tags = CustomTagFilter(field_name='tags__slug',
-                           label='Теги')
+    tags = CustomTagFilter(method='filter_tags', label='Теги')
     is_favorited = filters.NumberFilter(
         method='filter_is_favorited',
         max_value=1, min_value=0, label='В избранном')
     is_in_shopping_cart = filters.NumberFilter(
         method='filter_is_in_shopping_cart',
         max_value=1, min_value=0, label='В корзине')
+    search = filters.CharFilter(method='filter_search', label='Поиск')
+    ordering = filters.ChoiceFilter(
+        method='filter_ordering',
+        choices=[(ranking, ranking) for ranking in RANKINGS],
+        label='Сортировка')
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        tag_ids = tag_index.get_ids(value)
+        if not tag_ids:
+            return queryset.none()
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(recipe_id=OuterRef('pk'),
+                                               tag_id__in=tag_ids)
+        ))
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(Exists(Favorites.objects.filter(
+                recipe_id=OuterRef('pk'), user=self.request.user
+            )))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shop_list__user=self.request.user)
+            return queryset.filter(Exists(ShoppingList.objects.filter(
+                recipe_id=OuterRef('pk'), user=self.request.user
+            )))
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        return rank_recipes(queryset, value)
+
     class Meta:
         model = Recipe
         fields = ('is_favorited', 'is_in_shopping_cart',
-                  'author', 'tags')
+                  'author', 'tags', 'search', 'ordering')
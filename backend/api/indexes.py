@@ -0,0 +1,343 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+
+from django.db import connections
+
+from api.cache import get_versions
+from foodgram_backend.constants import CookableConstants
+from recipes.models import Ingredient, RecipeIngredient, Tag
+
+
+class IngredientPrefixIndex:
+    """
+    Индекс ингредиентов в памяти процесса для поиска по началу названия.
+    Хранит отсортированный список нормализованных названий и ищет
+    первое совпадение бинарным поиском.
+    Индекс строится при первом обращении. Вместе с индексом хранится
+    версия области ingredients из кэша, поэтому изменение ингредиентов
+    в любом процессе, в том числе загрузка loadcsvdata, сбрасывает
+    индекс во всех процессах при следующем поиске.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """Приведение названия к виду для сравнения без учета регистра."""
+        return name.strip().casefold()
+
+    def _build(self):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (self.normalize(ingredient.name),
+                                    ingredient.id)
+        )
+        keys = [self.normalize(ingredient.name) for ingredient in ingredients]
+        return keys, ingredients
+
+    def _get_index(self):
+        version, = get_versions('ingredients')
+        index = self._index
+        if index is None or index[0] != version:
+            with self._lock:
+                index = self._index
+                if index is None or index[0] != version:
+                    index = self._index = (version, *self._build())
+        return index[1:]
+
+    def invalidate(self):
+        """Сброс индекса, перестроение при следующем поиске."""
+        with self._lock:
+            self._index = None
+
+    def search(self, prefix: str, limit: int):
+        """
+        Поиск ингредиентов, название которых начинается с prefix.
+        Возвращает не более limit ингредиентов в алфавитном порядке.
+        """
+        keys, ingredients = self._get_index()
+        prefix = self.normalize(prefix)
+        result = []
+        for position in range(bisect_left(keys, prefix), len(keys)):
+            if len(result) == limit or not keys[position].startswith(prefix):
+                break
+            result.append(ingredients[position])
+        return result
+
+
+class TagSlugIndex:
+    """
+    Соответствие slug тегов их id в памяти процесса.
+    Вместе с соответствием хранится версия области tags из кэша,
+    поэтому изменение тегов в любом процессе сбрасывает индекс
+    во всех процессах при следующем обращении.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._index = None
+
+    def _get_index(self):
+        version, = get_versions('tags')
+        index = self._index
+        if index is None or index[0] != version:
+            with self._lock:
+                index = self._index
+                if index is None or index[0] != version:
+                    index = self._index = (
+                        version, dict(Tag.objects.values_list('slug', 'id'))
+                    )
+        return index[1]
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+    def get_ids(self, slugs):
+        """id тегов с переданными slug, неизвестные slug пропускаются."""
+        index = self._get_index()
+        return [index[slug] for slug in slugs if slug in index]
+
+
+def popcount(bits: int) -> int:
+    return bin(bits).count('1')
+
+
+def make_bitset(positions) -> int:
+    """Битовое множество из номеров позиций за один проход."""
+    positions = list(positions)
+    if not positions:
+        return 0
+    buffer = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class CookableResult:
+    """
+    Последовательность (recipe_id, missing) для пагинации.
+    Группы битовых множеств уже упорядочены по рангу, номера рецептов
+    извлекаются только для запрошенного среза, в группе -- от новых
+    рецептов к старым.
+    """
+
+    def __init__(self, groups):
+        self.groups = [(missing, bits, popcount(bits))
+                       for missing, bits in groups if bits]
+
+    def __len__(self):
+        return sum(count for *_, count in self.groups)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop, _ = item.indices(len(self))
+        result = []
+        for missing, bits, count in self.groups:
+            if start >= count:
+                start -= count
+                stop -= count
+                continue
+            if stop <= 0:
+                break
+            for position in range(min(stop, count)):
+                recipe_id = bits.bit_length() - 1
+                bits ^= 1 << recipe_id
+                if position >= start:
+                    result.append((recipe_id, missing))
+            start = 0
+            stop -= count
+        return result
+
+
+class CookableIndex:
+    """
+    Инвертированный индекс ингредиент -> битовое множество рецептов.
+    Номер бита -- id рецепта. Для каждого размера рецепта хранится
+    множество рецептов с таким числом ингредиентов.
+    Поиск складывает множества запрошенных ингредиентов побитовым
+    счетчиком: срез i хранит i-й бит количества совпавших ингредиентов
+    каждого рецепта. Рецепты с нужным числом совпадений выбираются
+    сравнением срезов, поэтому время поиска зависит от числа
+    ингредиентов в запросе и размеров рецептов, а не от числа строк.
+    Память -- около (число ингредиентов) * (максимальный id рецепта) / 8
+    байт.
+    Индекс обновляется сигналами в текущем процессе и перестраивается
+    в фоне раз в REBUILD_INTERVAL секунд, чтобы учесть изменения
+    из других процессов и массовые загрузки без сигналов.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # Индекс строит один поток, остальные ждут первого построения
+        # или пользуются прежним индексом до конца перестроения.
+        self._build_lock = Lock()
+        self._state = None
+        self._built_at = 0.0
+        self._rebuilding = False
+        self._pending = []
+
+    @staticmethod
+    def _build():
+        positions = defaultdict(list)
+        sizes = defaultdict(int)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).iterator():
+            positions[ingredient_id].append(recipe_id)
+            sizes[recipe_id] += 1
+        size_positions = defaultdict(list)
+        for recipe_id, size in sizes.items():
+            size_positions[size].append(recipe_id)
+        return {
+            'postings': {ingredient_id: make_bitset(recipe_ids)
+                         for ingredient_id, recipe_ids in positions.items()},
+            'sizes': dict(sizes),
+            'size_classes': {size: make_bitset(recipe_ids)
+                             for size, recipe_ids in size_positions.items()},
+        }
+
+    def _get_state(self):
+        with self._lock:
+            state = self._state
+            expired = (time.monotonic() - self._built_at
+                       > CookableConstants.REBUILD_INTERVAL)
+            if state is not None and expired and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_in_background,
+                                 daemon=True).start()
+        if state is None:
+            state = self._rebuild(missing_only=True)
+        return state
+
+    def _rebuild_in_background(self):
+        """
+        Перестроение в фоновом потоке. Соединения с базой данных
+        закрываются до завершения потока: соединение из пула
+        возвращается в пул только при закрытии.
+        """
+        try:
+            self._rebuild()
+        finally:
+            connections.close_all()
+
+    def _rebuild(self, missing_only=False):
+        """
+        Построение индекса и применение изменений, поступивших во время
+        построения. При missing_only индекс строится, только если его
+        еще нет. Возвращает текущий индекс.
+        """
+        with self._build_lock:
+            with self._lock:
+                if missing_only and self._state is not None:
+                    return self._state
+                self._rebuilding = True
+                self._pending = []
+            try:
+                state = self._build()
+            except Exception:
+                with self._lock:
+                    self._rebuilding = False
+                    self._pending = []
+                raise
+            with self._lock:
+                for change in self._pending:
+                    self._apply(state, *change)
+                self._state = state
+                self._built_at = time.monotonic()
+                self._rebuilding = False
+                self._pending = []
+            return state
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+    def change(self, recipe_id, added=(), removed=()):
+        """
+        Изменение состава рецепта. Операции идемпотентны: повторное
+        добавление или удаление того же ингредиента ничего не меняет.
+        """
+        change = (recipe_id, tuple(added), tuple(removed))
+        with self._lock:
+            if self._rebuilding:
+                self._pending.append(change)
+            if self._state is not None:
+                self._apply(self._state, *change)
+
+    @staticmethod
+    def _apply(state, recipe_id, added, removed):
+        postings = state['postings']
+        size_classes = state['size_classes']
+        bit = 1 << recipe_id
+        old_size = size = state['sizes'].get(recipe_id, 0)
+        for ingredient_id in removed:
+            bits = postings.get(ingredient_id, 0)
+            if bits & bit:
+                postings[ingredient_id] = bits ^ bit
+                size -= 1
+        for ingredient_id in added:
+            bits = postings.get(ingredient_id, 0)
+            if not bits & bit:
+                postings[ingredient_id] = bits | bit
+                size += 1
+        if size == old_size:
+            return
+        if old_size:
+            size_classes[old_size] &= ~bit
+        if size:
+            size_classes[size] = size_classes.get(size, 0) | bit
+            state['sizes'][recipe_id] = size
+        else:
+            state['sizes'].pop(recipe_id, None)
+
+    def search(self, ingredient_ids, max_missing=0):
+        """
+        Рецепты, в которых не хватает не более max_missing ингредиентов
+        из ingredient_ids и есть хотя бы один из них.
+        Результат упорядочен по числу недостающих ингредиентов, затем
+        по числу совпавших и по новизне рецепта.
+        """
+        state = self._get_state()
+        postings = state['postings']
+        slices = []
+        for ingredient_id in set(ingredient_ids):
+            carry = postings.get(ingredient_id, 0)
+            for position, counter in enumerate(slices):
+                if not carry:
+                    break
+                slices[position], carry = counter ^ carry, counter & carry
+            if carry:
+                slices.append(carry)
+        if not slices:
+            return CookableResult([])
+        matched_any = 0
+        for counter in slices:
+            matched_any |= counter
+        groups = []
+        for missing in range(max_missing + 1):
+            for size in sorted(state['size_classes'], reverse=True):
+                matched = size - missing
+                if not 0 < matched < 1 << len(slices):
+                    continue
+                bits = state['size_classes'][size] & matched_any
+                for position, counter in enumerate(slices):
+                    if not bits:
+                        break
+                    if matched >> position & 1:
+                        bits &= counter
+                    else:
+                        bits &= ~counter
+                groups.append((missing, bits))
+        return CookableResult(groups)
+
+
+ingredient_index = IngredientPrefixIndex()
+tag_index = TagSlugIndex()
+cookable_index = CookableIndex()
@@ -0,0 +1,238 @@
+import asyncio
+import threading
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.db import connections
+
+from api.async_views import sync_to_async
+from foodgram_backend.constants import MetricsConstants
+
+API_NAMESPACE = 'api'
+
+
+class RequestStats:
+    """
+    Замеры одного запроса.
+    Время сериализации -- время работы view без SQL-запросов:
+    сериализаторы, валидация и логика view.
+    Время рендера -- время преобразования Response в байты.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.view = None
+        self.action = None
+        self.view_started = None
+        self.view_db_time = 0.0
+        self.view_time = None
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+
+    def execute(self, execute, sql, params, many, context):
+        """Обертка выполнения SQL-запросов для connection.execute_wrapper."""
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.db_queries += 1
+
+    @contextmanager
+    def track(self):
+        """Подсчет SQL-запросов соединений текущего потока."""
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self.execute))
+            yield
+
+    def start_view(self, view, action):
+        self.view = view
+        self.action = action
+        self.view_started = perf_counter()
+        self.view_db_time = self.db_time
+
+    def finish_view(self):
+        if self.view_started is None or self.view_time is not None:
+            return
+        self.view_time = perf_counter() - self.view_started
+        self.serialize_time = max(
+            self.view_time - (self.db_time - self.view_db_time), 0.0
+        )
+
+    def start_render(self, response):
+        started = perf_counter()
+
+        def finish_render(response):
+            self.render_time = perf_counter() - started
+
+        response.add_post_render_callback(finish_render)
+
+    def get_server_timing(self):
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.2f};'
+            f'desc="{self.db_queries} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.2f}',
+            f'render;dur={self.render_time * 1000:.2f}',
+            f'total;dur={self.total_time * 1000:.2f}',
+        ))
+
+
+class MetricsRegistry:
+    """
+    Гистограммы запросов по view и action в памяти процесса.
+    Каждый процесс сервера ведет свои гистограммы, Prometheus
+    собирает их с каждого процесса отдельно.
+    """
+
+    # Имя гистограммы, атрибут RequestStats, границы корзин, описание.
+    HISTOGRAMS = (
+        ('request_duration_seconds', 'total_time',
+         MetricsConstants.DURATION_BUCKETS, 'Полное время запроса.'),
+        ('db_duration_seconds', 'db_time',
+         MetricsConstants.DURATION_BUCKETS, 'Время SQL-запросов.'),
+        ('db_queries', 'db_queries',
+         MetricsConstants.QUERIES_BUCKETS, 'Количество SQL-запросов.'),
+        ('serialize_duration_seconds', 'serialize_time',
+         MetricsConstants.DURATION_BUCKETS, 'Время view без SQL-запросов.'),
+        ('render_duration_seconds', 'render_time',
+         MetricsConstants.DURATION_BUCKETS, 'Время рендера ответа.'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name, *_ in self.HISTOGRAMS}
+        self._requests = {}
+
+    def observe(self, stats: RequestStats, status_code):
+        labels = (stats.view, stats.action)
+        with self._lock:
+            key = (*labels, status_code)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for name, attr, buckets, _ in self.HISTOGRAMS:
+                value = getattr(stats, attr)
+                histogram = self._histograms[name].get(labels)
+                if histogram is None:
+                    histogram = self._histograms[name][labels] = [
+                        [0] * (len(buckets) + 1), 0.0
+                    ]
+                histogram[0][bisect_left(buckets, value)] += 1
+                histogram[1] += value
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {name: {} for name, *_ in self.HISTOGRAMS}
+            self._requests = {}
+
+    def export(self):
+        """Метрики в текстовом формате Prometheus."""
+        prefix = MetricsConstants.PREFIX
+        lines = [f'# HELP {prefix}_requests_total Количество запросов.',
+                 f'# TYPE {prefix}_requests_total counter']
+        with self._lock:
+            for (view, action, status), count in sorted(
+                self._requests.items()
+            ):
+                lines.append(
+                    f'{prefix}_requests_total'
+                    f'{{{format_labels(view, action)},status="{status}"}} '
+                    f'{count}'
+                )
+            for name, _, buckets, description in self.HISTOGRAMS:
+                metric = f'{prefix}_{name}'
+                lines += [f'# HELP {metric} {description}',
+                          f'# TYPE {metric} histogram']
+                for (view, action), (counts, total) in sorted(
+                    self._histograms[name].items()
+                ):
+                    labels = format_labels(view, action)
+                    cumulative = 0
+                    for bound, count in zip((*buckets, '+Inf'), counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket'
+                                     f'{{{labels},le="{bound}"}} '
+                                     f'{cumulative}')
+                    lines += [f'{metric}_sum{{{labels}}} {total}',
+                              f'{metric}_count{{{labels}}} {cumulative}']
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(view, action):
+    return f'view="{escape_label(view)}",action="{escape_label(action)}"'
+
+
+def escape_label(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    Замеры запросов к маршрутам api.
+    SQL-запросы считаются через connection.execute_wrapper, время
+    рендера -- через post_render_callback ответа. Результаты
+    добавляются в registry, а персоналу возвращаются в заголовке
+    Server-Timing.
+    Под ASGI SQL-запросы асинхронных представлений считаются в потоке,
+    где выполняется view (api.async_views).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Как в django.utils.deprecation.MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = request.metrics = RequestStats()
+        with stats.track():
+            response = self.get_response(request)
+        return self.finish(request, stats, response)
+
+    async def __acall__(self, request):
+        stats = request.metrics = RequestStats()
+        response = await self.get_response(request)
+        if stats.view is None:
+            return response
+        return await sync_to_async(self.finish)(request, stats, response)
+
+    @staticmethod
+    def finish(request, stats, response):
+        if stats.view is None:
+            return response
+        stats.finish_view()
+        stats.total_time = perf_counter() - stats.started
+        registry.observe(stats, response.status_code)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = stats.get_server_timing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if API_NAMESPACE not in request.resolver_match.namespaces:
+            return None
+        view_class = getattr(view_func, 'cls', None)
+        view = view_class.__name__ if view_class else view_func.__name__
+        actions = getattr(view_func, 'actions', None) or {}
+        method = request.method.lower()
+        request.metrics.start_view(view, actions.get(method, method))
+        return None
+
+    def process_template_response(self, request, response):
+        stats = getattr(request, 'metrics', None)
+        if stats is not None and stats.view is not None:
+            stats.finish_view()
+            stats.start_render(response)
+        return response
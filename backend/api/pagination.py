@@ -1,9 +1,182 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination, _positive_int)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from api.rankings import RANK_FIELD
+from api.services import FeedTimeline
+from foodgram_backend.constants import PaginationConstants
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Пагинация по курсору (keyset).
+    Порядок совпадает с Meta.ordering модели и дополняется id,
+    поэтому позиция однозначна: для рецептов это (pub_date, id).
+    Запрос COUNT(*) и сдвиг OFFSET по всей выборке не выполняются.
+    """
+    page_size_query_param = 'limit'
+    page_size = PaginationConstants.PAGE_SIZE
+    max_page_size = PaginationConstants.MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        return (*queryset.model._meta.ordering, '-id')
+
+
+class RankKeysetPagination(BasePagination):
+    """
+    Пагинация по курсору для сортировки по рейтингу (api.rankings)
+    и по релевантности поиска (api.search).
+    Позиция -- пара (рейтинг, id) последнего объекта страницы,
+    следующая страница -- объекты с меньшей парой, что читается
+    из индекса (рейтинг, id) без OFFSET даже при равных рейтингах.
+    Условие строится по первым двум полям сортировки выборки,
+    чтобы совпадать со столбцами индекса.
+    Поддерживается только переход вперед, previous всегда null.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = PaginationConstants.PAGE_SIZE
+    max_page_size = PaginationConstants.MAX_PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        if position is not None:
+            rank, pk = position
+            rank_field, pk_field = (
+                field.lstrip('-') for field in queryset.query.order_by[:2]
+            )
+            queryset = queryset.filter(
+                Q(**{f'{rank_field}__lt': rank})
+                | Q(**{rank_field: rank, f'{pk_field}__lt': pk})
+            )
+        results = list(queryset[:limit + 1])
+        self.page = results[:limit]
+        self.has_next = len(results) > limit
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return self.parse_position(
+                *json.loads(base64.urlsafe_b64decode(encoded))
+            )
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_position(self, rank, pk):
+        return float(rank), int(pk)
+
+    def get_position(self):
+        """Позиция последнего объекта страницы для курсора."""
+        last = self.page[-1]
+        return [getattr(last, RANK_FIELD), last.pk]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = json.dumps(self.get_position())
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            base64.urlsafe_b64encode(position.encode()).decode()
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
+
+
+class FeedKeysetPagination(RankKeysetPagination):
+    """
+    Пагинация ленты подписок по курсору.
+    Позиция -- пара (pub_date, id) последнего рецепта страницы.
+    Пары страницы собирает FeedTimeline.get_page из записей ленты
+    и рецептов популярных авторов, затем рецепты выбираются
+    из queryset по id.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_page_size(request)
+        rows = FeedTimeline.get_page(request.user.id,
+                                     self.decode_cursor(request), limit + 1)
+        self.has_next = len(rows) > limit
+        self.rows = rows[:limit]
+        recipes = queryset.in_bulk([recipe_id for _, recipe_id in self.rows])
+        self.page = [recipes[recipe_id] for _, recipe_id in self.rows
+                     if recipe_id in recipes]
+        return self.page
+
+    def parse_position(self, pub_date, pk):
+        pub_date = parse_datetime(pub_date)
+        if pub_date is None:
+            raise ValueError
+        return pub_date, int(pk)
+
+    def get_position(self):
+        pub_date, pk = self.rows[-1]
+        return [pub_date.isoformat(), pk]
 
 
 class CustomPagination(PageNumberPagination):
     """
     Кастомная пагинация.
+    Параметры:
+        - page=<int> - Номер страницы
+        - limit=<int> - Количество объектов на странице (не более 100)
+        - cursor=<str> - Пагинация по курсору вместо номера страницы.
+            Для первой страницы передается пустое значение: cursor=
+    Выборка, упорядоченная по рейтингу или релевантности поиска
+    (аннотация RANK_FIELD), разбивается на страницы курсором
+    rank_pagination_class.
     """
     page_size_query_param = 'limit'
-    page_size = 6
+    page_size = PaginationConstants.PAGE_SIZE
+    max_page_size = PaginationConstants.MAX_PAGE_SIZE
+    cursor_pagination_class = KeysetPagination
+    rank_pagination_class = RankKeysetPagination
+
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_param = self.cursor_pagination_class.cursor_query_param
+        if (cursor_param in request.query_params
+                and isinstance(queryset, QuerySet)):
+            if RANK_FIELD in queryset.query.annotations:
+                self.cursor_paginator = self.rank_pagination_class()
+            else:
+                self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
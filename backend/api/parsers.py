@@ -0,0 +1,59 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import (DataAndFiles,
+                                    FileUploadParser,
+                                    MultiPartParser)
+
+from foodgram_backend.constants import RecipeImageConstants
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """
+    Парсер multipart/form-data для создания и редактирования рецептов.
+    Поля рецепта передаются в JSON в части data, изображение -- файлом
+    в части image, без кодирования в base64.
+    Без части data поля формы используются как есть.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        result = super().parse(stream, media_type, parser_context)
+        if 'data' not in result.data:
+            return result
+        try:
+            data = json.loads(result.data['data'])
+        except ValueError as exc:
+            raise ParseError(f'Некорректный JSON в поле data: {exc}')
+        if not isinstance(data, dict):
+            raise ParseError('Поле data должно содержать JSON-объект.')
+        return DataAndFiles(data, result.files.dict())
+
+
+class ImageUploadParser(FileUploadParser):
+    """
+    Парсер изображения, переданного телом запроса без кодирования.
+    Имя файла определяется по Content-Type, если оно не указано
+    в Content-Disposition.
+    """
+
+    media_type = 'image/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        meta = parser_context['request'].META
+        try:
+            content_length = int(meta.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > RecipeImageConstants.MAX_SIZE:
+            raise ParseError(
+                f'Размер изображения больше {RecipeImageConstants.MAX_SIZE} '
+                'байт.'
+            )
+        return super().parse(stream, media_type, parser_context)
+
+    def get_filename(self, stream, media_type, parser_context):
+        filename = super().get_filename(stream, media_type, parser_context)
+        if filename:
+            return filename
+        ext = media_type.split(';')[0].split('/')[-1].strip()
+        return f'image.{ext}'
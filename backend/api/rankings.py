@@ -0,0 +1,127 @@
+"""
+Рейтинги рецептов для сортировки ordering=popular и ordering=trending.
+Рейтинги хранятся в RecipeScore и изменяются на вес события при
+добавлении и удалении рецепта из избранного и списка покупок, поэтому
+сортировка читает индекс (рейтинг, id) без подсчета добавлений.
+Рейтинг trending хранится как логарифм суммы затухающих весов
+относительно RankingConstants.EPOCH: затухание общее для всех рецептов
+и не меняет порядок, поэтому старые рейтинги не пересчитываются.
+"""
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from foodgram_backend.constants import RankingConstants
+from recipes.models import Favorites, RecipeScore, ShoppingList
+
+RANK_FIELD = 'score_rank'
+RANKINGS = ('popular', 'trending')
+
+
+def get_time_key(moment) -> float:
+    """Время от EPOCH в единицах TRENDING_HALF_LIFE."""
+    return ((moment - RankingConstants.EPOCH).total_seconds()
+            / RankingConstants.TRENDING_HALF_LIFE)
+
+
+def change_trending(key: float, weight: float, moment) -> float:
+    """
+    Рейтинг trending после события веса weight в момент moment:
+    log2(2 ** key + weight * 2 ** get_time_key(moment)).
+    Отрицательный вес вычитается, рейтинг не опускается ниже 0.
+    """
+    if weight > 0:
+        event = get_time_key(moment) + math.log2(weight)
+        if key <= 0:
+            return event
+        high, low = max(key, event), min(key, event)
+        return high + math.log2(1 + 2 ** (low - high))
+    event = get_time_key(moment) + math.log2(-weight)
+    if key <= 0 or event >= key:
+        return 0.0
+    return max(key + math.log2(1 - 2 ** (event - key)), 0.0)
+
+
+def rank_recipes(queryset, ranking: str):
+    """
+    Рецепты по убыванию рейтинга ranking из RANKINGS.
+    Сортировка и курсор пагинации используют столбцы RecipeScore
+    (рейтинг, recipe) напрямую, поэтому страница читается из индекса
+    (рейтинг, recipe). RecipeScore есть у каждого рецепта (сигнал
+    create_recipe_score, миграция 0010 и команда refresh_rankings),
+    соединение внутреннее.
+    """
+    return queryset.filter(score__isnull=False).annotate(
+        **{RANK_FIELD: F(f'score__{ranking}')}
+    ).order_by(f'-score__{ranking}', '-score__recipe_id')
+
+
+class RecipeRanking:
+    """Изменение и расчет рейтингов RecipeScore."""
+
+    WEIGHTS = {
+        Favorites: RankingConstants.FAVORITE_WEIGHT,
+        ShoppingList: RankingConstants.SHOPPING_CART_WEIGHT,
+    }
+
+    @classmethod
+    def change(cls, model, added=(), removed=(), moment=None):
+        """
+        Изменение рейтингов рецептов, добавленных в избранное или список
+        покупок (model) и удаленных из них.
+        added и removed -- id рецептов или {id: время добавления},
+        moment -- время добавления рецептов, переданных без него,
+        по умолчанию текущее. Вес удаленного рецепта вычитается в момент
+        его добавления, иначе рейтинг trending занижается.
+        """
+        moment = moment or timezone.now()
+        events = defaultdict(list)
+        for sign, recipes in ((1, added), (-1, removed)):
+            if not isinstance(recipes, dict):
+                recipes = dict.fromkeys(recipes, moment)
+            for recipe_id, added_date in recipes.items():
+                events[recipe_id].append((sign, added_date))
+        if not events:
+            return
+        weight = cls.WEIGHTS[model]
+        with transaction.atomic():
+            scores = RecipeScore.objects.select_for_update().in_bulk(
+                events.keys()
+            )
+            for recipe_id, score in scores.items():
+                for sign, event_moment in events[recipe_id]:
+                    delta = sign * weight
+                    score.popular = max(score.popular + delta, 0.0)
+                    score.trending = change_trending(score.trending, delta,
+                                                     event_moment)
+            RecipeScore.objects.bulk_update(scores.values(),
+                                            ('popular', 'trending'))
+
+    @classmethod
+    def calculate(cls):
+        """
+        Расчет рейтингов по таблицам избранного и списков покупок.
+        Возвращает {recipe_id: (popular, trending)}.
+        """
+        now = get_time_key(timezone.now())
+        popular = defaultdict(float)
+        decayed = defaultdict(float)
+        for model, weight in cls.WEIGHTS.items():
+            for recipe_id, added_date in model.objects.values_list(
+                'recipe_id', 'added_date'
+            ).iterator():
+                popular[recipe_id] += weight
+                decayed[recipe_id] += weight * 2 ** (
+                    get_time_key(added_date) - now
+                )
+        return {
+            recipe_id: (
+                popular[recipe_id],
+                now + math.log2(decayed[recipe_id])
+                if decayed[recipe_id] > 0 else 0.0
+            )
+            for recipe_id in popular
+        }
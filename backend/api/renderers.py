@@ -0,0 +1,108 @@
+import csv
+import json
+from functools import lru_cache
+
+from art import text2art
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+@lru_cache(maxsize=None)
+def get_banner():
+    """Заголовок списка покупок, вычисляется один раз за процесс."""
+    return text2art('Foodgram\n\n', font='small')
+
+
+class EchoBuffer:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+    Метод stream возвращает генератор частей файла, поэтому
+    список покупок отдается потоком без сборки в памяти.
+    Ответы с ошибками отдаются в JSON (RecipeViewSet.finalize_response).
+    """
+
+    charset = 'utf-8'
+
+    def stream(self, user, items):
+        raise NotImplementedError(
+            'Метод stream() должен быть переопределен.'
+        )
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    """
+    Список покупок в формате .txt.
+    Пример:
+        Список покупок для @<username>.
+
+        ◻︎ бараний окорок на косточке --------- 10 кусок
+        ◻︎ масло грецкого ореха --------------- 50 ч. л.
+        ◻︎ персики консервированные ----------- 10 г
+    """
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+    separator = '-'
+    base_len_separator = 35
+
+    def stream(self, user, items):
+        yield get_banner()
+        yield f'Список покупок для @{user.username}.\n\n'
+        for item in items:
+            item_len_separator = self.base_len_separator - len(item['name'])
+            yield (
+                f'◻︎ {item["name"]} '
+                f'{self.separator * item_len_separator} '
+                f'{item["amount"]} '
+                f'{item["measurement_unit"]}\n'
+            )
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """Список покупок в формате .csv."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+
+    fields = ('name', 'measurement_unit', 'amount')
+
+    def stream(self, user, items):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(self.fields)
+        for item in items:
+            yield writer.writerow([item[field] for field in self.fields])
+
+
+class ShoppingListJSONRenderer(JSONRenderer):
+    """Список покупок в формате .json."""
+
+    charset = 'utf-8'
+
+    def stream(self, user, items):
+        yield '['
+        for number, item in enumerate(items):
+            if number:
+                yield ','
+            yield json.dumps(item, ensure_ascii=False)
+        yield ']'
+
+
+class PrometheusRenderer(BaseRenderer):
+    """Текстовый формат метрик Prometheus."""
+
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(f'# {key}: {value}'
+                             for key, value in data.items())
+        return str(data).encode(self.charset)
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.urls import Resolver404, resolve
+from rest_framework.permissions import SAFE_METHODS
+
+from api.async_views import sync_to_async
+
+# База данных для чтения в текущем запросе, None -- основная.
+read_database = ContextVar('read_database', default=None)
+
+
+@contextmanager
+def read_from(alias):
+    """Чтение из базы alias внутри блока."""
+    token = read_database.set(alias)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def read_primary_if_changed(changed_at: float):
+    """
+    Чтение из основной базы внутри блока, если данные изменились
+    в момент changed_at (с) меньше REPLICA_PIN_SECONDS секунд назад:
+    реплика может еще не получить изменения, а ответ сохраняется в кэше
+    и получает ETag новой версии данных.
+    """
+    if (read_database.get() is not None
+            and time.time() - changed_at < settings.REPLICA_PIN_SECONDS):
+        return read_from(None)
+    return nullcontext()
+
+
+class ReplicaRouter:
+    """
+    Чтение из реплики, выбранной ReplicaMiddleware для запроса,
+    запись и чтение вне таких запросов -- в основную базу.
+    Данные аутентификации (PRIMARY_MODELS) всегда читаются из основной
+    базы: токен, созданный при входе, мог еще не дойти до реплики,
+    и первый запрос с ним получил бы 401.
+    """
+
+    PRIMARY_MODELS = {'authtoken.Token', 'sessions.Session',
+                      settings.AUTH_USER_MODEL}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label in self.PRIMARY_MODELS:
+            return None
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база.
+        return True
+
+
+def get_pin_key(request):
+    """Ключ закрепления за основной базой по заголовку Authorization."""
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    digest = hashlib.sha1(authorization.encode()).hexdigest()
+    return f'replica-pin:{digest}'
+
+
+class ReplicaMiddleware:
+    """
+    Выбор базы данных для чтения.
+    Запросы безопасными методами к представлениям с атрибутом
+    read_from_replica = True читают из случайной реплики
+    из DATABASE_REPLICAS. После запроса изменяющим методом клиент
+    с тем же заголовком Authorization REPLICA_PIN_SECONDS секунд читает
+    из основной базы и видит свои изменения, даже если реплика отстает.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Как в django.utils.deprecation.MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with read_from(self.get_read_database(request)):
+            response = self.get_response(request)
+        self.pin(request)
+        return response
+
+    async def __acall__(self, request):
+        alias = await sync_to_async(self.get_read_database)(request)
+        with read_from(alias):
+            response = await self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            await sync_to_async(self.pin)(request)
+        return response
+
+    @staticmethod
+    def get_read_database(request):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or request.method not in SAFE_METHODS:
+            return None
+        try:
+            match = resolve(request.path_info,
+                            getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+        view_class = getattr(match.func, 'cls', None)
+        if not getattr(view_class, 'read_from_replica', False):
+            return None
+        key = get_pin_key(request)
+        if key is not None and cache.get(key):
+            return None
+        return random.choice(replicas)
+
+    @staticmethod
+    def pin(request):
+        key = get_pin_key(request)
+        if key is not None and request.method not in SAFE_METHODS:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
@@ -0,0 +1,114 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from api.rankings import RANK_FIELD
+from foodgram_backend.constants import SearchConstants
+
+# Триггеры синхронизации FTS5-таблицы с recipes_recipe для SQLite.
+# Создаются миграцией recipes.0008_recipe_search и восстанавливаются
+# после каждой миграции: SQLite пересоздает таблицу при изменении
+# схемы, и триггеры старой таблицы удаляются вместе с ней.
+SQLITE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON recipes_recipe
+    BEGIN
+        INSERT INTO {fts}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON recipes_recipe
+    BEGIN
+        INSERT INTO {fts}({fts}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {fts}_au
+    AFTER UPDATE OF name, text ON recipes_recipe
+    BEGIN
+        INSERT INTO {fts}({fts}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {fts}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+)
+
+
+def ensure_sqlite_search_index(using):
+    """Восстановление триггеров FTS5 и перестроение индекса при их потере."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    fts = SearchConstants.SQLITE_FTS_TABLE
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = 'recipes_recipe' AND name LIKE %s",
+            (f'{fts}_a_',)
+        )
+        if cursor.fetchone()[0] == len(SQLITE_TRIGGERS):
+            return
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name = %s", (fts,)
+        )
+        if not cursor.fetchone()[0]:
+            return
+        for trigger in SQLITE_TRIGGERS:
+            cursor.execute(trigger.format(fts=fts))
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def get_fts_query(query):
+    """
+    Запрос FTS5 из пользовательской строки: все слова обязательны
+    и ищутся по началу, служебный синтаксис FTS5 не используется.
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query))
+
+
+def search_recipes(queryset, query):
+    """
+    Полнотекстовый поиск рецептов по названию и описанию.
+    Результаты упорядочены по релевантности, затем от новых рецептов
+    к старым, название весит больше описания. Релевантность
+    аннотируется полем RANK_FIELD, как рейтинг в api.rankings, поэтому
+    курсор страниц -- пара (релевантность, id).
+    PostgreSQL использует столбец search_vector с GIN-индексом,
+    SQLite -- таблицу FTS5, остальные базы -- поиск подстроки.
+    """
+    vendor = connections[queryset.db].vendor
+    table = queryset.model._meta.db_table
+    if vendor == 'postgresql':
+        tsquery = 'websearch_to_tsquery(%s, %s)'
+        params = (SearchConstants.POSTGRES_CONFIG, query)
+        queryset = queryset.filter(RawSQL(
+            f'"{table}"."search_vector" @@ {tsquery}', params,
+            output_field=BooleanField()
+        )).annotate(**{RANK_FIELD: RawSQL(
+            f'ts_rank("{table}"."search_vector", {tsquery})', params,
+            output_field=FloatField()
+        )})
+    elif vendor == 'sqlite':
+        fts_query = get_fts_query(query)
+        if not fts_query:
+            return queryset.none()
+        fts = SearchConstants.SQLITE_FTS_TABLE
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', (fts_query,)
+        )).annotate(**{RANK_FIELD: RawSQL(
+            f'(SELECT -bm25({fts}, %s, %s) FROM {fts} '
+            f'WHERE {fts} MATCH %s AND rowid = "{table}"."id")',
+            (SearchConstants.NAME_WEIGHT, SearchConstants.TEXT_WEIGHT,
+             fts_query),
+            output_field=FloatField()
+        )})
+    else:
+        queryset = queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        ).annotate(**{RANK_FIELD: Value(0.0, output_field=FloatField())})
+    return queryset.order_by(f'-{RANK_FIELD}', '-id')
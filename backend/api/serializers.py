@@ -1,6 +1,13 @@
+from operator import attrgetter
+
+from django.db import transaction
 from rest_framework import serializers
 
 from api.fields import Base64ImageField
+from api.services import ShoppingListAggregator
+from api.signals import recipe_ingredients_changed
+from foodgram_backend.constants import (CookableConstants,
+                                        UserRecipesConstants)
 from recipes.models import (Recipe,
                             Ingredient,
                             Tag,
@@ -48,7 +55,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     """
     Представление рецептов.
     Поля is_favorited и is_in_shopping_cart получены с помощью
-    дополнительных методов.
+    дополнительных методов. Если рецепт получен из аннотированной
+    выборки, используются готовые значения без запросов к базе.
     """
 
     tags = TagSerializer(many=True, read_only=True)
@@ -66,17 +74,89 @@ class RecipeReadSerializer(serializers.ModelSerializer):
                   'is_favorited', 'is_in_shopping_cart', 'name',
                   'image', 'text', 'cooking_time')
 
-    def get_extra_field(self, obj, model):
+    def get_extra_field(self, obj, model, field_name):
+        annotated_value = getattr(obj, field_name, None)
+        if annotated_value is not None:
+            return annotated_value
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return model.objects.filter(recipe=obj, user=request.user).exists()
 
     def get_is_favorited(self, obj):
-        return self.get_extra_field(obj=obj, model=Favorites)
+        return self.get_extra_field(
+            obj=obj, model=Favorites, field_name='is_favorited'
+        )
 
     def get_is_in_shopping_cart(self, obj):
-        return self.get_extra_field(obj=obj, model=ShoppingList)
+        return self.get_extra_field(
+            obj=obj, model=ShoppingList, field_name='is_in_shopping_cart'
+        )
+
+
+class RecipeFastReadSerializer(serializers.BaseSerializer):
+    """
+    Быстрое представление рецептов для list и retrieve.
+    Возвращает те же данные, что RecipeReadSerializer, но строит словари
+    из атрибутов заранее загруженных объектов одним вызовом attrgetter
+    на объект, без полей DRF для каждого значения. Поля берутся
+    из Meta.fields сериализаторов тегов, пользователей и ингредиентов.
+    """
+
+    tag_fields = TagSerializer.Meta.fields
+    author_fields = tuple(field for field in UserReadSerializer.Meta.fields
+                          if field != 'is_subscribed')
+    ingredient_fields = tuple(
+        field for field in RecipeIngredientReadSerializer.Meta.fields
+        if field != 'amount'
+    )
+
+    get_tag_values = attrgetter(*tag_fields)
+    get_author_values = attrgetter(*author_fields)
+    get_ingredient_values = attrgetter(*ingredient_fields)
+
+    get_extra_field = RecipeReadSerializer.get_extra_field
+    get_is_subscribed = UserReadSerializer.get_is_subscribed
+
+    def to_representation(self, recipe):
+        return {
+            'id': recipe.id,
+            'tags': [dict(zip(self.tag_fields, self.get_tag_values(tag)))
+                     for tag in recipe.tags.all()],
+            'author': self.get_author(recipe.author),
+            'ingredients': [
+                {**dict(zip(self.ingredient_fields,
+                            self.get_ingredient_values(item.ingredient))),
+                 'amount': item.amount}
+                for item in recipe.recipe_ingredient.all()
+            ],
+            'is_favorited': self.get_extra_field(
+                obj=recipe, model=Favorites, field_name='is_favorited'
+            ),
+            'is_in_shopping_cart': self.get_extra_field(
+                obj=recipe, model=ShoppingList,
+                field_name='is_in_shopping_cart'
+            ),
+            'name': recipe.name,
+            'image': self.get_image(recipe.image),
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+        }
+
+    def get_author(self, author):
+        data = dict(zip(self.author_fields, self.get_author_values(author)))
+        data['is_subscribed'] = self.get_is_subscribed(author)
+        return data
+
+    def get_image(self, image):
+        """Ссылка на изображение, как у serializers.ImageField."""
+        if not image:
+            return None
+        url = image.url
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
 
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
@@ -157,8 +237,16 @@ class RecipeCreateSerializer(RecipeReadSerializer):
         recipe = super().create(validated_data)
         recipe.tags.set(tags)
         self.add_ingredients(recipe=recipe, ingredients=ingredients)
+        recipe_ingredients_changed.send(
+            sender=Recipe,
+            recipe=recipe,
+            old_amounts={},
+            new_amounts={ingredient['id'].id: ingredient['amount']
+                         for ingredient in ingredients}
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, instance: Recipe, validated_data: dict):
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
@@ -168,9 +256,16 @@ class RecipeCreateSerializer(RecipeReadSerializer):
         else:
             raise serializers.ValidationError({'tags': 'Не указаны.'})
         if ingredients:
+            old_amounts = ShoppingListAggregator.get_amounts(instance.id)
             instance.ingredients.clear()
             RecipeIngredient.objects.filter(recipe=instance).delete()
             self.add_ingredients(recipe=instance, ingredients=ingredients)
+            recipe_ingredients_changed.send(
+                sender=Recipe,
+                recipe=instance,
+                old_amounts=old_amounts,
+                new_amounts=ShoppingListAggregator.get_amounts(instance.id)
+            )
         else:
             raise serializers.ValidationError({'ingredients': 'Не указаны.'})
         return super().update(instance, validated_data)
@@ -180,6 +275,41 @@ class RecipeCreateSerializer(RecipeReadSerializer):
         return serializer.data
 
 
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Загрузка изображения рецепта."""
+
+    image = Base64ImageField(required=True)
+
+    class Meta:
+        model = Recipe
+        fields = ('image',)
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=CookableConstants.MAX_INGREDIENTS
+    )
+    missing = serializers.IntegerField(
+        min_value=0,
+        max_value=CookableConstants.MAX_MISSING,
+        default=0
+    )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного изменения избранного/покупок."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=UserRecipesConstants.MAX_BULK_RECIPES
+    )
+
+
 class FavoritesSerializer(serializers.ModelSerializer):
     """Добавление в избранное репрезентации рецептов."""
 
@@ -1,57 +1,506 @@
-from art import text2art
-from django.db.models import Sum
+import heapq
+from collections import defaultdict
 
-from recipes.models import RecipeIngredient
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import (BooleanField, Count, Exists, F, OuterRef, Q,
+                              Sum, Value, Window)
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from foodgram_backend.constants import FeedConstants, ShoppingListConstants
+from recipes.models import (FeedEntry,
+                            Recipe,
+                            RecipeIngredient,
+                            ShoppingList,
+                            ShoppingListIngredient)
+from users.models import Follow
+
+User = get_user_model()
+
+
+def annotate_is_subscribed(queryset, user):
+    """
+    Аннотация поля is_subscribed для выборки пользователей.
+    Для анонимного пользователя значение всегда False.
+    """
+    if user.is_anonymous:
+        return queryset.annotate(
+            is_subscribed=Value(False, output_field=BooleanField())
+        )
+    return queryset.annotate(
+        is_subscribed=Exists(
+            Follow.objects.filter(user=user, following=OuterRef('pk'))
+        )
+    )
+
+
+def get_recipes_by_author(author_ids, limit=None):
+    """
+    Последние рецепты авторов одним запросом.
+    При указании limit для каждого автора выбирается не больше limit
+    рецептов с помощью ROW_NUMBER() OVER (PARTITION BY author).
+    Возвращает {author_id: [Recipe, ...]}.
+    """
+    recipes = Recipe.objects.filter(author_id__in=author_ids).only(
+        'id', 'name', 'image', 'cooking_time', 'author_id'
+    )
+    if limit is None:
+        recipes = recipes.order_by('author_id', '-pub_date', '-id')
+    else:
+        ranked = recipes.annotate(recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc())
+        )).order_by()
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            'WHERE ranked.recipe_rank <= %s '
+            'ORDER BY ranked.author_id, ranked.recipe_rank',
+            (*params, limit)
+        )
+    recipes_by_author = defaultdict(list)
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    return recipes_by_author
+
+
+def supports_returning() -> bool:
+    """Поддержка INSERT/DELETE ... RETURNING текущей базой данных."""
+    if connection.vendor == 'postgresql':
+        return True
+    return (connection.vendor == 'sqlite'
+            and connection.Database.sqlite_version_info >= (3, 35))
+
+
+def add_user_recipes(model, user_id: int, recipe_ids) -> dict:
+    """
+    Добавление рецептов в избранное/список покупок одним запросом
+    INSERT ... ON CONFLICT DO NOTHING.
+    Несуществующие и уже добавленные рецепты пропускаются.
+    Возвращает {id действительно добавленного рецепта: время добавления}.
+    Сигналы post_save не отправляются.
+    """
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return {}
+    if not supports_returning():
+        # bulk_create с ignore_conflicts возвращает и пропущенные объекты,
+        # поэтому добавленными считаются строки с временем добавления,
+        # записанным этим вызовом.
+        existing_ids = Recipe.objects.filter(
+            id__in=recipe_ids
+        ).values_list('id', flat=True)
+        with transaction.atomic():
+            objs = model.objects.bulk_create(
+                (model(user_id=user_id, recipe_id=recipe_id)
+                 for recipe_id in existing_ids),
+                ignore_conflicts=True
+            )
+            created = {(obj.recipe_id, obj.added_date) for obj in objs}
+            return dict(row for row in model.objects.filter(
+                user_id=user_id, recipe_id__in=recipe_ids
+            ).values_list('recipe_id', 'added_date') if row in created)
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    added_date = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} '
+            '(user_id, recipe_id, added_date) '
+            f'SELECT %s, id, %s FROM {quote(Recipe._meta.db_table)} '
+            f'WHERE id IN ({placeholders}) '
+            'ON CONFLICT DO NOTHING RETURNING recipe_id',
+            (user_id, added_date, *recipe_ids)
+        )
+        return {row[0]: added_date for row in cursor.fetchall()}
+
+
+def remove_user_recipes(model, user_id: int, recipe_ids=None) -> dict:
+    """
+    Удаление рецептов из избранного/списка покупок одним запросом.
+    Без recipe_ids удаляются все рецепты пользователя.
+    Возвращает {id действительно удаленного рецепта: время добавления}.
+    Сигналы pre_delete и post_delete не отправляются.
+    """
+    queryset = model.objects.filter(user_id=user_id)
+    if recipe_ids is not None:
+        recipe_ids = sorted(set(recipe_ids))
+        if not recipe_ids:
+            return {}
+        queryset = queryset.filter(recipe_id__in=recipe_ids)
+    if not supports_returning():
+        removed = dict(queryset.values_list('recipe_id', 'added_date'))
+        queryset._raw_delete(queryset.db)
+        return removed
+    quote = connection.ops.quote_name
+    sql = f'DELETE FROM {quote(model._meta.db_table)} WHERE user_id = %s'
+    params = [user_id]
+    if recipe_ids is not None:
+        sql += f' AND recipe_id IN ({", ".join(["%s"] * len(recipe_ids))})'
+        params += recipe_ids
+    # Даты из курсора приводятся так же, как при чтении через ORM.
+    added_date = model._meta.get_field('added_date').get_col(
+        model._meta.db_table
+    )
+    converters = connection.ops.get_db_converters(added_date)
+    removed = {}
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING recipe_id, added_date', params)
+        for recipe_id, value in cursor.fetchall():
+            for converter in converters:
+                value = converter(value, added_date, connection)
+            removed[recipe_id] = value
+    return removed
 
 
 class ShoppingListCreator:
     """
     Создание списка покупок.
-    Пример:
-        Список покупок для @<username>.
-
-        ◻︎ бараний окорок на косточке --------- 10 кусок
-        ◻︎ масло грецкого ореха --------------- 50 ч. л.
-        ◻︎ персики консервированные ----------- 10 г
-        """
+    Суммы ингредиентов читаются из ShoppingListIngredient
+    и передаются рендереру построчно.
+    """
 
     def __init__(self, user):
         self.user = user
 
-    def __get_data(self):
+    def get_items(self):
         """
-        Получение ингредиентов и суммирование количества дублей.
+        Получение суммарного количества ингредиентов списка покупок.
         """
-        shopping_list_data = RecipeIngredient.objects.filter(
-            recipe__shop_list__user=self.user
+        shopping_list_data = ShoppingListIngredient.objects.filter(
+            user=self.user,
+            amount__gt=0
         ).values(
             'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            sum_amount=Sum(
-                'amount',
-                distinct=True
+            'ingredient__measurement_unit',
+            'amount'
+        ).order_by('ingredient__name')
+        for item in shopping_list_data.iterator():
+            yield {
+                'name': item['ingredient__name'],
+                'measurement_unit': item['ingredient__measurement_unit'],
+                'amount': item['amount'],
+            }
+
+    def render(self, renderer, prefetch=False):
+        """
+        Создание списка покупок.
+        Возвращает генератор частей файла в формате рендерера.
+        При prefetch строки читаются из базы сразу, и генератор только
+        форматирует их, не обращаясь к базе данных.
+        """
+        items = self.get_items()
+        if prefetch:
+            items = list(items)
+        return renderer.stream(self.user, items)
+
+
+class ShoppingListAggregator:
+    """
+    Поддержка суммарного количества ингредиентов в списках покупок.
+    Суммы изменяются на разницу количеств ингредиентов при добавлении
+    и удалении рецепта из списка покупок и при изменении
+    ингредиентов рецепта, без пересчета всего списка.
+    """
+
+    @staticmethod
+    def get_amounts(recipe_id: int) -> dict:
+        """Количество ингредиентов рецепта: {ingredient_id: amount}."""
+        return dict(RecipeIngredient.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount'))
+
+    @classmethod
+    def add_recipe(cls, user_id: int, recipe_id: int):
+        cls.apply(user_ids=[user_id], delta=cls.get_amounts(recipe_id))
+
+    @classmethod
+    def remove_recipe(cls, user_id: int, recipe_id: int):
+        cls.apply(
+            user_ids=[user_id],
+            delta={ingredient_id: -amount for ingredient_id, amount
+                   in cls.get_amounts(recipe_id).items()}
+        )
+
+    @classmethod
+    def change_user_recipes(cls, user_id: int, added=(), removed=()):
+        """Добавление и удаление нескольких рецептов списка покупок."""
+        delta = defaultdict(int)
+        added = set(added)
+        amounts = RecipeIngredient.objects.filter(
+            recipe_id__in=added | set(removed)
+        ).values_list('recipe_id', 'ingredient_id', 'amount')
+        for recipe_id, ingredient_id, amount in amounts:
+            delta[ingredient_id] += amount if recipe_id in added else -amount
+        cls.apply(user_ids=[user_id], delta=delta)
+
+    @staticmethod
+    def clear(user_id: int):
+        """Удаление всех сумм ингредиентов пользователя одним запросом."""
+        ShoppingListIngredient.objects.filter(user_id=user_id).delete()
+
+    @classmethod
+    def change_recipe(cls, recipe_id: int, old_amounts: dict,
+                      new_amounts: dict):
+        """Изменение ингредиентов рецепта в списках покупок."""
+        delta = {
+            ingredient_id: (new_amounts.get(ingredient_id, 0)
+                            - old_amounts.get(ingredient_id, 0))
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        user_ids = list(ShoppingList.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True))
+        cls.apply(user_ids=user_ids, delta=delta)
+
+    @staticmethod
+    def apply(user_ids: list, delta: dict):
+        """
+        Изменение сумм ингредиентов пользователей на delta.
+        delta -- {ingredient_id: изменение количества}.
+        Суммы изменяются запросом INSERT ... ON CONFLICT DO UPDATE:
+        строки, которых еще нет, нельзя заблокировать select_for_update,
+        и одновременные добавления одного ингредиента иначе нарушают
+        ограничение уникальности.
+        """
+        delta = {key: value for key, value in delta.items() if value}
+        if not user_ids or not delta:
+            return
+        quote = connection.ops.quote_name
+        table = quote(ShoppingListIngredient._meta.db_table)
+        rows = [(user_id, ingredient_id, amount)
+                for user_id in sorted(set(user_ids))
+                for ingredient_id, amount in sorted(delta.items())]
+        batch_size = ShoppingListConstants.UPSERT_BATCH_SIZE
+        with transaction.atomic(), connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(
+                    f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                    f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                    'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+                    f'SET amount = {table}.amount + EXCLUDED.amount',
+                    [value for row in batch for value in row]
+                )
+            if any(amount < 0 for amount in delta.values()):
+                ShoppingListIngredient.objects.filter(
+                    user_id__in=user_ids,
+                    ingredient_id__in=delta.keys(),
+                    amount__lte=0
+                ).delete()
+
+    @staticmethod
+    def calculate():
+        """
+        Расчет сумм ингредиентов всех списков покупок по рецептам.
+        Возвращает {(user_id, ingredient_id): amount}.
+        """
+        return {
+            (item['recipe__shop_list__user'], item['ingredient']):
+                item['total']
+            for item in RecipeIngredient.objects.filter(
+                recipe__shop_list__isnull=False
+            ).values(
+                'recipe__shop_list__user', 'ingredient'
+            ).annotate(total=Sum('amount')).order_by().iterator()
+        }
+
+
+class FeedTimeline:
+    """
+    Ленты подписок: гибридная схема push/pull.
+    Рецепт автора, у которого меньше FeedConstants.PULL_FOLLOWERS
+    подписчиков, записывается в ленты всех подписчиков при публикации
+    (FeedEntry). Рецепты популярных авторов в ленты не записываются,
+    а добавляются к странице при чтении.
+    """
+
+    @staticmethod
+    def is_pushed(author_id: int) -> bool:
+        """Рецепты автора записываются в ленты подписчиков."""
+        return User.objects.filter(
+            pk=author_id, followers_count__lt=FeedConstants.PULL_FOLLOWERS
+        ).exists()
+
+    @staticmethod
+    def get_page(user_id: int, position, limit: int):
+        """
+        Страница ленты пользователя после позиции position -- пары
+        (pub_date, id рецепта) или None для первой страницы.
+        Возвращает не больше limit пар (pub_date, id) от новых к старым.
+        Записи ленты читаются по индексу (user, pub_date, recipe),
+        рецепты популярных авторов из подписок -- по индексу
+        (author, pub_date, id) рецептов, и обе выборки сливаются.
+        """
+        entries = FeedEntry.objects.filter(user_id=user_id)
+        pulled = Recipe.objects.filter(author_id__in=Follow.objects.filter(
+            user_id=user_id,
+            following__followers_count__gte=FeedConstants.PULL_FOLLOWERS
+        ).values('following_id'))
+        if position is not None:
+            pub_date, recipe_id = position
+            entries = entries.filter(
+                Q(pub_date__lt=pub_date)
+                | Q(pub_date=pub_date, recipe_id__lt=recipe_id)
+            )
+            pulled = pulled.filter(
+                Q(pub_date__lt=pub_date)
+                | Q(pub_date=pub_date, id__lt=recipe_id)
             )
+        rows = heapq.merge(
+            entries.order_by('-pub_date', '-recipe_id').values_list(
+                'pub_date', 'recipe_id'
+            )[:limit],
+            pulled.order_by('-pub_date', '-id').values_list(
+                'pub_date', 'id'
+            )[:limit],
+            reverse=True
         )
-        return shopping_list_data
+        page = []
+        for row in rows:
+            # Запись автора, ставшего популярным, может еще оставаться
+            # в ленте, тогда рецепт приходит из обеих выборок подряд.
+            if not page or page[-1] != row:
+                page.append(row)
+        return page[:limit]
+
+    @classmethod
+    def push_recipe(cls, recipe: Recipe):
+        """Запись нового рецепта в ленты подписчиков автора."""
+        if not cls.is_pushed(recipe.author_id):
+            return
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(FeedEntry._meta.db_table)} '
+                '(user_id, recipe_id, author_id, pub_date) '
+                'SELECT user_id, %s, %s, %s '
+                f'FROM {quote(Follow._meta.db_table)} '
+                'WHERE following_id = %s ON CONFLICT DO NOTHING',
+                (recipe.id, recipe.author_id, recipe.pub_date,
+                 recipe.author_id)
+            )
+        cls.trim(Follow.objects.filter(
+            following_id=recipe.author_id
+        ).values('user_id'))
 
-    def create_shopping_list(self):
+    @staticmethod
+    def add_author(author_id: int, follows):
         """
-        Создание списка покупок.
+        Запись последних MAX_ENTRIES рецептов автора в ленты
+        подписчиков из follows (выборка Follow автора) одним запросом
+        INSERT ... SELECT. Ленты после записи не обрезаются.
         """
-        data = self.__get_data()
-        separator = '-'
-        base_len_separator = 35
-        shop_list = text2art('Foodgram\n\n', font='small')
-        shop_list += f'Список покупок для @{self.user.username}.\n\n'
-        for item in data:
-            item_len_separator = (
-                base_len_separator - len(item["ingredient__name"])
+        recipes = Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        ).values('id', 'author_id', 'pub_date')[:FeedConstants.MAX_ENTRIES]
+        recipes_sql, recipes_params = recipes.query.sql_with_params()
+        follows_sql, follows_params = follows.filter(
+            following_id=author_id
+        ).order_by().values('user_id').query.sql_with_params()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            # WHERE перед ON CONFLICT обязателен в SQLite.
+            cursor.execute(
+                f'INSERT INTO {quote(FeedEntry._meta.db_table)} '
+                '(user_id, recipe_id, author_id, pub_date) '
+                'SELECT follows.user_id, recipes.id, recipes.author_id, '
+                f'recipes.pub_date FROM ({follows_sql}) follows '
+                f'CROSS JOIN ({recipes_sql}) recipes '
+                'WHERE true ON CONFLICT DO NOTHING',
+                (*follows_params, *recipes_params)
             )
-            shop_list += (
-                f'◻︎ {item["ingredient__name"]} '
-                f'{separator * item_len_separator} '
-                f'{item["sum_amount"]} '
-                f'{item["ingredient__measurement_unit"]}\n'
+
+    @classmethod
+    def follow(cls, user_id: int, author_id: int):
+        """Запись последних рецептов автора в ленту нового подписчика."""
+        if not cls.is_pushed(author_id):
+            return
+        cls.add_author(author_id, Follow.objects.filter(user_id=user_id))
+        cls.trim([user_id])
+
+    @staticmethod
+    def unfollow(user_id: int, author_id: int):
+        """Удаление рецептов автора из ленты бывшего подписчика."""
+        entries = FeedEntry.objects.filter(user_id=user_id,
+                                           author_id=author_id)
+        entries._raw_delete(entries.db)
+
+    @classmethod
+    def followers_changed(cls, author_id: int, delta: int):
+        """
+        Перевод автора между push и pull после изменения числа
+        подписчиков на delta.
+        Когда подписчиков становится меньше PULL_FOLLOWERS, последние
+        рецепты автора записываются в ленты всех подписчиков: раньше
+        они читались выборкой и записей в лентах нет. Когда подписчиков
+        становится PULL_FOLLOWERS, записи автора удаляются из лент.
+        """
+        followers_count = User.objects.filter(pk=author_id).values_list(
+            'followers_count', flat=True
+        ).first()
+        if followers_count is None:
+            return
+        threshold = FeedConstants.PULL_FOLLOWERS
+        before = followers_count - delta
+        follows = Follow.objects.filter(following_id=author_id)
+        if followers_count < threshold <= before:
+            cls.add_author(author_id, follows)
+            cls.trim(follows.values('user_id'))
+        elif before < threshold <= followers_count:
+            entries = FeedEntry.objects.filter(author_id=author_id)
+            entries._raw_delete(entries.db)
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """
+        Перестроение всех лент по подпискам, возвращает число записей.
+        Нужно после загрузки подписок и рецептов в обход сигналов.
+        """
+        entries = FeedEntry.objects.all()
+        entries._raw_delete(entries.db)
+        follows = Follow.objects.filter(
+            following__followers_count__lt=FeedConstants.PULL_FOLLOWERS
+        )
+        author_ids = follows.order_by('following_id').values_list(
+            'following_id', flat=True
+        ).distinct()
+        for author_id in author_ids.iterator():
+            cls.add_author(author_id, follows)
+        cls.trim(FeedEntry.objects.values('user_id'))
+        return FeedEntry.objects.count()
+
+    @staticmethod
+    def trim(user_ids):
+        """
+        Удаление записей сверх FeedConstants.MAX_ENTRIES из лент
+        пользователей user_ids (список или выборка user_id).
+        Ленты обрезаются, когда в них набирается больше
+        MAX_ENTRIES + TRIM_SLACK записей, чтобы не ранжировать
+        записи при каждой публикации.
+        """
+        overflowed = FeedEntry.objects.filter(
+            user_id__in=user_ids
+        ).values('user_id').annotate(
+            entries=Count('id')
+        ).filter(
+            entries__gt=FeedConstants.MAX_ENTRIES + FeedConstants.TRIM_SLACK
+        ).values('user_id')
+        ranked = FeedEntry.objects.filter(
+            user_id__in=overflowed
+        ).annotate(position=Window(
+            expression=RowNumber(),
+            partition_by=F('user_id'),
+            order_by=(F('pub_date').desc(), F('recipe_id').desc())
+        )).values('id', 'position').order_by()
+        sql, params = ranked.query.sql_with_params()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(FeedEntry._meta.db_table)} '
+                f'WHERE id IN (SELECT ranked.id FROM ({sql}) ranked '
+                'WHERE ranked.position > %s)',
+                (*params, FeedConstants.MAX_ENTRIES)
             )
-        return shop_list
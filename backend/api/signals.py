@@ -1,11 +1,306 @@
 # flake8: noqa
-from django.db.models.signals import post_delete
-from django.dispatch.dispatcher import receiver
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save, pre_delete)
+from django.db import transaction
+from django.dispatch.dispatcher import Signal, receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 
-from recipes.models import Recipe
+from api.async_views import run_in_background
+from api.authentication import invalidate_tokens
+from api.cache import bump_versions, user_scope
+from api.indexes import cookable_index
+from api.rankings import RecipeRanking
+from api.search import ensure_sqlite_search_index
+from api.services import FeedTimeline, ShoppingListAggregator
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            RecipeScore, ShoppingList, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+# Отправляется после замены ингредиентов рецепта.
+# Аргументы: recipe, old_amounts, new_amounts -- {ingredient_id: amount}.
+recipe_ingredients_changed = Signal()
+
+# Отправляется после пакетного изменения избранного или списка покупок,
+# sender -- Favorites или ShoppingList.
+# Аргументы: user_id, added, removed -- {id рецепта: время добавления},
+# cleared -- удалены все рецепты пользователя.
+user_recipes_changed = Signal()
 
 
 @receiver(post_delete, sender=Recipe)
 def del_image(sender, instance: Recipe, *args, **kwargs):
-    if instance.image.name:
-        instance.image.delete(False)
+    name = instance.image.name
+    if name and not Recipe.objects.filter(image=name).exists():
+        storage = instance.image.storage
+        transaction.on_commit(
+            lambda: run_in_background(storage.delete, name)
+        )
+
+
+@receiver(post_save, sender=ShoppingList)
+def add_to_shopping_list_aggregate(sender, instance: ShoppingList, created,
+                                   *args, **kwargs):
+    if created:
+        ShoppingListAggregator.add_recipe(user_id=instance.user_id,
+                                          recipe_id=instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def remove_from_shopping_list_aggregate(sender, instance: ShoppingList,
+                                        *args, **kwargs):
+    ShoppingListAggregator.remove_recipe(user_id=instance.user_id,
+                                         recipe_id=instance.recipe_id)
+
+
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def change_shopping_list_aggregate(sender, recipe: Recipe, old_amounts,
+                                   new_amounts, *args, **kwargs):
+    ShoppingListAggregator.change_recipe(recipe_id=recipe.id,
+                                         old_amounts=old_amounts,
+                                         new_amounts=new_amounts)
+
+
+@receiver(user_recipes_changed, sender=ShoppingList)
+def change_user_shopping_list_aggregate(sender, user_id, added=(),
+                                        removed=(), cleared=False,
+                                        *args, **kwargs):
+    if cleared:
+        ShoppingListAggregator.clear(user_id=user_id)
+    else:
+        ShoppingListAggregator.change_user_recipes(
+            user_id=user_id, added=added, removed=removed
+        )
+
+
+def change_counter(queryset, field_name, value):
+    """Атомарное изменение счетчика на value без чтения объекта."""
+    if value < 0:
+        queryset = queryset.filter(**{f'{field_name}__gte': -value})
+    queryset.update(**{field_name: F(field_name) + value})
+
+
+@receiver(post_save, sender=Favorites)
+def increase_favorites_count(sender, instance: Favorites, created,
+                             *args, **kwargs):
+    if created:
+        change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                       'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorites)
+def decrease_favorites_count(sender, instance: Favorites, *args, **kwargs):
+    change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                   'favorites_count', -1)
+
+
+@receiver(user_recipes_changed, sender=Favorites)
+def change_favorites_count(sender, user_id, added=(), removed=(),
+                           *args, **kwargs):
+    if added:
+        change_counter(Recipe.objects.filter(pk__in=added),
+                       'favorites_count', 1)
+    if removed:
+        change_counter(Recipe.objects.filter(pk__in=removed),
+                       'favorites_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(sender, instance: Recipe, created,
+                           *args, **kwargs):
+    if created:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance: Recipe, *args, **kwargs):
+    change_counter(User.objects.filter(pk=instance.author_id),
+                   'recipes_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def increase_followers_count(sender, instance: Follow, created,
+                             *args, **kwargs):
+    if created:
+        change_counter(User.objects.filter(pk=instance.following_id),
+                       'followers_count', 1)
+        FeedTimeline.followers_changed(instance.following_id, 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrease_followers_count(sender, instance: Follow, *args, **kwargs):
+    change_counter(User.objects.filter(pk=instance.following_id),
+                   'followers_count', -1)
+    FeedTimeline.followers_changed(instance.following_id, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(sender, instance: Recipe, created, *args, **kwargs):
+    if created:
+        RecipeScore.objects.create(recipe=instance)
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=ShoppingList)
+def increase_recipe_score(sender, instance, created, *args, **kwargs):
+    if created:
+        RecipeRanking.change(sender, added=[instance.recipe_id],
+                             moment=instance.added_date)
+
+
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=ShoppingList)
+def decrease_recipe_score(sender, instance, *args, **kwargs):
+    RecipeRanking.change(sender, removed=[instance.recipe_id],
+                         moment=instance.added_date)
+
+
+@receiver(user_recipes_changed, sender=Favorites)
+@receiver(user_recipes_changed, sender=ShoppingList)
+def change_recipe_scores(sender, user_id, added=(), removed=(),
+                         *args, **kwargs):
+    RecipeRanking.change(sender, added=added, removed=removed)
+
+
+@receiver(post_save, sender=Recipe)
+def push_recipe_to_feeds(sender, instance: Recipe, created, *args, **kwargs):
+    if created:
+        FeedTimeline.push_recipe(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance: Follow, created, *args, **kwargs):
+    if created:
+        FeedTimeline.follow(user_id=instance.user_id,
+                            author_id=instance.following_id)
+
+
+@receiver(post_delete, sender=Follow)
+def retract_feed(sender, instance: Follow, *args, **kwargs):
+    FeedTimeline.unfollow(user_id=instance.user_id,
+                          author_id=instance.following_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(recipe_ingredients_changed, sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def reset_recipes_cache(sender, *args, **kwargs):
+    bump_versions('recipes')
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def touch_recipe_by_ingredient(sender, instance: RecipeIngredient,
+                               *args, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_by_tags(sender, instance, action, reverse, pk_set,
+                         *args, **kwargs):
+    if reverse and action == 'pre_clear':
+        recipes = Recipe.objects.filter(tags=instance)
+    elif not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif reverse and action in ('post_add', 'post_remove'):
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    else:
+        return
+    recipes.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def reset_tags_cache(sender, *args, **kwargs):
+    bump_versions('tags', 'recipes')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def reset_ingredients_cache(sender, *args, **kwargs):
+    bump_versions('ingredients', 'recipes')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def reset_authors_cache(sender, update_fields=None, *args, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_versions('users', 'recipes')
+
+
+@receiver(post_delete, sender=Token)
+def reset_cached_token(sender, instance: Token, *args, **kwargs):
+    invalidate_tokens(instance.key)
+
+
+@receiver(post_save, sender=User)
+def reset_cached_user_tokens(sender, instance, update_fields=None,
+                             *args, **kwargs):
+    # Смена пароля, деактивация и другие изменения пользователя.
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_tokens(*Token.objects.filter(
+        user_id=instance.pk
+    ).values_list('key', flat=True))
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_delete, sender=Favorites)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def reset_user_versions(sender, instance, *args, **kwargs):
+    bump_versions(user_scope(instance.user_id))
+
+
+@receiver(user_recipes_changed, sender=Favorites)
+@receiver(user_recipes_changed, sender=ShoppingList)
+def reset_user_versions_by_recipes(sender, user_id, added=(), removed=(),
+                                   *args, **kwargs):
+    if added or removed:
+        bump_versions(user_scope(user_id))
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, *args, **kwargs):
+    if sender.name == 'recipes':
+        ensure_sqlite_search_index(using)
+
+
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def change_cookable_index(sender, recipe: Recipe, old_amounts, new_amounts,
+                          *args, **kwargs):
+    transaction.on_commit(lambda: cookable_index.change(
+        recipe.id,
+        added=new_amounts.keys(),
+        removed=old_amounts.keys() - new_amounts.keys()
+    ))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def add_to_cookable_index(sender, instance: RecipeIngredient, created,
+                          *args, **kwargs):
+    if created:
+        transaction.on_commit(lambda: cookable_index.change(
+            instance.recipe_id, added=(instance.ingredient_id,)
+        ))
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_from_cookable_index(sender, instance: RecipeIngredient,
+                               *args, **kwargs):
+    transaction.on_commit(lambda: cookable_index.change(
+        instance.recipe_id, removed=(instance.ingredient_id,)
+    ))
@@ -1,12 +1,54 @@
+import base64
 import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase
 
-from recipes.models import Tag, Ingredient
+from api.async_views import shutdown_executor
+from api.authentication import (CachedTokenAuthentication, get_shared_key,
+                                invalidate_tokens, token_cache)
+from api.cache import bump_versions, check_shared_cache
+from api.indexes import CookableIndex, cookable_index, ingredient_index
+from api.rankings import RecipeRanking
+from api.serializers import RecipeFastReadSerializer, RecipeReadSerializer
+from api.services import ShoppingListAggregator
+from api.views import RecipeViewSet
+from foodgram_backend.constants import FeedConstants, RankingConstants
+from foodgram_backend.db.pool import ConnectionPool, PoolTimeout, get_pool
+from recipes.models import (Tag,
+                            FeedEntry,
+                            Ingredient,
+                            Recipe,
+                            RecipeIngredient,
+                            RecipeScore,
+                            Favorites,
+                            ShoppingList,
+                            ShoppingListIngredient)
 from users.models import Follow
 
 User = get_user_model()
@@ -58,6 +100,12 @@ class TestsTags(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, self.tag_detail_response_data)
 
+    def test_get_tags_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
 
 class TestsIngredients(APITestCase):
 
@@ -106,6 +154,81 @@ class TestsIngredients(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, self.tag_detail_response_data)
 
+    def test_search_ingredients_by_prefix(self):
+        ingredient_index.invalidate()
+        self.client.get(self.url, {'name': 'к'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'name': 'КАР'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content),
+                         self.tag_list_response_data[:1])
+
+    def test_search_index_is_rebuilt_on_save(self):
+        self.client.get(self.url, {'name': 'к'})
+        Ingredient.objects.create(name='Капуста', measurement_unit='кг')
+        response = self.client.get(self.url, {'name': 'ка'})
+        self.assertEqual([item['name'] for item in response.data],
+                         ['Капуста', 'Картошка'])
+
+    def test_search_index_follows_version_from_other_process(self):
+        self.client.get(self.url, {'name': 'к'})
+        # Загрузка в другом процессе: сигналы этого процесса
+        # не отправляются, меняется только версия в общем кэше.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Капуста', measurement_unit='кг')]
+        )
+        bump_versions('ingredients')
+        response = self.client.get(self.url, {'name': 'ка'})
+        self.assertEqual([item['name'] for item in response.data],
+                         ['Капуста', 'Картошка'])
+
+
+class TestsLoadData(APITestCase):
+
+    INGREDIENTS = [{'name': 'Картошка', 'measurement_unit': 'кг'},
+                   {'name': 'Сахар', 'measurement_unit': 'г'},
+                   {'name': 'Сахар', 'measurement_unit': 'г'},
+                   {'name': 'Соль', 'measurement_unit': 'г'}]
+    TAGS = 'name,color,slug\nЗавтрак,#f5d784,breakfast\nОбед,#5dc4de,lunch\n'
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.ingredients = os.path.join(self.data_dir, 'ingredients.json')
+        self.tags = os.path.join(self.data_dir, 'tags.csv')
+        with open(self.ingredients, 'w', encoding='utf-8') as file:
+            json.dump(self.INGREDIENTS, file, ensure_ascii=False)
+        with open(self.tags, 'w', encoding='utf-8') as file:
+            file.write(self.TAGS)
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+    def load(self, *args):
+        output = StringIO()
+        call_command('loadcsvdata', '--noinput', '--batch-size', '2',
+                     '--ingredients', self.ingredients, '--tags', self.tags,
+                     *args, stdout=output)
+        return output.getvalue()
+
+    def test_load_is_idempotent(self):
+        self.load()
+        output = self.load()
+        self.assertIn('Ingredient: обработано 4, добавлено 0', output)
+        self.assertEqual(Ingredient.objects.count(), 3)
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_upsert(self):
+        self.load()
+        with open(self.tags, 'w', encoding='utf-8') as file:
+            file.write(self.TAGS.replace('#5dc4de', '#000000'))
+        self.load('--upsert')
+        self.assertEqual(Tag.objects.get(slug='lunch').color, '#000000')
+
+    def test_skip_existing(self):
+        Tag.objects.create(name='Ужин', color='#ffffff', slug='dinner')
+        output = self.load('--skip-existing')
+        self.assertIn('Tag: пропущено.', output)
+        self.assertEqual(Tag.objects.count(), 1)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
 
 class TestsFollowing(APITestCase):
 
@@ -181,3 +304,1446 @@ class TestsFollowing(APITestCase):
         )
         response = self.client.delete(self.url_first)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_followers_count(self):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_count, 1)
+        Follow.objects.filter(following=self.user).delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_count, 0)
+
+
+class TestsRecipesQueries(APITestCase):
+
+    RECIPES_COUNT = 10
+    LIST_QUERIES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('api:recipe-list')
+        cls.author = User.objects.create(
+            username='author', email='author@ya.ru'
+        )
+        cls.user = User.objects.create(username='reader', email='reader@ya.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        Follow.objects.create(user=cls.user, following=cls.author)
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                 color='#411d96')
+        ingredient = Ingredient.objects.create(name='Сахар',
+                                               measurement_unit='г')
+        for number in range(cls.RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}',
+                text='Описание',
+                image='recipes/images/test.png',
+                cooking_time=10,
+                author=cls.author
+            )
+            recipe.tags.set([tag])
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=ingredient,
+                                            amount=number + 1)
+        cls.favorite_recipe = recipe
+        Favorites.objects.create(user=cls.user, recipe=recipe)
+        ShoppingList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        for limit in (1, self.RECIPES_COUNT):
+            with self.assertNumQueries(self.LIST_QUERIES):
+                response = self.client.get(self.url, {'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_queries_for_authorized_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        with self.assertNumQueries(self.LIST_QUERIES + 1):
+            response = self.client.get(self.url,
+                                       {'limit': self.RECIPES_COUNT})
+        recipe = response.data['results'][0]
+        self.assertEqual(recipe['id'], self.favorite_recipe.id)
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertFalse(response.data['results'][1]['is_favorited'])
+
+    def test_anonymous_list_is_cached(self):
+        params = {'limit': 2, 'tags': ['lunch', 'breakfast']}
+        response = self.client.get(self.url, params)
+        with self.assertNumQueries(0):
+            cached = self.client.get(
+                self.url, {'tags': ['breakfast', 'lunch'], 'limit': 2}
+            )
+        self.assertEqual(cached.data, response.data)
+        self.favorite_recipe.name = 'Новое название'
+        self.favorite_recipe.save()
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.data['results'][0]['name'],
+                         'Новое название')
+
+    def test_cached_links_keep_request_host(self):
+        self.client.get(self.url, {'limit': 1})
+        response = self.client.get(self.url, {'limit': 1}, secure=True,
+                                   HTTP_HOST='public.example')
+        self.assertTrue(
+            response.data['next'].startswith('https://public.example/')
+        )
+
+    def test_authorized_list_is_not_cached(self):
+        self.client.get(self.url)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        with self.assertNumQueries(self.LIST_QUERIES + 1):
+            response = self.client.get(self.url)
+        self.assertTrue(response.data['results'][0]['is_favorited'])
+
+    def test_conditional_retrieve(self):
+        url = reverse('api:recipe-detail', args=(self.favorite_recipe.id,))
+        response = self.client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Last-Modified отдается, когда секунда изменения прошла.
+        self.assertNotIn('Last-Modified', response)
+        with mock.patch('api.cache.time.time', return_value=time.time() + 2):
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=self.client.get(url)[
+                    'Last-Modified'
+                ]
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.favorite_recipe.tags.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_several_workers_require_shared_cache(self):
+        with override_settings(WEB_CONCURRENCY=2):
+            with self.assertRaises(ImproperlyConfigured):
+                check_shared_cache()
+        with override_settings(
+            WEB_CONCURRENCY=2,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.'
+                                           'filebased.FileBasedCache',
+                                'LOCATION': tempfile.gettempdir()}}
+        ):
+            check_shared_cache()
+        with override_settings(DATABASE_REPLICAS=['replica'], DB_PROD=True):
+            with self.assertRaises(ImproperlyConfigured):
+                check_shared_cache()
+
+    def test_conditional_list_depends_on_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Favorites.objects.filter(user=self.user).delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['results'][0]['is_favorited'])
+
+    def test_tags_filter_without_duplicates(self):
+        lunch = Tag.objects.create(name='Обед', slug='lunch', color='#411d97')
+        self.favorite_recipe.tags.add(lunch)
+        response = self.client.get(
+            self.url, {'tags': ['breakfast', 'lunch', 'unknown'],
+                       'limit': self.RECIPES_COUNT + 1}
+        )
+        self.assertEqual(response.data['count'], self.RECIPES_COUNT)
+        self.assertEqual(len(response.data['results']), self.RECIPES_COUNT)
+        response = self.client.get(self.url, {'tags': 'lunch'})
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [self.favorite_recipe.id])
+        response = self.client.get(self.url, {'tags': 'unknown'})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_counters(self):
+        self.author.refresh_from_db()
+        self.favorite_recipe.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, self.RECIPES_COUNT)
+        self.assertEqual(self.favorite_recipe.favorites_count, 1)
+        Recipe.objects.filter(pk=self.favorite_recipe.pk).update(
+            favorites_count=5
+        )
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        output = StringIO()
+        call_command('reconcile_counters', stdout=output)
+        self.assertIn('Recipe.favorites_count: 1', output.getvalue())
+        self.favorite_recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.favorite_recipe.favorites_count, 1)
+        self.assertEqual(self.author.recipes_count, self.RECIPES_COUNT)
+
+    def test_stale_save_keeps_counters(self):
+        recipe = Recipe.objects.get(pk=self.favorite_recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        Favorites.objects.create(
+            user=User.objects.create(username='fan', email='fan@ya.ru'),
+            recipe=recipe
+        )
+        Recipe.objects.create(name='Новый', text='Описание', cooking_time=5,
+                              image='recipes/images/test.png', author=author)
+        recipe.name = 'Другое название'
+        recipe.save()
+        author.first_name = 'Автор'
+        author.save()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual((recipe.name, recipe.favorites_count),
+                         ('Другое название', 2))
+        self.assertEqual((author.first_name, author.recipes_count),
+                         ('Автор', self.RECIPES_COUNT + 1))
+
+    def test_cursor_pagination(self):
+        url = self.url + '?cursor=&limit=4'
+        ids = []
+        while url:
+            with self.assertNumQueries(self.LIST_QUERIES - 1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(
+            ids,
+            list(Recipe.objects.order_by('-pub_date', '-id')
+                 .values_list('id', flat=True))
+        )
+
+    def test_cursor_pagination_with_filters(self):
+        response = self.client.get(self.url, {'limit': 1, 'tags': 'breakfast',
+                                              'author': self.author.id,
+                                              'cursor': ''})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+
+class TestsRecipeSearch(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('api:recipe-list')
+        author = User.objects.create(username='chef', email='chef@ya.ru')
+        recipes = {}
+        for name, text in (('Борщ', 'Свекла, капуста и картофель.'),
+                           ('Салат', 'Свекла и борщевой набор овощей.'),
+                           ('Омлет', 'Яйца и молоко.')):
+            recipes[name] = Recipe.objects.create(
+                name=name, text=text, image='recipes/images/test.png',
+                cooking_time=10, author=author
+            )
+        cls.borsch = recipes['Борщ']
+        cls.salad = recipes['Салат']
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = self.client.get(self.url, {'search': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_search_ranks_name_above_text(self):
+        self.assertEqual(self.search('борщ'), [self.borsch.id, self.salad.id])
+        self.assertEqual(self.search('СВЕКЛА капуст'), [self.borsch.id])
+        self.assertEqual(self.search('"* OR'), [])
+
+    def test_search_cursor_pagination_keeps_relevance(self):
+        url, params = self.url, {'search': 'свекла', 'limit': 1,
+                                 'cursor': ''}
+        ids = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(ids, [self.borsch.id, self.salad.id])
+        response = self.client.get(self.url, {'search': 'свекла',
+                                              'ordering': 'popular'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_search_index_follows_changes(self):
+        self.salad.text = 'Огурцы.'
+        self.salad.save()
+        self.assertEqual(self.search('свекла'), [self.borsch.id])
+        self.borsch.delete()
+        self.assertEqual(self.search('свекла'), [])
+
+
+class TestsCookable(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('api:recipe-cookable')
+        cls.author = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.token = Token.objects.create(user=cls.author)
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch',
+                                     color='#411d97')
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'яйца', 'молоко', 'рыба')
+        ]
+        cls.recipes = []
+        for number, indexes in enumerate(((0, 1), (0, 1, 2), (3,), (0,))):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                image='recipes/images/test.png', author=cls.author
+            )
+            for index in indexes:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=cls.ingredients[index], amount=1
+                )
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        cookable_index.invalidate()
+
+    def search(self, indexes, missing=0):
+        response = self.client.get(self.url, {
+            'ingredients': [self.ingredients[index].id for index in indexes],
+            'missing': missing
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(recipe['id'], recipe['missing'])
+                for recipe in response.data['results']]
+
+    def test_cookable(self):
+        first, second, _, fourth = self.recipes
+        self.assertEqual(self.search((0, 1)), [(first.id, 0), (fourth.id, 0)])
+        self.assertEqual(self.search((0, 1), missing=1),
+                         [(first.id, 0), (fourth.id, 0), (second.id, 1)])
+        self.assertEqual(self.search((2,), missing=1), [])
+
+    def test_cookable_validation(self):
+        response = self.client.get(self.url, {'missing': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_concurrent_searches_build_index_once(self):
+        index = CookableIndex()
+        state = CookableIndex._build()
+
+        def build():
+            time.sleep(0.05)
+            return state
+
+        with mock.patch.object(CookableIndex, '_build',
+                               side_effect=build) as build_mock:
+            threads = [threading.Thread(target=index.search,
+                                        args=([self.ingredients[0].id],))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(build_mock.call_count, 1)
+
+    def test_cookable_index_follows_changes(self):
+        self.search((3,))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse('api:recipe-detail', args=(self.recipes[2].id,)),
+                {'ingredients': [{'id': self.ingredients[0].id,
+                                  'amount': 5}],
+                 'tags': [self.tag.id]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.search((3,)), [])
+        self.assertIn((self.recipes[2].id, 0), self.search((0,)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[3].delete()
+        self.assertNotIn(self.recipes[3].id,
+                         [recipe_id for recipe_id, _ in self.search((0,))])
+
+
+class TestsShoppingListDownload(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('api:recipe-download-shopping-cart')
+        cls.user = User.objects.create(username='buyer', email='buyer@ya.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        for number, amounts in enumerate(((100, 200), (50, 300))):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                image='recipes/images/test.png', author=cls.user
+            )
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=sugar,
+                                            amount=amounts[0])
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=milk,
+                                            amount=amounts[1])
+            ShoppingList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def download(self, **extra):
+        response = self.client.get(self.url, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_download_txt(self):
+        response, content = self.download()
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('buyer_shopping_list.txt',
+                      response['Content-Disposition'])
+        self.assertIn('Список покупок для @buyer.', content)
+        self.assertIn('◻︎ сахар ', content)
+        self.assertIn(' 150 г\n', content)
+        self.assertIn(' 500 мл\n', content)
+
+    def test_download_csv(self):
+        response, content = self.download(HTTP_ACCEPT='text/csv')
+        self.assertEqual(content.splitlines(),
+                         ['name,measurement_unit,amount',
+                          'молоко,мл,500',
+                          'сахар,г,150'])
+
+    def test_errors_are_json(self):
+        ShoppingList.objects.filter(user=self.user).delete()
+        for accept in ('text/plain', 'text/csv'):
+            response = self.client.get(self.url, HTTP_ACCEPT=accept)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(response.content),
+                             {'errors': 'Список покупок пуст.'})
+        self.client.credentials()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('detail', json.loads(response.content))
+
+    def test_aggregate_is_updated_incrementally(self):
+        recipe = Recipe.objects.first()
+        ShoppingList.objects.filter(recipe=recipe).delete()
+        response, content = self.download(HTTP_ACCEPT='text/csv')
+        self.assertEqual(len(content.splitlines()), 3)
+        self.assertNotIn(',150', content)
+        ShoppingList.objects.create(user=self.user, recipe=recipe)
+        call_command('rebuild_shopping_lists', verify=True, stdout=StringIO())
+
+    def test_aggregate_upsert(self):
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        sugar = Ingredient.objects.get(name='сахар')
+        for _ in range(2):
+            ShoppingListAggregator.apply([self.user.id],
+                                         {salt.id: 5, sugar.id: 10})
+        ShoppingListAggregator.apply([self.user.id], {salt.id: -10})
+        other = Ingredient.objects.create(name='перец', measurement_unit='г')
+        ShoppingListAggregator.apply([self.user.id], {other.id: -1})
+        self.assertEqual(
+            dict(ShoppingListIngredient.objects.filter(
+                user=self.user
+            ).values_list('ingredient__name', 'amount')),
+            {'сахар': 170, 'молоко': 500}
+        )
+
+    def test_recipe_update_changes_aggregate(self):
+        recipe = Recipe.objects.get(name='Рецепт 0')
+        sugar = Ingredient.objects.get(name='сахар')
+        response = self.client.patch(
+            reverse('api:recipe-detail', kwargs={'pk': recipe.id}),
+            {'tags': [Tag.objects.create(name='Обед', slug='lunch',
+                                         color='#411d97').id],
+             'ingredients': [{'id': sugar.id, 'amount': 1}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, content = self.download(HTTP_ACCEPT='text/csv')
+        self.assertEqual(content.splitlines()[1:],
+                         ['молоко,мл,300', 'сахар,г,51'])
+        call_command('rebuild_shopping_lists', verify=True, stdout=StringIO())
+
+    def test_download_json(self):
+        response, content = self.download(HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(content),
+                         [{'name': 'молоко', 'measurement_unit': 'мл',
+                           'amount': 500},
+                          {'name': 'сахар', 'measurement_unit': 'г',
+                           'amount': 150}])
+
+
+class TestsUserRecipes(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        cls.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                image='recipes/images/test.png', author=cls.user
+            )
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=sugar,
+                                            amount=10 * (number + 1))
+            cls.recipes.append(recipe)
+        cls.ids = [recipe.id for recipe in cls.recipes]
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_toggle_is_idempotent(self):
+        url = reverse('api:recipe-favorite', args=(self.ids[0],))
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['name'], 'Рецепт 0')
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Recipe.objects.get(id=self.ids[0]).favorites_count,
+                         1)
+        self.assertEqual(self.client.delete(url).status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.delete(url).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Recipe.objects.get(id=self.ids[0]).favorites_count,
+                         0)
+        missing = reverse('api:recipe-favorite', args=(max(self.ids) + 1,))
+        self.assertEqual(self.client.post(missing).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(missing).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_readd_is_not_counted(self):
+        url = reverse('api:recipe-shopping-cart-bulk')
+        for returning in (True, False):
+            with self.subTest(returning=returning), \
+                    mock.patch('api.services.supports_returning',
+                               return_value=returning):
+                self.client.delete(url, {'recipes': self.ids},
+                                   format='json')
+                self.client.post(url, {'recipes': self.ids[:1]},
+                                 format='json')
+                response = self.client.post(url, {'recipes': self.ids},
+                                            format='json')
+                self.assertEqual(response.data, {'recipes': self.ids[1:]})
+                self.assertEqual(
+                    RecipeScore.objects.get(pk=self.ids[0]).popular,
+                    RankingConstants.SHOPPING_CART_WEIGHT
+                )
+
+    def test_bulk_add_skips_rows_added_concurrently(self):
+        bulk_create = ShoppingList.objects.bulk_create
+
+        def add_concurrently(objs, **kwargs):
+            ShoppingList.objects.create(user=self.user,
+                                        recipe_id=self.ids[0])
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch('api.services.supports_returning',
+                        return_value=False), \
+                mock.patch.object(ShoppingList.objects, 'bulk_create',
+                                  side_effect=add_concurrently):
+            response = self.client.post(
+                reverse('api:recipe-shopping-cart-bulk'),
+                {'recipes': self.ids}, format='json'
+            )
+        self.assertEqual(response.data, {'recipes': self.ids[1:]})
+        self.assertEqual(RecipeScore.objects.get(pk=self.ids[0]).popular,
+                         RankingConstants.SHOPPING_CART_WEIGHT)
+
+    def test_bulk_favorites(self):
+        url = reverse('api:recipe-favorite-bulk')
+        unknown = max(self.ids) + 1
+        response = self.client.post(
+            url, {'recipes': self.ids[:2] + [unknown]}, format='json'
+        )
+        self.assertEqual(response.data, {'recipes': self.ids[:2]})
+        response = self.client.post(url, {'recipes': self.ids},
+                                    format='json')
+        self.assertEqual(response.data, {'recipes': self.ids[2:]})
+        response = self.client.delete(url, {'recipes': self.ids[1:]},
+                                      format='json')
+        self.assertEqual(response.data, {'recipes': self.ids[1:]})
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True
+            )), [1, 0, 0]
+        )
+        response = self.client.post(url, {'recipes': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_shopping_cart_and_clear(self):
+        url = reverse('api:recipe-shopping-cart-bulk')
+        self.client.post(url, {'recipes': self.ids}, format='json')
+        self.client.delete(url, {'recipes': self.ids[:1]}, format='json')
+        self.assertEqual(
+            ShoppingListIngredient.objects.get(user=self.user).amount, 50
+        )
+        call_command('rebuild_shopping_lists', verify=True, stdout=StringIO())
+        response = self.client.delete(
+            reverse('api:recipe-clear-shopping-cart')
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(ShoppingList.objects.filter(user=self.user).exists())
+        self.assertFalse(
+            ShoppingListIngredient.objects.filter(user=self.user).exists()
+        )
+
+
+@override_settings(ASYNC_VIEWS=True,
+                   ROOT_URLCONF='foodgram_backend.async_urls')
+class TestsAsyncViews(TransactionTestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='async', email='async@ya.ru')
+        self.token = Token.objects.create(user=user).key
+        recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/images/test.png', author=user
+        )
+        RecipeIngredient.objects.create(
+            recipe=recipe, amount=150,
+            ingredient=Ingredient.objects.create(name='сахар',
+                                                 measurement_unit='г')
+        )
+        ShoppingList.objects.create(user=user, recipe=recipe)
+
+    def tearDown(self):
+        shutdown_executor()
+
+    async def test_download_shopping_cart(self):
+        response = await self.async_client.get(
+            reverse('api:recipe-download-shopping-cart'),
+            authorization=f'Token {self.token}', accept='text/csv'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Строки прочитаны в потоке пула, файл отдается по частям:
+        # обращение к базе здесь, в цикле событий, вызвало бы
+        # SynchronousOnlyOperation.
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content.splitlines(),
+                         ['name,measurement_unit,amount', 'сахар,г,150'])
+        response = await self.async_client.get(
+            reverse('api:recipe-download-shopping-cart')
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class TestsRecipeImageUpload(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('api:recipe-list')
+        cls.user = User.objects.create(username='cook', email='cook@ya.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.tag = Tag.objects.create(name='Ужин', slug='dinner',
+                                     color='#411d98')
+        cls.ingredient = Ingredient.objects.create(name='соль',
+                                                   measurement_unit='г')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    @staticmethod
+    def make_image(size=(2, 2), image_format='PNG', mode='RGB'):
+        buffer = BytesIO()
+        Image.new(mode, size).save(buffer, format=image_format)
+        return buffer.getvalue()
+
+    def recipe_data(self, name, image=None):
+        data = {'name': name, 'text': 'Описание', 'cooking_time': 5,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 2}]}
+        if image is not None:
+            data['image'] = ('data:image/png;base64,'
+                             + base64.b64encode(image).decode())
+        return data
+
+    def test_create_with_base64_image(self):
+        response = self.client.post(
+            self.url, self.recipe_data('base64', self.make_image()),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['image'].endswith('.png'))
+
+    def test_create_with_multipart_image(self):
+        image = BytesIO(self.make_image())
+        image.name = 'photo.png'
+        response = self.client.post(
+            self.url,
+            {'data': json.dumps(self.recipe_data('multipart')),
+             'image': image},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['name'], 'multipart')
+
+    def test_upload_raw_image(self):
+        recipe = Recipe.objects.create(name='raw', text='Описание',
+                                       cooking_time=5, author=self.user,
+                                       image='recipes/images/test.png')
+        response = self.client.put(
+            reverse('api:recipe-image', kwargs={'pk': recipe.id}),
+            data=self.make_image(image_format='JPEG'),
+            content_type='image/jpeg'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.image.name.endswith('.jpeg'))
+
+    def test_image_checks_run_on_header(self):
+        response = self.client.post(
+            self.url,
+            self.recipe_data('huge', self.make_image((8000, 6000),
+                                                     mode='1')),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+        response = self.client.post(
+            self.url,
+            self.recipe_data('bmp', self.make_image(image_format='BMP')),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('BMP', str(response.data['image']))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class TestsGenerateDataset(APITestCase):
+
+    SCALE = '0.01'
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_generate_dataset(self):
+        call_command('generate_dataset', '--scale', self.SCALE, '--seed', '7',
+                     '--batch-size', '30', stdout=StringIO())
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Recipe.objects.count(), 100)
+        self.assertTrue(Favorites.objects.exists())
+        self.assertTrue(Follow.objects.exists())
+        output = StringIO()
+        call_command('reconcile_counters', '--verify', stdout=output)
+        self.assertNotRegex(output.getvalue(), r': [1-9]')
+        recipe = Recipe.objects.first()
+        image_path = recipe.image.path
+        recipe.delete()
+        self.assertTrue(os.path.exists(image_path))
+
+
+class TestsMetrics(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('api:metrics')
+        cls.tags_url = reverse('api:tag-list')
+        cls.admin = User.objects.create(username='admin', email='admin@ya.ru',
+                                        is_staff=True)
+        cls.user = User.objects.create(username='user', email='user@ya.ru')
+        cls.admin_token = Token.objects.create(user=cls.admin)
+        cls.user_token = Token.objects.create(user=cls.user)
+
+    def test_server_timing_for_staff_only(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.user_token.key
+        )
+        self.assertNotIn('Server-Timing', self.client.get(self.tags_url))
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.admin_token.key
+        )
+        response = self.client.get(self.tags_url)
+        self.assertRegex(response['Server-Timing'],
+                         r'db;dur=[\d.]+;desc="\d+ queries", serialize;')
+
+    def test_metrics(self):
+        self.client.get(self.tags_url)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.admin_token.key
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            'foodgram_api_request_duration_seconds_count'
+            '{view="TagViewSet",action="list"}',
+            response.content.decode()
+        )
+
+
+class TestsConnectionPool(APITestCase):
+
+    @staticmethod
+    def connect():
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def test_connection_is_reused_and_recycled(self):
+        pool = ConnectionPool(max_uses=2)
+        first = pool.acquire(self.connect)
+        pool.release(first)
+        self.assertIs(pool.acquire(self.connect), first)
+        pool.release(first)
+        second = pool.acquire(self.connect)
+        self.assertIsNot(second, first)
+        pool.release(second)
+        second.close()
+        self.assertIsNot(pool.acquire(self.connect), second)
+        stats = pool.stats()
+        self.assertEqual((stats['created'], stats['recycled'],
+                          stats['ping_failures'], stats['in_use']),
+                         (3, 1, 1, 1))
+
+    def test_wait_timeout(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect)
+        stats = pool.stats()
+        self.assertEqual((stats['waits'], stats['timeouts']), (1, 1))
+        self.assertGreater(stats['wait_time'], 0)
+
+    def test_threads_never_exceed_max_size(self):
+        pool = ConnectionPool(max_size=2)
+        in_use = []
+
+        def work():
+            connection = pool.acquire(self.connect)
+            in_use.append(pool.stats()['in_use'])
+            time.sleep(0.01)
+            pool.release(connection)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(max(in_use), 2)
+        self.assertEqual(pool.stats()['size'], 2)
+
+    def test_dead_thread_connection_is_reclaimed(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        thread = threading.Thread(target=pool.acquire, args=(self.connect,))
+        thread.start()
+        thread.join()
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        stats = pool.stats()
+        self.assertEqual((stats['reclaimed'], stats['created'],
+                          stats['size'], stats['timeouts']), (1, 2, 1, 0))
+
+    def test_stats_for_staff_only(self):
+        get_pool('tests', max_size=3)
+        url = reverse('api:db-pool')
+        user = User.objects.create(username='user', email='user@ya.ru')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        user.is_staff = True
+        self.client.force_authenticate(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['tests']['max_size'], 3)
+
+
+class TestsPooledBackgroundRebuild(TransactionTestCase):
+    """
+    Фоновое перестроение индекса, когда соединения потоков, кроме
+    главного, берутся из пула, как в бэкенде foodgram_backend.db.
+    """
+
+    def test_rebuild_thread_returns_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=0.5)
+        wrapper_class = type(connections['default'])
+        connect = wrapper_class.get_new_connection
+        close = wrapper_class.close
+        main = threading.main_thread()
+
+        def get_new_connection(wrapper, conn_params):
+            if threading.current_thread() is main:
+                return connect(wrapper, conn_params)
+            return pool.acquire(lambda: connect(wrapper, conn_params))
+
+        def close_connection(wrapper):
+            if threading.current_thread() is main:
+                return close(wrapper)
+            # SQLite не закрывает соединения с базой в памяти.
+            return BaseDatabaseWrapper.close(wrapper)
+
+        def release(wrapper):
+            pool.release(wrapper.connection)
+
+        threads = []
+        thread_class = threading.Thread
+
+        def start_thread(*args, **kwargs):
+            threads.append(thread_class(*args, **kwargs))
+            return threads[-1]
+
+        index = CookableIndex()
+        with mock.patch.multiple(wrapper_class,
+                                 get_new_connection=get_new_connection,
+                                 close=close_connection, _close=release), \
+                mock.patch('api.indexes.threading.Thread',
+                           side_effect=start_thread):
+            index.search([1])
+            for _ in range(3):
+                index._built_at = 0.0
+                index.search([1])
+                threads[-1].join()
+                self.assertGreater(index._built_at, 0.0)
+        pool.close()
+        stats = pool.stats()
+        self.assertEqual(len(threads), 3)
+        self.assertEqual((stats['created'], stats['in_use'],
+                          stats['reclaimed'], stats['timeouts']),
+                         (1, 0, 0, 0))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=5)
+class TestsReadReplica(APITestCase):
+    """Реплика -- отдельный файл SQLite, отстающий от основной базы."""
+
+    # Псевдоним replica добавляется в setUpClass.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.databases['replica'] = {
+            **connections.databases['default'],
+            'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+        }
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.tokens = {}
+        for username in ('writer', 'reader'):
+            user = User.objects.create(username=username,
+                                       email=f'{username}@ya.ru')
+            user.save(using='replica')
+            token = Token.objects.create(user=user)
+            token.save(using='replica')
+            self.tokens[username] = f'Token {token.key}'
+        self.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/images/test.png', author=user
+        )
+
+    def get_count(self, authorization=None, aged=True):
+        """
+        Число рецептов. При aged изменения данных считаются
+        давними, и реплика может их уже получить.
+        """
+        headers = {}
+        if authorization:
+            headers['HTTP_AUTHORIZATION'] = authorization
+        with mock.patch('api.routers.time') as routers_time:
+            routers_time.time.return_value = time.time() + (60 if aged
+                                                            else 0)
+            response = self.client.get(reverse('api:recipe-list'), **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['count']
+
+    def test_reads_from_replica_until_own_write(self):
+        self.assertEqual(self.get_count(), 0)
+        self.assertEqual(self.get_count(self.tokens['writer']), 0)
+        response = self.client.post(
+            reverse('api:recipe-favorite', args=[self.recipe.id]),
+            HTTP_AUTHORIZATION=self.tokens['writer']
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_count(self.tokens['writer']), 1)
+        self.assertEqual(self.get_count(self.tokens['reader']), 0)
+        self.assertEqual(self.get_count(), 0)
+
+    def test_fresh_changes_are_cached_from_primary(self):
+        self.assertEqual(self.get_count(aged=False), 1)
+        self.assertEqual(self.get_count(), 1)
+
+    def test_new_token_is_read_from_primary(self):
+        token = Token.objects.create(user=User.objects.create(
+            username='newcomer', email='newcomer@ya.ru'
+        ))
+        self.assertEqual(self.get_count(f'Token {token.key}'), 0)
+
+    def test_subscriptions_read_from_replica(self):
+        writer, reader = User.objects.order_by('id')[:2]
+        Follow.objects.create(user=reader, following=writer)
+        url = reverse('api:foodgramuser-subscriptions')
+        response = self.client.get(
+            url, HTTP_AUTHORIZATION=self.tokens['reader']
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 0)
+        response = self.client.get(
+            reverse('api:foodgramuser-detail', args=[writer.id]),
+            HTTP_AUTHORIZATION=self.tokens['reader']
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_pin_expires(self):
+        self.client.post(
+            reverse('api:recipe-favorite', args=[self.recipe.id]),
+            HTTP_AUTHORIZATION=self.tokens['writer']
+        )
+        self.assertEqual(self.get_count(self.tokens['writer']), 0)
+
+
+class TestsCachedTokenAuthentication(APITestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@ya.ru', password='old-password'
+        )
+        self.key = Token.objects.create(user=self.user).key
+        self.url = reverse('api:foodgramuser-me')
+
+    def get_me(self):
+        return self.client.get(self.url,
+                               HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    def test_cached_token_skips_query(self):
+        authentication = CachedTokenAuthentication()
+        with self.assertNumQueries(1):
+            user, token = authentication.authenticate_credentials(self.key)
+        with self.assertNumQueries(0):
+            cached_user, cached_token = (
+                authentication.authenticate_credentials(self.key)
+            )
+        self.assertEqual((cached_user, cached_token.key), (user, self.key))
+        self.assertIsNot(cached_user, user)
+
+    def test_logout_invalidates_token(self):
+        self.assertEqual(self.get_me().status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('api:logout'),
+                                    HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(token_cache.get(self.key))
+        self.assertEqual(self.get_me().status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates_token(self):
+        self.get_me()
+        response = self.client.post(
+            reverse('api:foodgramuser-set-password'),
+            {'current_password': 'old-password',
+             'new_password': 'new-password'},
+            HTTP_AUTHORIZATION=f'Token {self.key}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(token_cache.get(self.key))
+
+    @override_settings(TOKEN_CACHE_SHARED=True)
+    def test_deactivation_invalidates_shared_cache(self):
+        self.get_me()
+        token_cache.clear()
+        with self.assertNumQueries(0):
+            CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me().status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_CACHE_SHARED=True)
+    def test_logout_during_lookup_is_not_cached(self):
+        read_token = TokenAuthentication.authenticate_credentials
+
+        def read_then_logout(authentication, key):
+            result = read_token(authentication, key)
+            invalidate_tokens(key)
+            return result
+
+        with mock.patch.object(TokenAuthentication,
+                               'authenticate_credentials',
+                               read_then_logout):
+            CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.assertIsNone(cache.get(get_shared_key(self.key)))
+        self.assertIsNone(token_cache.get(self.key))
+
+    def test_password_change_keeps_other_fields(self):
+        self.get_me()
+        User.objects.filter(pk=self.user.pk).update(first_name='Новое')
+        self.client.post(
+            reverse('api:foodgramuser-set-password'),
+            {'current_password': 'old-password',
+             'new_password': 'new-password'},
+            HTTP_AUTHORIZATION=f'Token {self.key}'
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Новое')
+        self.assertTrue(self.user.check_password('new-password'))
+
+
+class TestsFeed(APITestCase):
+
+    def setUp(self):
+        self.reader = User.objects.create(username='reader',
+                                          email='reader@ya.ru')
+        self.author = User.objects.create(username='author',
+                                          email='author@ya.ru')
+        self.star = User.objects.create(username='star', email='star@ya.ru')
+        User.objects.filter(pk=self.star.pk).update(
+            followers_count=FeedConstants.PULL_FOLLOWERS
+        )
+        self.old_recipe = self.create_recipe(self.author)
+        self.client.force_authenticate(self.reader)
+        for author in (self.author, self.star):
+            self.client.post(reverse('api:foodgramuser-subscribe',
+                                     args=[author.id]))
+        self.url = reverse('api:recipe-feed')
+
+    @staticmethod
+    def create_recipe(author):
+        number = Recipe.objects.count()
+        return Recipe.objects.create(
+            name=f'Рецепт {number}', text='Описание', cooking_time=10,
+            image='recipes/images/test.png', author=author
+        )
+
+    def get_feed_ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_feed_merges_pushed_and_pulled_recipes(self):
+        star_recipe = self.create_recipe(self.star)
+        new_recipe = self.create_recipe(self.author)
+        self.create_recipe(self.reader)
+        self.assertEqual(self.get_feed_ids(),
+                         [new_recipe.id, star_recipe.id, self.old_recipe.id])
+        self.assertEqual(
+            set(FeedEntry.objects.filter(
+                user=self.reader
+            ).values_list('recipe_id', flat=True)),
+            {self.old_recipe.id, new_recipe.id}
+        )
+
+    def test_feed_cursor_pagination(self):
+        recipes = [self.create_recipe(self.author) for _ in range(3)]
+        response = self.client.get(self.url, {'limit': 2})
+        self.assertNotIn('count', response.data)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        ids += [recipe['id'] for recipe
+                in self.client.get(response.data['next']).data['results']]
+        self.assertEqual(ids, [recipe.id for recipe in reversed(recipes)]
+                         + [self.old_recipe.id])
+
+    def test_unsubscribe_retracts_entries(self):
+        self.create_recipe(self.star)
+        for author in (self.author, self.star):
+            response = self.client.delete(
+                reverse('api:foodgramuser-subscribe', args=[author.id])
+            )
+            self.assertEqual(response.status_code,
+                             status.HTTP_204_NO_CONTENT)
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.get_feed_ids(), [])
+
+    def test_feed_is_trimmed(self):
+        with mock.patch.object(FeedConstants, 'MAX_ENTRIES', 2), \
+                mock.patch.object(FeedConstants, 'TRIM_SLACK', 1):
+            recipes = [self.create_recipe(self.author) for _ in range(3)]
+        self.assertEqual(
+            list(FeedEntry.objects.filter(user=self.reader).order_by(
+                '-pub_date', '-id'
+            ).values_list('recipe_id', flat=True)),
+            [recipes[2].id, recipes[1].id]
+        )
+
+    def test_author_below_threshold_is_pushed_to_feeds(self):
+        star_recipe = self.create_recipe(self.star)
+        fan = User.objects.create(username='fan', email='fan@ya.ru')
+        follow = Follow.objects.create(user=fan, following=self.star)
+        User.objects.filter(pk=self.star.pk).update(
+            followers_count=FeedConstants.PULL_FOLLOWERS
+        )
+        follow.delete()
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.reader, recipe=star_recipe
+        ).exists())
+        self.assertEqual(self.get_feed_ids(),
+                         [star_recipe.id, self.old_recipe.id])
+
+    def test_author_above_threshold_is_pulled(self):
+        User.objects.filter(pk=self.author.pk).update(
+            followers_count=FeedConstants.PULL_FOLLOWERS - 1
+        )
+        fan = User.objects.create(username='fan', email='fan@ya.ru')
+        Follow.objects.create(user=fan, following=self.author)
+        self.assertFalse(FeedEntry.objects.filter(
+            author=self.author
+        ).exists())
+        self.assertEqual(self.get_feed_ids(), [self.old_recipe.id])
+
+    def test_rebuild_feeds(self):
+        recipes = [self.create_recipe(self.author) for _ in range(2)]
+        self.create_recipe(self.star)
+        FeedEntry.objects.all().delete()
+        with mock.patch.object(FeedConstants, 'MAX_ENTRIES', 2), \
+                mock.patch.object(FeedConstants, 'TRIM_SLACK', 0):
+            call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(
+            set(FeedEntry.objects.values_list('user_id', 'recipe_id')),
+            {(self.reader.id, recipe.id) for recipe in recipes}
+        )
+
+    def test_feed_for_authorized_only(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+
+class TestsRankings(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author',
+                                          email='author@ya.ru')
+        self.users = [
+            User.objects.create(username=f'user{number}',
+                                email=f'user{number}@ya.ru')
+            for number in range(2)
+        ]
+        self.old, self.cart, self.new, self.idle = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                image='recipes/images/test.png', author=self.author
+            )
+            for number in range(4)
+        ]
+        for user in self.users:
+            Favorites.objects.create(user=user, recipe=self.old)
+        Favorites.objects.filter(recipe=self.old).update(
+            added_date=timezone.now() - timedelta(days=30)
+        )
+        ShoppingList.objects.create(user=self.users[0], recipe=self.cart)
+        self.client.force_authenticate(self.users[1])
+        self.client.post(reverse('api:recipe-favorite', args=[self.new.id]))
+        self.url = reverse('api:recipe-list')
+
+    def get_ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_popular_and_trending(self):
+        call_command('refresh_rankings', stdout=StringIO())
+        self.assertEqual(self.get_ids(ordering='popular'),
+                         [self.old.id, self.new.id, self.cart.id,
+                          self.idle.id])
+        self.assertEqual(self.get_ids(ordering='trending'),
+                         [self.new.id, self.cart.id, self.old.id,
+                          self.idle.id])
+        self.assertEqual(self.client.get(self.url, {'ordering': 'x'})
+                         .status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_incremental_scores_match_refresh(self):
+        self.client.delete(reverse('api:recipe-favorite',
+                                   args=[self.new.id]))
+        self.client.post(reverse('api:recipe-shopping-cart',
+                                 args=[self.idle.id]))
+        incremental = {score.pk: score for score in RecipeScore.objects.all()}
+        call_command('refresh_rankings', stdout=StringIO())
+        for score in RecipeScore.objects.all():
+            self.assertEqual(score.popular, incremental[score.pk].popular)
+            # Добавления old изменены в обход сигналов.
+            if score.pk != self.old.pk:
+                self.assertAlmostEqual(score.trending,
+                                       incremental[score.pk].trending,
+                                       places=3)
+        self.assertEqual(RecipeScore.objects.get(pk=self.new.pk).trending, 0)
+
+    def test_bulk_removal_uses_added_date(self):
+        call_command('refresh_rankings', stdout=StringIO())
+        response = self.client.delete(reverse('api:recipe-favorite-bulk'),
+                                      {'recipes': [self.old.id]},
+                                      format='json')
+        self.assertEqual(response.data, {'recipes': [self.old.id]})
+        _, trending = RecipeRanking.calculate()[self.old.id]
+        self.assertAlmostEqual(
+            RecipeScore.objects.get(pk=self.old.pk).trending, trending,
+            places=3
+        )
+
+    def test_keyset_query_uses_score_index(self):
+        quote = connection.ops.quote_name
+        table = quote(RecipeScore._meta.db_table)
+        for index in RecipeScore._meta.indexes:
+            ranking = index.fields[0].lstrip('-')
+            columns = [
+                f'{table}.{quote(field.column)}' for field in (
+                    RecipeScore._meta.get_field(name.lstrip('-'))
+                    for name in index.fields
+                )
+            ]
+            response = self.client.get(self.url, {'ordering': ranking,
+                                                  'cursor': '', 'limit': 1})
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(response.data['next'])
+            sql = next(query['sql'] for query in queries.captured_queries
+                       if f'FROM {quote(Recipe._meta.db_table)}'
+                       in query['sql'])
+            self.assertIn(f'INNER JOIN {table}', sql)
+            self.assertIn(f'ORDER BY {columns[0]} DESC, {columns[1]} DESC',
+                          sql)
+            self.assertIn(f'{columns[0]} < ', sql)
+            self.assertIn(f'{columns[1]} < ', sql)
+
+    def test_cursor_pagination_with_equal_scores(self):
+        url = self.url + '?ordering=popular&cursor=&limit=1'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, self.get_ids(ordering='popular'))
+        response = self.client.get(self.url, {'ordering': 'popular',
+                                              'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestsRecipeFastReadSerializer(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@ya.ru',
+                                         first_name='Имя', last_name='Автор')
+        cls.reader = User.objects.create(username='reader',
+                                         email='reader@ya.ru')
+        Follow.objects.create(user=cls.reader, following=cls.author)
+        tags = [Tag.objects.create(name=f'Тег {number}', slug=f'tag{number}',
+                                   color=f'#00000{number}')
+                for number in range(2)]
+        ingredients = [Ingredient.objects.create(name=f'Ингредиент {number}',
+                                                 measurement_unit='г')
+                       for number in range(3)]
+        for number, image in enumerate(('recipes/images/test.png', '')):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', image=image,
+                cooking_time=number + 1, author=cls.author
+            )
+            recipe.tags.set(tags[number:])
+            for amount, ingredient in enumerate(ingredients[number:], 1):
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+        Favorites.objects.create(user=cls.reader, recipe=recipe)
+        ShoppingList.objects.create(user=cls.reader, recipe=recipe)
+
+    @staticmethod
+    def get_view(user=None, action='list'):
+        request = Request(APIRequestFactory().get(reverse('api:recipe-list')))
+        request.user = user or AnonymousUser()
+        return RecipeViewSet(action=action, request=request,
+                             format_kwarg=None, kwargs={})
+
+    def assertSameRepresentation(self, recipes, context):
+        expected = RecipeReadSerializer(recipes, many=True,
+                                        context=context).data
+        actual = RecipeFastReadSerializer(recipes, many=True,
+                                          context=context).data
+        self.assertEqual(JSONRenderer().render(actual),
+                         JSONRenderer().render(expected))
+
+    def test_parity_with_annotated_queryset(self):
+        for user in (None, self.reader, self.author):
+            view = self.get_view(user)
+            self.assertSameRepresentation(list(view.get_queryset()),
+                                          view.get_serializer_context())
+
+    def test_parity_without_annotations(self):
+        recipes = list(Recipe.objects.all())
+        self.assertSameRepresentation(
+            recipes, self.get_view(self.reader).get_serializer_context()
+        )
+        self.assertSameRepresentation(recipes, {})
+
+    def test_list_and_retrieve_use_fast_serializer(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse('api:recipe-list'))
+        expected = RecipeReadSerializer(
+            self.get_view(self.reader).get_queryset(), many=True,
+            context={'request': response.renderer_context['request']}
+        ).data
+        self.assertEqual(response.data['results'], expected)
+        recipe = response.data['results'][0]
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertIsNone(recipe['image'])
+        response = self.client.get(reverse('api:recipe-detail',
+                                           args=[recipe['id']]))
+        self.assertEqual(response.data, recipe)
+
+
+class TestsSubscriptions(APITestCase):
+
+    AUTHORS_COUNT = 3
+    RECIPES_COUNT = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('api:foodgramuser-subscriptions')
+        cls.user = User.objects.create(username='fan', email='fan@ya.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        for author_number in range(cls.AUTHORS_COUNT):
+            author = User.objects.create(
+                username=f'author{author_number}',
+                email=f'author{author_number}@ya.ru'
+            )
+            Follow.objects.create(user=cls.user, following=author)
+            for number in range(cls.RECIPES_COUNT):
+                Recipe.objects.create(
+                    name=f'Рецепт {number}', text='Описание',
+                    cooking_time=10, image='recipes/images/test.png',
+                    author=author
+                )
+
+    def setUp(self):
+        token_cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_subscriptions_queries(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, {'recipes_limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), self.AUTHORS_COUNT)
+        for author in response.data['results']:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], self.RECIPES_COUNT)
+            self.assertEqual(
+                [recipe['name'] for recipe in author['recipes']],
+                ['Рецепт 2', 'Рецепт 1']
+            )
+
+    def test_subscriptions_without_limit(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), self.RECIPES_COUNT)
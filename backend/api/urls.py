@@ -1,8 +1,9 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
 from users.views import UserViewSet
-from .views import RecipeViewSet, TagViewSet, IngredientViewSet
+from .views import (DatabasePoolView, IngredientViewSet, MetricsView,
+                    RecipeViewSet, TagViewSet)
 
 
 app_name = 'api'
@@ -17,5 +18,7 @@ router_v1.register('users', UserViewSet)
 
 urlpatterns = [
     path('', include(router_v1.urls)),
-    path('auth/', include('djoser.urls.authtoken'))
+    path('auth/', include('djoser.urls.authtoken')),
+    re_path(r'^metrics/?$', MetricsView.as_view(), name='metrics'),
+    re_path(r'^db-pool/?$', DatabasePoolView.as_view(), name='db-pool'),
 ]
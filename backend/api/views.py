@@ -1,32 +1,60 @@
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import (IsAuthenticatedOrReadOnly,
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import (IsAdminUser,
+                                        IsAuthenticatedOrReadOnly,
                                         IsAuthenticated)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from api.filters import IngredientNameSearchFilter, CustomRecipeFilter
-from api.pagination import CustomPagination
+from api.async_views import stream_without_database
+from api.cache import AnonymousCacheMixin, ConditionalGetMixin
+from api.filters import CustomRecipeFilter
+from api.indexes import cookable_index, ingredient_index
+from api.metrics import registry
+from api.pagination import CustomPagination, FeedKeysetPagination
+from api.parsers import ImageUploadParser, MultiPartJSONParser
 from api.permissions import IsAuthorOrAdminOrHigherOrReadOnly
-from api.serializers import (RecipeReadSerializer,
+from api.renderers import (PrometheusRenderer,
+                           ShoppingListTextRenderer,
+                           ShoppingListCSVRenderer,
+                           ShoppingListJSONRenderer)
+from api.serializers import (CookableQuerySerializer,
+                             RecipeFastReadSerializer,
                              RecipeCreateSerializer,
+                             RecipeIdsSerializer,
+                             RecipeImageSerializer,
                              TagSerializer,
                              IngredientSerializer,
                              FavoritesSerializer,
                              ShoppingListSerializer)
-from api.services import ShoppingListCreator
+from api.services import (ShoppingListCreator, add_user_recipes,
+                          annotate_is_subscribed, remove_user_recipes)
+from api.signals import user_recipes_changed
+from foodgram_backend.constants import IngredientConstants
+from foodgram_backend.db.pool import get_pools
 from recipes.models import (Recipe,
                             Tag,
                             Ingredient,
+                            RecipeIngredient,
                             Favorites,
                             ShoppingList)
 
+User = get_user_model()
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """
     Вьюсет для представления ингредиентов.
     Методы:
@@ -34,26 +62,41 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
         - GET -- Представление тега по id.
     """
 
+    read_from_replica = True
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    cache_scopes = ('tags',)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """
     Вьюсет для представления ингредиентов.
     Методы:
         - GET -- Представление списка ингредиентов.
         - GET -- Представление ингредиента по id.
-    Доступен поиск по частичному вхождению в название ингредиента.
+    Доступен поиск по началу названия ингредиента:
+        - name=<str> -- Ингредиенты, название которых начинается с name.
+    Поиск выполняется по индексу в памяти без запроса к базе.
     """
 
+    read_from_replica = True
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = [IngredientNameSearchFilter, ]
-    search_fields = ('^name',)
+    cache_scopes = ('ingredients',)
+
+    def list(self, request: Request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            ingredients = ingredient_index.search(
+                name, limit=IngredientConstants.SEARCH_RESULTS_LIMIT
+            )
+            serializer = self.get_serializer(ingredients, many=True)
+            return Response(serializer.data)
+        return super().list(request, *args, **kwargs)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin, ModelViewSet):
     """
     Вьюсет для представления, создания, редактирования и удаления рецептов.
     Права доступа:
@@ -67,29 +110,89 @@ class RecipeViewSet(ModelViewSet):
         - POST -- Создание рецепта.
         - PATCH -- Редактирование рецепта.
         - DELETE -- Удаление рецепта.
+    Создание и редактирование принимают JSON с изображением в base64
+    или multipart/form-data: JSON рецепта в части data и файл в части image.
     Доступные actions:
         - POST -- Добавление рецепта в избранное.
         - DELETE -- Удаление рецепта из избранного.
         - POST -- Добавление рецепта в список покупок.
         - DELETE -- Удаление рецепта из списка покупок.
-        - GET -- Получить список покупок в формате .txt.
+        - POST, DELETE -- Пакетное добавление и удаление рецептов
+        избранного и списка покупок.
+        - DELETE -- Очистка списка покупок.
+        - GET -- Получить список покупок в формате .txt, .csv или .json.
+        - GET -- Рецепты, которые можно приготовить из имеющихся
+        ингредиентов.
+        - PUT -- Загрузка изображения рецепта телом запроса.
     Параметры фильтрации:
         - is_favorited=<0 или 1> -- 1 Только рецепты добавленные в избранное
         - is_in_shopping_cart=<0 или 1> -- Только рецепты в списке покупок
         - author=<id> -- Только рецепты выбранного автора
         - tags=<slug> -- Только рецепты с выбранными тегами
             Пример: tags=lunch&tags=breakfast
+        - search=<str> -- Поиск по названию и описанию
         Пагинация:
         - page=<int> - Номер страницы
         - limit=<int> - Количество объектов на странице(по умолчанию 6)
+        - cursor=<str> - Курсор следующей страницы вместо page
+    Ответы list и retrieve для анонимных пользователей кэшируются.
+    Поддерживаются условные запросы с If-None-Match и If-Modified-Since.
     """
 
+    read_from_replica = True
     queryset = Recipe.objects.all()
     permission_classes = [IsAuthorOrAdminOrHigherOrReadOnly,
                           IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, ]
     filterset_class = CustomRecipeFilter
     pagination_class = CustomPagination
+    parser_classes = [JSONParser, MultiPartJSONParser]
+    cache_scopes = ('recipes',)
+    object_version_field = 'updated_at'
+    lookup_value_regex = r'\d+'
+
+    def get_etag_scopes(self):
+        if self.action == 'retrieve':
+            return ('tags', 'ingredients', 'users')
+        return self.cache_scopes
+
+    def get_queryset(self):
+        """
+        Выборка рецептов для представления.
+        Для list и retrieve поля is_favorited, is_in_shopping_cart
+        и author.is_subscribed вычисляются подзапросами Exists,
+        а теги, автор и ингредиенты загружаются заранее.
+        Количество запросов не зависит от размера страницы.
+        """
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve', 'cookable', 'feed'):
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            queryset = queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        else:
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorites.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+                is_in_shopping_cart=Exists(ShoppingList.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                ))
+            )
+        return queryset.prefetch_related(
+            'tags',
+            Prefetch(
+                'author',
+                queryset=annotate_is_subscribed(User.objects.all(), user)
+            ),
+            Prefetch(
+                'recipe_ingredient',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
 
     def update(self, request: Request, *args, **kwargs):
         if request.method == 'PUT':
@@ -98,19 +201,55 @@ class RecipeViewSet(ModelViewSet):
         return super().update(request, *args, **kwargs)
 
     def get_serializer_class(self):
-        if self.action in ['list', 'retrieve']:
-            return RecipeReadSerializer
+        if self.action in ['list', 'retrieve', 'cookable', 'feed']:
+            return RecipeFastReadSerializer
         elif self.action == 'favorite':
             return FavoritesSerializer
         elif self.action == 'shopping_cart':
             return ShoppingListSerializer
+        elif self.action in ['favorite_bulk', 'delete_favorite_bulk',
+                             'shopping_cart_bulk',
+                             'delete_shopping_cart_bulk']:
+            return RecipeIdsSerializer
+        elif self.action == 'image':
+            return RecipeImageSerializer
         return RecipeCreateSerializer
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Рендереры списка покупок отдают только файл, ошибки
+        # скачивания (пустой список, нет авторизации) -- в JSON.
+        if (self.action == 'download_shopping_cart'
+                and isinstance(response, Response)
+                and not status.is_success(response.status_code)):
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args,
+                                         **kwargs)
+
     def perform_create(self, serializer: RecipeCreateSerializer):
         user = self.request.user
         serializer.is_valid(raise_exception=True)
         serializer.save(author=user)
 
+    @action(
+        detail=True,
+        methods=['put'],
+        parser_classes=[ImageUploadParser, MultiPartJSONParser]
+    )
+    def image(self, request: Request, pk: int):
+        """
+        Загрузить изображение рецепта.
+        Изображение передается телом запроса с Content-Type image/*
+        или файлом в части image запроса multipart/form-data.
+        Доступно автору рецепта и персоналу.
+        """
+        recipe = self.get_object()
+        image = request.data.get('file') or request.data.get('image')
+        serializer = self.get_serializer(recipe, data={'image': image})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
     def __post_extra_action(self, request: Request, model, pk: int):
         """
         Добавление рецепта в список покупок/избранное.
@@ -118,49 +257,77 @@ class RecipeViewSet(ModelViewSet):
             - Невозможно добавить рецепт, который не существует.
             - Невозможно добавить уже добавленный рецепт.
         """
-        if Recipe.objects.filter(id=pk).exists():
-            user = request.user
-            recipe: Recipe = Recipe.objects.get(id=pk)
-            object_exists: bool = model.objects.filter(
-                user=user,
-                recipe=recipe
-            ).exists()
-            if object_exists:
-                return Response(
-                    {'errors': 'Выбранный рецепт уже добавлен.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            serializer = self.get_serializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save(user=user, recipe=recipe)
+        user = request.user
+        with transaction.atomic():
+            added = self.__change_user_recipes(model, user,
+                                               added=[int(pk)])
+        recipe = Recipe.objects.filter(id=int(pk)).only(
+            'id', 'name', 'image', 'cooking_time'
+        ).first()
+        if recipe is None:
+            return Response(
+                {'errors': 'Выбранный рецепт не существует.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not added:
             return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED)
+                {'errors': 'Выбранный рецепт уже добавлен.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = self.get_serializer(model(user=user, recipe=recipe))
         return Response(
-            {'errors': 'Выбранный рецепт не существует.'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+            serializer.data,
+            status=status.HTTP_201_CREATED)
 
-    @staticmethod
-    def __delete_extra_action(request: Request, model, pk: int):
+    def __delete_extra_action(self, request: Request, model, pk: int):
         """
         Удаление рецепта из списка покупок/избранного.
         Ограничения:
             - Невозможно удалить рецепт, который не существует.
             - Невозможно удалить рецепт, который не добавлен.
         """
-        user = request.user
-        recipe: Recipe = get_object_or_404(Recipe, id=pk)
-        object_exists: bool = model.objects.filter(
-            user=user,
-            recipe=recipe
-        ).exists()
-        if not object_exists:
-            return Response(
-                data={'errors': 'Выбранный рецепт ранее не был добавлен.'},
-                status=status.HTTP_400_BAD_REQUEST)
-        model.objects.get(user=user, recipe=recipe).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            removed = self.__change_user_recipes(model, request.user,
+                                                 removed=[int(pk)])
+        if removed:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, id=int(pk))
+        return Response(
+            data={'errors': 'Выбранный рецепт ранее не был добавлен.'},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    def __bulk_extra_action(self, request: Request, model):
+        """
+        Пакетное добавление (POST) или удаление (DELETE) рецептов
+        списка покупок/избранного.
+        Несуществующие, уже добавленные и ранее не добавленные рецепты
+        пропускаются. Возвращает id измененных рецептов.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = self.__change_user_recipes(model, request.user,
+                                                     added=recipe_ids)
+            else:
+                changed = self.__change_user_recipes(model, request.user,
+                                                     removed=recipe_ids)
+        return Response({'recipes': sorted(changed)})
+
+    @staticmethod
+    def __change_user_recipes(model, user, added=(), removed=()):
+        """
+        Изменение списка покупок/избранного одним запросом на вставку
+        и одним на удаление, повторы и гонки не приводят к ошибкам.
+        """
+        added = add_user_recipes(model, user.id, added) if added else {}
+        removed = (remove_user_recipes(model, user.id, removed)
+                   if removed else {})
+        if added or removed:
+            user_recipes_changed.send(sender=model, user_id=user.id,
+                                      added=added, removed=removed)
+        return added or removed
 
     @action(
         detail=True,
@@ -218,14 +385,136 @@ class RecipeViewSet(ModelViewSet):
             pk=pk
         )
 
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='favorite',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def favorite_bulk(self, request: Request):
+        """
+        Добавить несколько рецептов в избранное.
+        Тело запроса: {"recipes": [<id>, ...]}.
+        Доступно только авторизованным пользователям.
+        """
+        return self.__bulk_extra_action(request=request, model=Favorites)
+
+    @favorite_bulk.mapping.delete
+    def delete_favorite_bulk(self, request: Request):
+        """
+        Удалить несколько рецептов из избранного.
+        Тело запроса: {"recipes": [<id>, ...]}.
+        Доступно только авторизованным пользователям.
+        """
+        return self.__bulk_extra_action(request=request, model=Favorites)
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='shopping_cart',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def shopping_cart_bulk(self, request: Request):
+        """
+        Добавить несколько рецептов в список покупок.
+        Тело запроса: {"recipes": [<id>, ...]}.
+        Доступно только авторизованным пользователям.
+        """
+        return self.__bulk_extra_action(request=request, model=ShoppingList)
+
+    @shopping_cart_bulk.mapping.delete
+    def delete_shopping_cart_bulk(self, request: Request):
+        """
+        Удалить несколько рецептов из списка покупок.
+        Тело запроса: {"recipes": [<id>, ...]}.
+        Доступно только авторизованным пользователям.
+        """
+        return self.__bulk_extra_action(request=request, model=ShoppingList)
+
+    @action(
+        detail=False,
+        methods=['delete'],
+        url_path='shopping_cart/clear',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def clear_shopping_cart(self, request: Request):
+        """
+        Очистить список покупок.
+        Доступно только авторизованным пользователям.
+        """
+        user = request.user
+        with transaction.atomic():
+            removed = remove_user_recipes(ShoppingList, user.id)
+            user_recipes_changed.send(sender=ShoppingList, user_id=user.id,
+                                      removed=removed, cleared=True)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['get'])
+    def cookable(self, request: Request):
+        """
+        Рецепты, которые можно приготовить из имеющихся ингредиентов.
+        Параметры:
+            - ingredients=<id> -- id имеющегося ингредиента, можно
+            указать несколько.
+            - missing=<int> -- Допустимое число недостающих ингредиентов,
+            по умолчанию 0.
+        Рецепты упорядочены по числу недостающих ингредиентов, оно
+        возвращается в поле missing. Поиск выполняется по индексу
+        в памяти, из базы загружаются только рецепты страницы.
+        """
+        params = CookableQuerySerializer(data={
+            'ingredients': request.query_params.getlist('ingredients'),
+            'missing': request.query_params.get('missing', 0),
+        })
+        params.is_valid(raise_exception=True)
+        page = self.paginate_queryset(cookable_index.search(
+            params.validated_data['ingredients'],
+            max_missing=params.validated_data['missing']
+        ))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page]
+        )
+        found = [(recipes[recipe_id], missing)
+                 for recipe_id, missing in page if recipe_id in recipes]
+        serializer = self.get_serializer(
+            [recipe for recipe, _ in found], many=True
+        )
+        data = [{**recipe, 'missing': missing}
+                for recipe, (_, missing) in zip(serializer.data, found)]
+        return self.get_paginated_response(data)
+
     @action(
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated, ]
     )
+    def feed(self, request: Request):
+        """
+        Лента подписок: новые рецепты авторов, на которых подписан
+        пользователь, от новых к старым.
+        Пагинация только по курсору:
+            - cursor=<str> -- Курсор следующей страницы
+            - limit=<int> -- Количество рецептов на странице
+        """
+        paginator = FeedKeysetPagination()
+        page = paginator.paginate_queryset(self.get_queryset(), request,
+                                           view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated, ],
+        renderer_classes=[ShoppingListTextRenderer,
+                          ShoppingListCSVRenderer,
+                          ShoppingListJSONRenderer]
+    )
     def download_shopping_cart(self, request: Request):
         """
-        Получить список покупок в формате .txt.
+        Получить список покупок в формате .txt, .csv или .json.
+        Формат выбирается по заголовку Accept или параметру format,
+        по умолчанию .txt.
         Доступно только авторизованным пользователям.
         При создании списка повторяющиеся ингредиенты складываются.
         Пример:
@@ -235,19 +524,58 @@ class RecipeViewSet(ModelViewSet):
                 - Персики 2 шт.
             Список покупок:
                 - Персики - 5 шт.
+        Файл отдается потоком по мере чтения ингредиентов из базы.
+        В асинхронном режиме ингредиенты читаются в потоке пула заранее,
+        а цикл событий отдает файл по частям, не обращаясь к базе:
+        в памяти хранятся строки ингредиентов, но не весь файл.
         """
         user = request.user
         if user.shop_list.exists():
-            shopping_list = ShoppingListCreator(
-                user=user
-            ).create_shopping_list()
-            response = HttpResponse(shopping_list, content_type='text/plain')
+            renderer = request.accepted_renderer
+            response = StreamingHttpResponse(
+                ShoppingListCreator(user=user).render(
+                    renderer, prefetch=settings.ASYNC_VIEWS
+                ),
+                content_type=f'{renderer.media_type}; '
+                             f'charset={renderer.charset}'
+            )
             response['Content-Disposition'] = (
-                f'attachment; filename={user.username}_shopping_list.txt'
+                f'attachment; filename={user.username}_shopping_list.'
+                f'{renderer.format}'
             )
+            if settings.ASYNC_VIEWS:
+                stream_without_database(response)
             return response
 
         return Response(
             data={'errors': 'Список покупок пуст.'},
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+class DatabasePoolView(APIView):
+    """
+    Статистика пулов соединений с базой данных процесса,
+    обработавшего запрос.
+    Доступно только персоналу.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request):
+        return Response({key: pool.stats()
+                         for key, pool in get_pools().items()})
+
+
+class MetricsView(APIView):
+    """
+    Гистограммы времени и количества SQL-запросов по view и action
+    в текстовом формате Prometheus.
+    Доступно только персоналу.
+    """
+
+    permission_classes = [IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request: Request):
+        return Response(registry.export())
@@ -2,6 +2,7 @@
 ASGI config for foodgram_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+API views are served as async views unless ASYNC_VIEWS=False is set.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -12,5 +13,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_backend.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -0,0 +1,4 @@
+from api.async_views import async_urlpatterns
+from foodgram_backend.urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = async_urlpatterns(sync_urlpatterns)
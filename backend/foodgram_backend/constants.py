@@ -1,3 +1,6 @@
+from datetime import datetime, timezone
+
+
 class RecipeConstants:
 
     MAX_LEN_NAME = 200
@@ -5,6 +8,15 @@ class RecipeConstants:
     MAX_COOKING_TIME = 2880
 
 
+class RecipeImageConstants:
+
+    MAX_SIZE = 10 * 1024 * 1024
+    MAX_PIXELS = 40_000_000
+    ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+    DECODE_CHUNK_SIZE = 64 * 1024
+    MAX_HEADER_LEN = 64
+
+
 class TagConstants:
 
     MAX_LEN_NAME = 200
@@ -16,6 +28,7 @@ class IngredientConstants:
 
     MAX_LEN_NAME = 200
     MAX_LEN_UNIT = 200
+    SEARCH_RESULTS_LIMIT = 50
 
 
 class RecipeIngredientConstants:
@@ -27,3 +40,73 @@ class RecipeIngredientConstants:
 class FoodgramUserConstants:
 
     MAX_LEN_ROLE = 8
+
+
+class PaginationConstants:
+
+    PAGE_SIZE = 6
+    MAX_PAGE_SIZE = 100
+
+
+class CacheConstants:
+
+    RESPONSE_TTL = 60
+    STALE_TTL = 300
+    LOCK_TTL = 10
+    LOCK_WAIT = 0.5
+    LOCK_POLL_INTERVAL = 0.05
+
+
+class MetricsConstants:
+
+    PREFIX = 'foodgram_api'
+    DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                        10)
+    QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class SearchConstants:
+
+    POSTGRES_CONFIG = 'russian'
+    SQLITE_FTS_TABLE = 'recipes_recipe_fts'
+    NAME_WEIGHT = 10.0
+    TEXT_WEIGHT = 1.0
+
+
+class CookableConstants:
+
+    MAX_INGREDIENTS = 50
+    MAX_MISSING = 5
+    REBUILD_INTERVAL = 300
+
+
+class ShoppingListConstants:
+
+    UPSERT_BATCH_SIZE = 500
+
+
+class UserRecipesConstants:
+
+    MAX_BULK_RECIPES = 100
+
+
+class AuthConstants:
+
+    LOCAL_CACHE_SIZE = 10000
+    LOCAL_TTL = 10
+    SHARED_TTL = 300
+
+
+class FeedConstants:
+
+    MAX_ENTRIES = 500
+    TRIM_SLACK = 50
+    PULL_FOLLOWERS = 1000
+
+
+class RankingConstants:
+
+    FAVORITE_WEIGHT = 2.0
+    SHOPPING_CART_WEIGHT = 1.0
+    TRENDING_HALF_LIFE = 3 * 24 * 60 * 60
+    EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
@@ -0,0 +1,30 @@
+from django.db import router
+
+
+class CountersModelMixin:
+    """
+    Модель с денормализованными счетчиками COUNTER_FIELDS.
+    Счетчики изменяются только атомарными UPDATE, поэтому save()
+    существующего объекта их не записывает: иначе копия объекта,
+    прочитанная до изменения счетчика, перезапишет его старым значением.
+    Счетчик сохраняется, только если он явно указан в update_fields.
+    """
+
+    COUNTER_FIELDS = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        using = using or router.db_for_write(self.__class__, instance=self)
+        # Копирование объекта в другую базу записывает все поля.
+        if (update_fields is None and not force_insert
+                and not self._state.adding and self.pk is not None
+                and using == self._state.db):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+                and field.attname not in deferred
+            ]
+        super().save(force_insert=force_insert, force_update=force_update,
+                     using=using, update_fields=update_fields)
@@ -0,0 +1,251 @@
+import os
+import threading
+from collections import deque
+from time import monotonic
+
+# Пулы текущего процесса: {(alias, параметры подключения): ConnectionPool}.
+# После fork процесс создает свои пулы, унаследованные соединения
+# родителя не используются и не закрываются.
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """Нет свободного соединения за время ожидания."""
+
+
+class PooledConnection:
+    """Соединение пула и данные для его проверки и замены."""
+
+    __slots__ = ('connection', 'created', 'last_used', 'uses', 'owner')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.last_used = monotonic()
+        self.uses = 0
+        # Поток, получивший соединение.
+        self.owner = None
+
+
+def ping(connection) -> bool:
+    """Проверка соединения запросом SELECT 1."""
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    Пул соединений с базой данных одного процесса.
+    Параметры:
+        - max_size -- Максимальное число открытых соединений.
+        - timeout -- Время ожидания свободного соединения, с.
+        - max_uses -- Соединение закрывается после max_uses выдач,
+        0 -- без ограничения.
+        - max_lifetime -- Соединение закрывается через max_lifetime с
+        после открытия, 0 -- без ограничения.
+        - ping_interval -- Соединение, простаивавшее дольше ping_interval с,
+        перед выдачей проверяется функцией ping, 0 -- проверка при каждой
+        выдаче.
+    Безопасен для использования из нескольких потоков. Соединения
+    завершившихся потоков, не вернувшие их в пул, закрываются, когда
+    свободных соединений не остается.
+    """
+
+    def __init__(self, max_size=10, timeout=5.0, max_uses=0,
+                 max_lifetime=0.0, ping_interval=0.0, ping=ping):
+        if max_size < 1:
+            raise ValueError('max_size должен быть больше нуля.')
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self.ping = ping
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._condition = threading.Condition()
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.ping_failures = 0
+        self.reclaimed = 0
+
+    def acquire(self, connect):
+        """
+        Выдача соединения: свободного из пула или нового, созданного
+        вызовом connect(). Если открыто max_size соединений, ожидает
+        освобождения не дольше timeout, затем вызывает PoolTimeout.
+        """
+        deadline = monotonic() + self.timeout
+        while True:
+            item = self._take(deadline)
+            if item is None:
+                try:
+                    item = PooledConnection(connect())
+                except BaseException:
+                    self._discard(None)
+                    raise
+                with self._condition:
+                    self.created += 1
+            elif self.is_expired(item):
+                self._discard(item.connection, recycled=True)
+                continue
+            elif (monotonic() - item.last_used >= self.ping_interval
+                    and not self.ping(item.connection)):
+                with self._condition:
+                    self.ping_failures += 1
+                self._discard(item.connection)
+                continue
+            item.uses += 1
+            item.owner = threading.current_thread()
+            with self._condition:
+                self._in_use[id(item.connection)] = item
+            return item.connection
+
+    def release(self, connection, discard=False):
+        """
+        Возврат соединения в пул. Соединения с discard=True,
+        отработавшие max_uses или max_lifetime закрываются.
+        """
+        with self._condition:
+            item = self._in_use.pop(id(connection), None)
+            if item is not None and not discard and not self.is_expired(item):
+                item.last_used = monotonic()
+                self._idle.append(item)
+                self._condition.notify()
+                return
+        if item is None:
+            close_quietly(connection)
+        else:
+            self._discard(connection, recycled=not discard)
+
+    def close(self):
+        """Закрытие свободных соединений."""
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for item in idle:
+            close_quietly(item.connection)
+
+    def is_expired(self, item) -> bool:
+        return ((self.max_uses and item.uses >= self.max_uses)
+                or (self.max_lifetime
+                    and monotonic() - item.created >= self.max_lifetime))
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'size': self._size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 6),
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'recycled': self.recycled,
+                'ping_failures': self.ping_failures,
+                'reclaimed': self.reclaimed,
+            }
+
+    def _take(self, deadline):
+        """
+        Свободное соединение или None, если можно открыть новое.
+        Место под новое соединение резервируется сразу.
+        """
+        started = monotonic()
+        waited = False
+        orphans = []
+        try:
+            with self._condition:
+                try:
+                    while True:
+                        if self._idle:
+                            # Последнее возвращенное соединение: остальные
+                            # дольше простаивают и закрываются
+                            # по max_lifetime.
+                            return self._idle.pop()
+                        if self._size < self.max_size:
+                            self._size += 1
+                            return None
+                        if self._reclaim(orphans):
+                            continue
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise PoolTimeout(
+                                f'Нет свободного соединения за '
+                                f'{self.timeout} с, открыто {self._size} '
+                                f'из {self.max_size}.'
+                            )
+                        waited = True
+                        self._condition.wait(remaining)
+                finally:
+                    if waited:
+                        self.waits += 1
+                        self.wait_time += monotonic() - started
+        finally:
+            for connection in orphans:
+                close_quietly(connection)
+
+    def _reclaim(self, orphans) -> bool:
+        """
+        Освобождение мест соединений, выданных завершившимся потокам.
+        Такие соединения уже не вернутся в пул, они добавляются в orphans
+        для закрытия. Вызывается под блокировкой пула.
+        """
+        reclaimed = [key for key, item in self._in_use.items()
+                     if item.owner is not None and not item.owner.is_alive()]
+        for key in reclaimed:
+            orphans.append(self._in_use.pop(key).connection)
+        self._size -= len(reclaimed)
+        self.reclaimed += len(reclaimed)
+        self._condition.notify(len(reclaimed))
+        return bool(reclaimed)
+
+    def _discard(self, connection, recycled=False):
+        with self._condition:
+            self._size -= 1
+            self.recycled += recycled
+            self._condition.notify()
+        if connection is not None:
+            close_quietly(connection)
+
+
+def get_pool(key, **options) -> ConnectionPool:
+    """Пул текущего процесса по ключу, создается при первом обращении."""
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if key not in _pools:
+            _pools[key] = ConnectionPool(**options)
+        return _pools[key]
+
+
+def get_pools() -> dict:
+    """Пулы текущего процесса."""
+    with _pools_lock:
+        return dict(_pools) if _pools_pid == os.getpid() else {}
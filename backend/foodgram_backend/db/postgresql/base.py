@@ -0,0 +1,103 @@
+"""
+PostgreSQL с пулом соединений процесса.
+Соединение берется из пула при подключении и возвращается в пул
+вместо закрытия в конце запроса, поэтому CONN_MAX_AGE может оставаться
+равным 0. Параметры пула задаются в DATABASES[alias]['POOL']:
+MAX_SIZE, TIMEOUT, MAX_USES, MAX_LIFETIME, PING_INTERVAL
+(см. foodgram_backend.db.pool.ConnectionPool).
+"""
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import DatabaseCreation
+from django.utils.asyncio import async_unsafe
+from psycopg2 import extensions
+
+from foodgram_backend.db.pool import PoolTimeout, get_pool, get_pools
+
+Database = base.Database
+
+
+def ping(connection) -> bool:
+    """Проверка соединения без изменения состояния транзакции."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not connection.autocommit:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+def reset(connection) -> bool:
+    """
+    Завершение открытой транзакции перед возвратом в пул.
+    Возвращает False, если соединение нельзя использовать повторно.
+    """
+    if connection.closed:
+        return False
+    try:
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+class PooledDatabaseCreation(DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Свободные соединения пула не дают удалить тестовую базу.
+        for key, pool in get_pools().items():
+            if key.endswith(f'/{test_database_name}'):
+                pool.close()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = PooledDatabaseCreation
+
+    @property
+    def pool(self):
+        conn_params = self.get_connection_params()
+        options = self.settings_dict.get('POOL', {})
+        return get_pool(
+            f'{self.alias}:{conn_params.get("host", "")}:'
+            f'{conn_params.get("port", "")}/{conn_params["database"]}',
+            max_size=options.get('MAX_SIZE', 10),
+            timeout=options.get('TIMEOUT', 5.0),
+            max_uses=options.get('MAX_USES', 0),
+            max_lifetime=options.get('MAX_LIFETIME', 0.0),
+            ping_interval=options.get('PING_INTERVAL', 0.0),
+            ping=ping,
+        )
+
+    def uses_pool(self):
+        # Служебные подключения к базе postgres при создании и удалении
+        # тестовой базы в пул не попадают.
+        return self.alias != NO_DB_ALIAS
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        if not self.uses_pool():
+            return super().get_new_connection(conn_params)
+        try:
+            connection = self.pool.acquire(
+                lambda: super(DatabaseWrapper, self).get_new_connection(
+                    conn_params
+                )
+            )
+        except PoolTimeout as error:
+            raise Database.OperationalError(str(error)) from error
+        self.isolation_level = connection.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is None or not self.uses_pool():
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.release(self.connection,
+                              discard=not reset(self.connection))
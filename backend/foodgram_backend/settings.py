@@ -18,6 +18,15 @@ DB_PROD = env.bool('DB_PROD')
 
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS')
 
+# Асинхронные представления API, включаются в foodgram_backend.asgi.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', False)
+
+ASYNC_VIEWS_THREADS = env.int('ASYNC_VIEWS_THREADS', 8)
+
+# Число процессов gunicorn, gunicorn читает ту же переменную окружения.
+# Несколько процессов требуют общего кэша CACHES['default'].
+WEB_CONCURRENCY = env.int('WEB_CONCURRENCY', 1)
+
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -36,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -46,7 +57,8 @@ MIDDLEWARE = [
 ]
 
 
-ROOT_URLCONF = 'foodgram_backend.urls'
+ROOT_URLCONF = ('foodgram_backend.async_urls' if ASYNC_VIEWS
+                else 'foodgram_backend.urls')
 
 TEMPLATES = [
     {
@@ -69,12 +81,21 @@ WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
 if DB_PROD:
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            'ENGINE': ('foodgram_backend.db.postgresql'
+                       if env.bool('DB_POOL', True)
+                       else 'django.db.backends.postgresql'),
             'NAME': env.str('POSTGRES_DB', 'django'),
             'USER': env.str('POSTGRES_USER', 'django'),
             'PASSWORD': env.str('POSTGRES_PASSWORD', ''),
             'HOST': env.str('DB_HOST', ''),
-            'PORT': env.int('DB_PORT', 5432)
+            'PORT': env.int('DB_PORT', 5432),
+            'POOL': {
+                'MAX_SIZE': env.int('DB_POOL_MAX_SIZE', 10),
+                'TIMEOUT': env.float('DB_POOL_TIMEOUT', 5.0),
+                'MAX_USES': env.int('DB_POOL_MAX_USES', 10000),
+                'MAX_LIFETIME': env.float('DB_POOL_MAX_LIFETIME', 1800.0),
+                'PING_INTERVAL': env.float('DB_POOL_PING_INTERVAL', 0.0),
+            },
         }
     }
 
@@ -95,6 +116,34 @@ else:
     MEDIA_URL = '/media/'
     MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Реплики для чтения: хосты PostgreSQL или, локально, файлы SQLite
+# с копией основной базы.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(env.list('DB_REPLICAS', []), start=1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        ('HOST' if DB_PROD else 'NAME'): (replica if DB_PROD
+                                          else BASE_DIR / replica),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+# Сколько секунд после изменяющего запроса клиент читает из основной базы.
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', 5)
+
+
+CACHES = {
+    'default': {
+        'BACKEND': env.str(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': env.str('CACHE_LOCATION', ''),
+    }
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -130,10 +179,13 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
 }
 
+# Хранить токены и пользователей также в общем кэше CACHES['default'].
+TOKEN_CACHE_SHARED = env.bool('TOKEN_CACHE_SHARED', False)
+
 AUTH_USER_MODEL = 'users.FoodgramUser'
 DJOSER = {
     'LOGIN_FIELD': 'email',
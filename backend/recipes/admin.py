@@ -1,5 +1,7 @@
 from django.contrib import admin
 
+from api.services import ShoppingListAggregator
+from api.signals import recipe_ingredients_changed
 from .models import (Recipe,
                      Tag,
                      Ingredient,
@@ -46,10 +48,27 @@ class RecipeFoodgramAdmin(BaseFoodgramAdmin):
     filter_horizontal = ('tags',)
     search_fields = ('name', 'id', 'author__username')
 
-    @admin.display(description='Добавлений в избранное')
+    def save_related(self, request, form, formsets, change):
+        """
+        Сохранение связанных объектов.
+        Метод переопределен для обновления списков покупок
+        после изменения ингредиентов рецепта.
+        """
+        recipe = form.instance
+        old_amounts = ShoppingListAggregator.get_amounts(recipe.id)
+        super().save_related(request, form, formsets, change)
+        new_amounts = ShoppingListAggregator.get_amounts(recipe.id)
+        if old_amounts != new_amounts:
+            recipe_ingredients_changed.send(sender=Recipe,
+                                            recipe=recipe,
+                                            old_amounts=old_amounts,
+                                            new_amounts=new_amounts)
+
+    @admin.display(description='Добавлений в избранное',
+                   ordering='favorites_count')
     def favorite_count(self, recipe: Recipe):
         """Счетчик добавлений рецепта в избранное."""
-        return recipe.favorites.count()
+        return recipe.favorites_count
 
     @admin.display(description='Ингредиенты')
     def ingredients_in_recipe(self, recipe: Recipe):
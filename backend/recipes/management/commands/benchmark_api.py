@@ -0,0 +1,448 @@
+import base64
+import itertools
+import json
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from io import BytesIO, StringIO
+from pathlib import Path
+from typing import Callable, Optional
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+
+@dataclass
+class Scenario:
+    """
+    Запрос к API, время которого измеряется.
+    setup и teardown выполняются вне замера перед и после каждого
+    запроса, чтобы изменяющие запросы можно было повторять.
+    """
+
+    name: str
+    method: str
+    path: str
+    status: int
+    data: Optional[Callable[[int], dict]] = None
+    content_type: Optional[str] = None
+    auth: bool = True
+    setup: Optional[Callable[[], None]] = None
+    teardown: Optional[Callable[[], None]] = None
+
+
+class Command(BaseCommand):
+    help = ('Замер времени, количества SQL-запросов, размера ответа '
+            'и выделенной памяти для маршрутов API на тестовой базе '
+            'с сгенерированными данными. Результат выводится в JSON.')
+
+    BATCH_SIZE = 1000
+    BENCHMARK_PASSWORD = 'benchmark-password'
+    FOLLOWS = 20
+    FAVORITES = 30
+    SHOPPING_LIST = 10
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Количество замеров каждого запроса.')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Количество запросов перед замерами.')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Начальное значение генератора данных.')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Количество пользователей.')
+        parser.add_argument('--recipes', type=int, default=1000,
+                            help='Количество рецептов.')
+        parser.add_argument('--only', default='',
+                            help='Замерять только запросы, в имени '
+                                 'которых есть эта строка.')
+        parser.add_argument('--save', type=Path,
+                            help='Сохранить результат в файл.')
+        parser.add_argument('--compare', type=Path,
+                            help='Сравнить результат с сохраненным.')
+        parser.add_argument('--threshold', type=float, default=25.0,
+                            help='Допустимый рост p50 в процентах.')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Завершиться с ошибкой при регрессии.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('Нужно хотя бы два замера.')
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     aliases={'default'})
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root,
+                CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.'
+                               'LocMemCache',
+                    'LOCATION': 'benchmark',
+                }}
+            ):
+                self.seed(options['seed'], options['users'],
+                          options['recipes'])
+                report = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+        if options['save']:
+            options['save'].write_text(
+                json.dumps(report, indent=2, ensure_ascii=False) + '\n',
+                encoding='utf-8'
+            )
+        if options['compare']:
+            return self.compare(report, options)
+        return json.dumps(report, indent=2, ensure_ascii=False)
+
+    def seed(self, seed, users_count, recipes_count):
+        """Детерминированное заполнение базы."""
+        rnd = random.Random(seed)
+        call_command('loadcsvdata', '--noinput', stdout=StringIO())
+        password = make_password(self.BENCHMARK_PASSWORD)
+        User.objects.bulk_create(
+            (User(username=f'user{number}', email=f'user{number}@ya.ru',
+                  first_name='Имя', last_name='Фамилия', password=password)
+             for number in range(users_count)),
+            batch_size=self.BATCH_SIZE
+        )
+        user_ids = list(User.objects.order_by('id')
+                        .values_list('id', flat=True))
+        Recipe.objects.bulk_create(
+            (Recipe(name=f'Рецепт {number}', text='Описание рецепта. ' * 20,
+                    image='recipes/images/benchmark.png',
+                    cooking_time=rnd.randint(1, 120),
+                    author_id=rnd.choice(user_ids))
+             for number in range(recipes_count)),
+            batch_size=self.BATCH_SIZE
+        )
+        recipe_ids = list(Recipe.objects.order_by('id')
+                          .values_list('id', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        RecipeIngredient.objects.bulk_create(
+            (RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                              amount=rnd.randint(1, 500))
+             for recipe_id in recipe_ids
+             for ingredient_id in rnd.sample(ingredient_ids,
+                                             rnd.randint(3, 10))),
+            batch_size=self.BATCH_SIZE
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+             for recipe_id in recipe_ids
+             for tag_id in rnd.sample(tag_ids, rnd.randint(1, len(tag_ids)))),
+            batch_size=self.BATCH_SIZE
+        )
+        reader_id = user_ids[0]
+        Follow.objects.bulk_create(
+            Follow(user_id=reader_id, following_id=following_id)
+            for following_id in rnd.sample(user_ids[1:], self.FOLLOWS)
+        )
+        for model, count in ((Favorites, self.FAVORITES),
+                             (ShoppingList, self.SHOPPING_LIST)):
+            model.objects.bulk_create(
+                model(user_id=reader_id, recipe_id=recipe_id)
+                for recipe_id in rnd.sample(recipe_ids, count)
+            )
+        call_command('reconcile_counters', stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+
+    def get_scenarios(self):
+        reader = User.objects.order_by('id').first()
+        own_recipe = Recipe.objects.filter(author=reader).first()
+        if own_recipe is None:
+            own_recipe = Recipe.objects.first()
+            own_recipe.author = reader
+            own_recipe.save()
+        author = Follow.objects.filter(user=reader).first().following
+        stranger = User.objects.exclude(pk=reader.pk).exclude(
+            pk__in=Follow.objects.filter(user=reader).values('following')
+        ).first()
+        recipe = Recipe.objects.exclude(
+            pk__in=Favorites.objects.filter(user=reader).values('recipe')
+        ).exclude(
+            pk__in=ShoppingList.objects.filter(user=reader).values('recipe')
+        ).first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        ingredient = Ingredient.objects.first()
+        recipe_data = {
+            'tags': list(Tag.objects.values_list('id', flat=True)[:2]),
+            'ingredients': [{'id': ingredient_id, 'amount': 10}
+                            for ingredient_id in Ingredient.objects
+                            .values_list('id', flat=True)[:5]],
+            'text': 'Описание',
+            'cooking_time': 15,
+        }
+        image = get_image()
+        image_data = base64.b64decode(image.partition(',')[2])
+
+        scenarios = [
+            Scenario('tags:list', 'get', reverse('api:tag-list'), 200),
+            Scenario('tags:detail', 'get',
+                     reverse('api:tag-detail', args=(Tag.objects.first().id,)),
+                     200),
+            Scenario('ingredients:list', 'get',
+                     reverse('api:ingredient-list'), 200),
+            Scenario('ingredients:search', 'get',
+                     reverse('api:ingredient-list') + '?name=сах', 200),
+            Scenario('ingredients:detail', 'get',
+                     reverse('api:ingredient-detail', args=(ingredient.id,)),
+                     200),
+            Scenario('recipes:list:anonymous', 'get',
+                     reverse('api:recipe-list'), 200, auth=False),
+            Scenario('recipes:list:anonymous:cold', 'get',
+                     reverse('api:recipe-list'), 200, auth=False,
+                     setup=cache.clear),
+            Scenario('recipes:list:cursor', 'get',
+                     reverse('api:recipe-list') + '?cursor=', 200),
+            Scenario('recipes:detail', 'get',
+                     reverse('api:recipe-detail', args=(recipe.id,)), 200),
+            Scenario('recipes:detail:anonymous', 'get',
+                     reverse('api:recipe-detail', args=(recipe.id,)), 200,
+                     auth=False, setup=cache.clear),
+        ]
+        filters = {
+            'tags': '&'.join(f'tags={slug}' for slug in tags),
+            'author': f'author={author.id}',
+            'is_favorited': 'is_favorited=1',
+            'is_in_shopping_cart': 'is_in_shopping_cart=1',
+        }
+        for size in range(1, len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                scenarios.append(Scenario(
+                    f'recipes:list?{"&".join(names)}', 'get',
+                    reverse('api:recipe-list') + '?' + '&'.join(
+                        filters[name] for name in names
+                    ),
+                    200
+                ))
+
+        def delete_created_recipe():
+            for created in Recipe.objects.filter(
+                author=reader, name__startswith='Новый рецепт'
+            ):
+                created.delete()
+
+        scenarios += [
+            Scenario('recipes:create', 'post', reverse('api:recipe-list'),
+                     201,
+                     data=lambda number: {**recipe_data, 'image': image,
+                                          'name': f'Новый рецепт {number}'},
+                     teardown=delete_created_recipe),
+            Scenario('recipes:update', 'patch',
+                     reverse('api:recipe-detail', args=(own_recipe.id,)), 200,
+                     data=lambda number: {**recipe_data,
+                                          'name': f'Изменен {number}',
+                                          'cooking_time': number % 100 + 1}),
+            Scenario('recipes:image', 'put',
+                     reverse('api:recipe-image', args=(own_recipe.id,)), 200,
+                     data=lambda number: image_data,
+                     content_type='image/png'),
+        ]
+        for model, name in ((Favorites, 'favorite'),
+                            (ShoppingList, 'shopping_cart')):
+            url = reverse(f'api:recipe-{name.replace("_", "-")}',
+                          args=(recipe.id,))
+            relation = model.objects.filter(user=reader, recipe=recipe)
+            scenarios += [
+                Scenario(f'recipes:{name}:add', 'post', url, 201,
+                         teardown=relation.delete),
+                Scenario(f'recipes:{name}:remove', 'delete', url, 204,
+                         setup=lambda model=model: model.objects.create(
+                             user=reader, recipe=recipe
+                         )),
+            ]
+        download_url = reverse('api:recipe-download-shopping-cart')
+        scenarios += [
+            Scenario(f'recipes:download_shopping_cart:{extension}', 'get',
+                     f'{download_url}?format={extension}', 200)
+            for extension in ('txt', 'csv', 'json')
+        ]
+        subscribe_url = reverse('api:foodgramuser-subscribe',
+                                args=(stranger.id,))
+        follow = Follow.objects.filter(user=reader, following=stranger)
+        new_users = User.objects.filter(username__startswith='new')
+        users_url = reverse('api:foodgramuser-list')
+
+        def new_user_data(number):
+            return {'username': f'new{number}', 'email': f'new{number}@ya.ru',
+                    'first_name': 'Имя', 'last_name': 'Фамилия',
+                    'password': self.BENCHMARK_PASSWORD}
+
+        def login_data(number):
+            return {'email': reader.email,
+                    'password': self.BENCHMARK_PASSWORD}
+
+        scenarios += [
+            Scenario('users:list', 'get', users_url, 200),
+            Scenario('users:detail', 'get',
+                     reverse('api:foodgramuser-detail', args=(author.id,)),
+                     200),
+            Scenario('users:me', 'get', reverse('api:foodgramuser-me'), 200),
+            Scenario('users:create', 'post', users_url, 201, auth=False,
+                     data=new_user_data, teardown=new_users.delete),
+            Scenario('users:subscriptions', 'get',
+                     reverse('api:foodgramuser-subscriptions'), 200),
+            Scenario('users:subscribe:add', 'post', subscribe_url, 201,
+                     teardown=follow.delete),
+            Scenario('users:subscribe:remove', 'delete', subscribe_url, 204,
+                     setup=lambda: Follow.objects.create(
+                         user=reader, following=stranger
+                     )),
+            Scenario('auth:token:login', 'post', reverse('api:login'), 200,
+                     auth=False,
+                     data=login_data),
+        ]
+        return reader, scenarios
+
+    def run(self, options):
+        reader, scenarios = self.get_scenarios()
+        token, _ = Token.objects.get_or_create(user=reader)
+        endpoints = {}
+        for scenario in scenarios:
+            if options['only'] not in scenario.name:
+                continue
+            client = APIClient()
+            if scenario.auth:
+                client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+            endpoints[scenario.name] = self.measure(
+                client, scenario, options['warmup'], options['iterations']
+            )
+            self.stderr.write(
+                f'{scenario.name}: '
+                f'{endpoints[scenario.name]["p50_ms"]} мс', ending='\n'
+            )
+        return {
+            'meta': {
+                'seed': options['seed'],
+                'users': options['users'],
+                'recipes': options['recipes'],
+                'iterations': options['iterations'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'endpoints': endpoints,
+        }
+
+    @staticmethod
+    def request(client, scenario, number):
+        data = scenario.data(number) if scenario.data else None
+        if scenario.content_type:
+            response = getattr(client, scenario.method)(
+                scenario.path, data, content_type=scenario.content_type
+            )
+        else:
+            response = getattr(client, scenario.method)(scenario.path, data,
+                                                        format='json')
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        if response.status_code != scenario.status:
+            raise CommandError(
+                f'{scenario.name}: ответ {response.status_code}, '
+                f'ожидался {scenario.status}: {content[:500]!r}'
+            )
+        return content
+
+    def measure(self, client, scenario, warmup, iterations):
+        timings = []
+        queries = []
+        size = 0
+        for number in range(warmup + iterations):
+            if scenario.setup:
+                scenario.setup()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                content = self.request(client, scenario, number)
+                elapsed = time.perf_counter() - started
+            if scenario.teardown:
+                scenario.teardown()
+            if number >= warmup:
+                timings.append(elapsed * 1000)
+                queries.append(len(context.captured_queries))
+                size = len(content)
+        if scenario.setup:
+            scenario.setup()
+        tracemalloc.start()
+        try:
+            self.request(client, scenario, warmup + iterations)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        if scenario.teardown:
+            scenario.teardown()
+        percentiles = statistics.quantiles(timings, n=100,
+                                           method='inclusive')
+        return {
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'queries': max(queries),
+            'bytes': size,
+            'alloc_peak_bytes': peak,
+        }
+
+    def compare(self, report, options):
+        """Сравнение с сохраненным результатом."""
+        baseline = json.loads(options['compare'].read_text(encoding='utf-8'))
+        lines = []
+        regressions = []
+        for name, current in report['endpoints'].items():
+            previous = baseline['endpoints'].get(name)
+            if previous is None:
+                lines.append(f'{name}: новый, p50 {current["p50_ms"]} мс, '
+                             f'запросов {current["queries"]}')
+                continue
+            change = ((current['p50_ms'] - previous['p50_ms'])
+                      / max(previous['p50_ms'], 1e-9) * 100)
+            line = (f'{name}: p50 {previous["p50_ms"]} -> '
+                    f'{current["p50_ms"]} мс ({change:+.1f}%), '
+                    f'запросов {previous["queries"]} -> '
+                    f'{current["queries"]}, байт {previous["bytes"]} -> '
+                    f'{current["bytes"]}')
+            if (change > options['threshold']
+                    or current['queries'] > previous['queries']):
+                line += ' РЕГРЕССИЯ'
+                regressions.append(name)
+            lines.append(line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError('\n'.join(
+                lines + [f'Регрессии: {", ".join(regressions)}.']
+            ))
+        return '\n'.join(lines)
+
+
+def get_image():
+    """Изображение рецепта в base64 для запросов на создание."""
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), color='orange').save(buffer, format='PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
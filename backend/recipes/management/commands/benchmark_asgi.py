@@ -0,0 +1,378 @@
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_databases,
+                               setup_test_environment, teardown_databases,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.reverse import reverse
+
+from api.async_views import shutdown_executor
+from recipes.models import Ingredient, Recipe, RecipeIngredient, ShoppingList
+
+User = get_user_model()
+
+
+class SlowInput:
+    """wsgi.input клиента, передающего тело запроса upload_time секунд."""
+
+    def __init__(self, body, upload_time):
+        self.body = BytesIO(body)
+        self.upload_time = upload_time
+
+    def read(self, size=-1):
+        if self.upload_time:
+            time.sleep(self.upload_time)
+            self.upload_time = 0
+        return self.body.read(size)
+
+    def readline(self, size=-1):
+        return self.body.readline(size)
+
+
+class Command(BaseCommand):
+    help = ('Сравнение пропускной способности WSGI с синхронными '
+            'воркерами, ASGI с синхронными представлениями и ASGI '
+            'с асинхронными представлениями (api.async_views) при '
+            'медленных клиентах: загрузка изображения рецепта '
+            'и скачивание списка покупок. Одновременно быстрый клиент '
+            'с постоянным интервалом запрашивает список тегов. Запросы '
+            'выполняются в процессе на тестовой базе, без сети '
+            'и обратного прокси.')
+
+    MODES = ('wsgi', 'asgi-sync', 'asgi')
+    ASGI_BODY_CHUNKS = 10
+    RECIPES_PER_USER = 5
+    CART_SIZE = 20
+    INGREDIENTS = 100
+    FAST_INTERVAL = 0.05
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=32,
+                            help='Количество одновременных медленных '
+                                 'клиентов.')
+        parser.add_argument('--requests', type=int, default=4,
+                            help='Количество запросов каждого клиента.')
+        parser.add_argument('--upload-time', type=float, default=0.5,
+                            help='Время передачи тела запроса, с.')
+        parser.add_argument('--download-time', type=float, default=0.5,
+                            help='Время чтения ответа клиентом, с.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Количество синхронных воркеров WSGI '
+                                 'и потоков пула ASGI.')
+        parser.add_argument('--modes', default=','.join(self.MODES),
+                            help='Режимы через запятую: '
+                                 f'{", ".join(self.MODES)}.')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Начальное значение генератора данных.')
+
+    def handle(self, *args, **options):
+        modes = [mode for mode in options['modes'].split(',') if mode]
+        unknown = set(modes) - set(self.MODES)
+        if unknown:
+            raise CommandError(f'Неизвестные режимы: {", ".join(unknown)}.')
+        if min(options['clients'], options['requests'],
+               options['workers']) < 1:
+            raise CommandError('Количество клиентов, запросов и воркеров '
+                               'должно быть больше нуля.')
+        media_root = tempfile.mkdtemp()
+        test_settings = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            # Общая база в файле, а не в памяти: запросы выполняются
+            # из нескольких потоков.
+            test_settings['TEST']['NAME'] = os.path.join(media_root,
+                                                         'benchmark.sqlite3')
+            test_settings['OPTIONS'].setdefault('timeout', 60)
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     aliases={'default'})
+        try:
+            with override_settings(MEDIA_ROOT=media_root,
+                                   ASYNC_VIEWS_THREADS=options['workers']):
+                self.seed(options['seed'], options['clients'])
+                report = {mode: self.run(mode, options) for mode in modes}
+        finally:
+            shutdown_executor()
+            connection.close()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+        return json.dumps({'options': {
+            key: options[key] for key in ('clients', 'requests', 'workers',
+                                          'upload_time', 'download_time')
+        }, 'results': report}, indent=2, ensure_ascii=False)
+
+    def seed(self, seed, clients):
+        """Пользователи с рецептами и списками покупок."""
+        rnd = random.Random(seed)
+        password = make_password(None)
+        User.objects.bulk_create(
+            User(username=f'slow{number}', email=f'slow{number}@example.com',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for number in range(clients)
+        )
+        users = list(User.objects.filter(username__startswith='slow'))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(self.INGREDIENTS)
+        )
+        ingredients = list(Ingredient.objects.all())
+        Recipe.objects.bulk_create(
+            Recipe(name=f'Рецепт {user.id}-{number}', text='Описание',
+                   cooking_time=10, image='recipes/images/benchmark.png',
+                   author=user)
+            for user in users for number in range(self.RECIPES_PER_USER)
+        )
+        recipes = list(Recipe.objects.all())
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=rnd.randint(1, 500))
+            for recipe in recipes
+            for ingredient in rnd.sample(ingredients, 8)
+        )
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=user, recipe=recipe)
+            for user in users
+            for recipe in rnd.sample(recipes, min(self.CART_SIZE,
+                                                  len(recipes)))
+        )
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        first_recipes = dict(Recipe.objects.order_by(
+            '-id'
+        ).values_list('author_id', 'id'))
+        self.clients = [(Token.objects.create(user=user).key,
+                         first_recipes[user.id])
+                        for user in users]
+        buffer = BytesIO()
+        Image.frombytes(
+            'RGB', (256, 256), rnd.randbytes(256 * 256 * 3)
+        ).save(buffer, format='PNG')
+        self.image = buffer.getvalue()
+
+    def get_requests(self, client_number, options):
+        """Запросы медленного клиента: (метод, путь, тело, заголовки)."""
+        token, recipe_id = self.clients[client_number]
+        headers = {'authorization': f'Token {token}'}
+        upload = ('PUT', reverse('api:recipe-image', args=(recipe_id,)),
+                  self.image, {**headers, 'content-type': 'image/png'})
+        download = ('GET', reverse('api:recipe-download-shopping-cart'),
+                    b'', {**headers, 'accept': 'text/csv'})
+        return [(upload if number % 2 else download)
+                for number in range(client_number,
+                                    client_number + options['requests'])]
+
+    def run(self, mode, options):
+        shutdown_executor()
+        if mode == 'asgi':
+            context = override_settings(
+                ASYNC_VIEWS=True,
+                ROOT_URLCONF='foodgram_backend.async_urls'
+            )
+        else:
+            context = override_settings(ASYNC_VIEWS=False)
+        with context:
+            started = time.perf_counter()
+            if mode == 'wsgi':
+                slow, fast = self.run_wsgi(options)
+            else:
+                slow, fast = asyncio.run(self.run_asgi(options))
+            elapsed = time.perf_counter() - started
+        shutdown_executor()
+        latencies = [latency for latency, _ in slow]
+        return {
+            'requests': len(slow),
+            'errors': sum(not 200 <= code < 300 for _, code in slow),
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(slow) / elapsed, 2),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'fast_requests': len(fast),
+            'fast_p50_ms': percentile(fast, 50),
+            'fast_p95_ms': percentile(fast, 95),
+        }
+
+    def run_wsgi(self, options):
+        """
+        Синхронные воркеры: поток воркера занят все время запроса,
+        включая прием тела и отправку ответа медленному клиенту.
+        """
+        handler = WSGIHandler()
+        slow, fast = [], []
+        done = threading.Event()
+
+        def request(method, path, body, headers, upload_time, download_time):
+            environ = {
+                'REQUEST_METHOD': method,
+                'PATH_INFO': path,
+                'QUERY_STRING': '',
+                'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'CONTENT_LENGTH': str(len(body)),
+                'CONTENT_TYPE': headers.get('content-type', ''),
+                'wsgi.version': (1, 0),
+                'wsgi.url_scheme': 'http',
+                'wsgi.input': SlowInput(body, upload_time),
+                'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            for name, value in headers.items():
+                if name != 'content-type':
+                    environ[f'HTTP_{name.upper()}'] = value
+            status = []
+            result = handler(environ,
+                             lambda code, *args: status.append(code))
+            try:
+                for _ in result:
+                    pass
+            finally:
+                result.close()
+            time.sleep(download_time)
+            return int(status[0].split()[0])
+
+        with ThreadPoolExecutor(options['workers']) as workers:
+
+            def slow_client(number):
+                for method, path, body, headers in self.get_requests(
+                        number, options):
+                    started = time.perf_counter()
+                    code = workers.submit(
+                        request, method, path, body, headers,
+                        options['upload_time'] if body else 0,
+                        options['download_time']
+                    ).result()
+                    slow.append((elapsed_ms(started), code))
+
+            def fast_client():
+                path = reverse('api:tag-list')
+                while not done.is_set():
+                    started = time.perf_counter()
+                    workers.submit(request, 'GET', path, b'', {}, 0,
+                                   0).result()
+                    fast.append(elapsed_ms(started))
+                    done.wait(self.FAST_INTERVAL)
+
+            clients = [threading.Thread(target=slow_client, args=(number,))
+                       for number in range(options['clients'])]
+            probe = threading.Thread(target=fast_client)
+            probe.start()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            done.set()
+            probe.join()
+        return slow, fast
+
+    async def run_asgi(self, options):
+        """
+        ASGI: тело запроса принимается и ответ отправляется в цикле
+        событий, поток занят только выполнением представления.
+        """
+        handler = ASGIHandler()
+        slow, fast = [], []
+        done = asyncio.Event()
+
+        async def request(method, path, body, headers, upload_time,
+                          download_time):
+            size = -(-len(body) // self.ASGI_BODY_CHUNKS) or 1
+            chunks = [body[start:start + size]
+                      for start in range(0, len(body), size)] or [b'']
+            status = []
+
+            async def receive():
+                if not chunks:
+                    await asyncio.Future()
+                await asyncio.sleep(upload_time / self.ASGI_BODY_CHUNKS)
+                chunk = chunks.pop(0)
+                return {'type': 'http.request', 'body': chunk,
+                        'more_body': bool(chunks)}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body'):
+                    await asyncio.sleep(download_time)
+
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': method,
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': b'',
+                'root_path': '',
+                'headers': [(b'host', b'testserver'),
+                            (b'content-length', str(len(body)).encode()),
+                            *((name.encode(), value.encode())
+                              for name, value in headers.items())],
+                'client': ('127.0.0.1', 0),
+                'server': ('testserver', 80),
+            }
+            try:
+                await handler(scope, receive, send)
+            except Exception:
+                # Django 3.2 перебирает потоковый ответ синхронного
+                # представления в цикле событий, запросы к базе
+                # в нем завершаются SynchronousOnlyOperation.
+                return 500
+            return status[0]
+
+        async def slow_client(number):
+            for method, path, body, headers in self.get_requests(number,
+                                                                 options):
+                started = time.perf_counter()
+                code = await request(method, path, body, headers,
+                                     options['upload_time'] if body else 0,
+                                     options['download_time'])
+                slow.append((elapsed_ms(started), code))
+
+        async def fast_client():
+            path = reverse('api:tag-list')
+            while not done.is_set():
+                started = time.perf_counter()
+                await request('GET', path, b'', {}, 0, 0)
+                fast.append(elapsed_ms(started))
+                await asyncio.sleep(self.FAST_INTERVAL)
+
+        probe = asyncio.ensure_future(fast_client())
+        await asyncio.gather(*(slow_client(number)
+                               for number in range(options['clients'])))
+        done.set()
+        await probe
+        return slow, fast
+
+
+def elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return round(values[0], 2)
+    return round(statistics.quantiles(values, n=100,
+                                      method='inclusive')[percent - 1], 2)
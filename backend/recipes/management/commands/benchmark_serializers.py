@@ -0,0 +1,139 @@
+import json
+import random
+import statistics
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import RecipeFastReadSerializer, RecipeReadSerializer
+from api.views import RecipeViewSet
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Сравнение времени сериализации и рендеринга списка рецептов '
+            'RecipeReadSerializer и RecipeFastReadSerializer. Рецепты '
+            'загружаются выборкой RecipeViewSet до замера, поэтому '
+            'измеряется только построение ответа.')
+
+    BATCH_SIZE = 1000
+    USERS = 50
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limits', type=int, nargs='+',
+                            default=[6, 50, 500],
+                            help='Размеры страниц.')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Количество замеров каждого размера.')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Начальное значение генератора данных.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('Нужно хотя бы два замера.')
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     aliases={'default'})
+        try:
+            reader = self.seed(options['seed'], max(options['limits']))
+            report = {
+                limit: self.measure(reader, limit, options['iterations'])
+                for limit in options['limits']
+            }
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+        return json.dumps(report, indent=2, ensure_ascii=False)
+
+    def seed(self, seed, recipes_count):
+        """Заполнение базы, возвращает пользователя с подписками."""
+        rnd = random.Random(seed)
+        call_command('loadcsvdata', '--noinput', stdout=StringIO())
+        User.objects.bulk_create(
+            User(username=f'user{number}', email=f'user{number}@ya.ru',
+                 first_name='Имя', last_name='Фамилия')
+            for number in range(self.USERS)
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        Recipe.objects.bulk_create(
+            (Recipe(name=f'Рецепт {number}', text='Описание рецепта. ' * 20,
+                    image='recipes/images/benchmark.png',
+                    cooking_time=rnd.randint(1, 120),
+                    author_id=rnd.choice(user_ids))
+             for number in range(recipes_count)),
+            batch_size=self.BATCH_SIZE
+        )
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        RecipeIngredient.objects.bulk_create(
+            (RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                              amount=rnd.randint(1, 500))
+             for recipe_id in recipe_ids
+             for ingredient_id in rnd.sample(ingredient_ids,
+                                             rnd.randint(3, 10))),
+            batch_size=self.BATCH_SIZE
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+             for recipe_id in recipe_ids
+             for tag_id in rnd.sample(tag_ids, rnd.randint(1, len(tag_ids)))),
+            batch_size=self.BATCH_SIZE
+        )
+        reader = User.objects.get(pk=user_ids[0])
+        Follow.objects.bulk_create(
+            Follow(user=reader, following_id=following_id)
+            for following_id in rnd.sample(user_ids[1:], self.USERS // 5)
+        )
+        for model in (Favorites, ShoppingList):
+            model.objects.bulk_create(
+                model(user=reader, recipe_id=recipe_id)
+                for recipe_id in rnd.sample(recipe_ids, len(recipe_ids) // 5)
+            )
+        return reader
+
+    def measure(self, reader, limit, iterations):
+        request = Request(APIRequestFactory().get(reverse('api:recipe-list')))
+        request.user = reader
+        view = RecipeViewSet(action='list', request=request,
+                             format_kwarg=None, kwargs={})
+        recipes = list(view.get_queryset()[:limit])
+        context = view.get_serializer_context()
+        renderer = JSONRenderer()
+        result = {}
+        contents = set()
+        for serializer_class in (RecipeReadSerializer,
+                                 RecipeFastReadSerializer):
+            timings = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                content = renderer.render(serializer_class(
+                    recipes, many=True, context=context
+                ).data)
+                timings.append((time.perf_counter() - started) * 1000)
+            contents.add(content)
+            result[serializer_class.__name__] = {
+                'p50_ms': round(statistics.median(timings), 3),
+                'min_ms': round(min(timings), 3),
+                'bytes': len(content),
+            }
+        if len(contents) > 1:
+            raise CommandError(f'limit={limit}: ответы различаются.')
+        slow, fast = result.values()
+        result['speedup'] = round(slow['p50_ms'] / fast['p50_ms'], 2)
+        self.stderr.write(f'limit={limit}: {slow["p50_ms"]} мс -> '
+                          f'{fast["p50_ms"]} мс (x{result["speedup"]})')
+        return result
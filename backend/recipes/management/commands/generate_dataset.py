@@ -0,0 +1,286 @@
+import multiprocessing
+import random
+import time
+from io import BytesIO, StringIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from PIL import Image
+
+from api.cache import bump_versions
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+# Генератор текущего запуска. Процессы-обработчики получают его
+# при fork, поэтому в задачи передаются только номера пакетов.
+_generator = None
+
+
+class PowerLaw:
+    """
+    Выбор элементов с вероятностью, убывающей по степенному закону
+    от ранга элемента. Ранги назначаются перемешиванием с заданным seed.
+    """
+
+    def __init__(self, population, exponent, seed):
+        self.population = list(population)
+        random.Random(seed).shuffle(self.population)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent
+            for rank in range(1, len(self.population) + 1)
+        ))
+
+    def choices(self, rnd, k):
+        return rnd.choices(self.population, cum_weights=self.cum_weights,
+                           k=k)
+
+
+class DatasetGenerator:
+    """Генерация строк таблиц пакетами по номерам строк."""
+
+    PLACEHOLDER_IMAGE = 'recipes/images/placeholder.png'
+    UNIQUE_IMAGE = 'recipes/images/generated_{number}.png'
+
+    def __init__(self, seed, images, prefix):
+        self.seed = seed
+        self.images = images
+        self.prefix = prefix
+        self.password = make_password(None)
+        self.user_ids = []
+        self.recipe_ids = []
+        self.authors = None
+        self.active_users = None
+        self.popular_users = None
+        self.popular_recipes = None
+        self.ingredients = None
+        self.tag_ids = list(Tag.objects.values_list('id', flat=True))
+
+    def random(self, table, index):
+        """Генератор пакета, не зависящий от числа процессов."""
+        return random.Random(f'{self.seed}:{table}:{index}')
+
+    def users(self, rnd, start, end):
+        return [User(username=f'{self.prefix}{number}',
+                     email=f'{self.prefix}{number}@example.com',
+                     first_name='Имя', last_name='Фамилия',
+                     password=self.password)
+                for number in range(start, end)]
+
+    def follows(self, rnd, start, end):
+        pairs = zip(self.active_users.choices(rnd, end - start),
+                    self.popular_users.choices(rnd, end - start))
+        return [Follow(user_id=user_id, following_id=following_id)
+                for user_id, following_id in set(pairs)
+                if user_id != following_id]
+
+    def recipes(self, rnd, start, end):
+        authors = self.authors.choices(rnd, end - start)
+        return [Recipe(name=f'Рецепт {self.prefix}{number}',
+                       text='Описание рецепта. ' * rnd.randint(1, 30),
+                       image=self.get_image(number),
+                       cooking_time=rnd.randint(1, 180),
+                       author_id=author_id)
+                for number, author_id in zip(range(start, end), authors)]
+
+    def recipe_ingredients(self, rnd, start, end):
+        rows = []
+        for recipe_id in self.recipe_ids[start:end]:
+            ingredient_ids = set(
+                self.ingredients.choices(rnd, rnd.randint(3, 12))
+            )
+            rows += [RecipeIngredient(recipe_id=recipe_id,
+                                      ingredient_id=ingredient_id,
+                                      amount=rnd.randint(1, 1000))
+                     for ingredient_id in ingredient_ids]
+        return rows
+
+    def recipe_tags(self, rnd, start, end):
+        rows = []
+        max_tags = min(3, len(self.tag_ids))
+        for recipe_id in self.recipe_ids[start:end]:
+            rows += [Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                     for tag_id in rnd.sample(self.tag_ids,
+                                              rnd.randint(1, max_tags))]
+        return rows
+
+    def favorites(self, rnd, start, end):
+        return self.user_recipes(Favorites, rnd, end - start)
+
+    def shopping_list(self, rnd, start, end):
+        return self.user_recipes(ShoppingList, rnd, end - start)
+
+    def user_recipes(self, model, rnd, count):
+        pairs = zip(self.active_users.choices(rnd, count),
+                    self.popular_recipes.choices(rnd, count))
+        return [model(user_id=user_id, recipe_id=recipe_id)
+                for user_id, recipe_id in set(pairs)]
+
+    def get_image(self, number):
+        if self.images == 'placeholder':
+            return self.PLACEHOLDER_IMAGE
+        name = self.UNIQUE_IMAGE.format(number=number)
+        color = tuple(random.Random(number).randrange(256) for _ in range(3))
+        save_image(name, color)
+        return name
+
+
+def save_image(name, color):
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), color=color).save(buffer, format='PNG')
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def insert_batch(task):
+    """Создание одного пакета строк, выполняется в процессе-обработчике."""
+    table, index, start, end = task
+    rows = getattr(_generator, table)(_generator.random(table, index),
+                                      start, end)
+    if rows:
+        type(rows[0]).objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+class Command(BaseCommand):
+    help = ('Генерация пользователей, рецептов, подписок, избранного '
+            'и списков покупок со степенным распределением. '
+            'Сигналы и сериализаторы не используются, счетчики и списки '
+            'покупок пересчитываются после генерации.')
+
+    BATCH_SIZE = 5000
+    POWER_LAW_EXPONENT = 1.1
+
+    # Количество строк на единицу --scale.
+    SCALE = {
+        'users': 1000,
+        'follows': 20000,
+        'recipes': 10000,
+        'favorites': 200000,
+        'shopping_list': 20000,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Множитель объема данных.')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Начальное значение генератора.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Количество процессов для вставки. '
+                                 'Для SQLite всегда 1.')
+        parser.add_argument('--batch-size', type=int,
+                            default=self.BATCH_SIZE,
+                            help='Количество строк в одном пакете.')
+        parser.add_argument('--images', choices=('placeholder', 'unique'),
+                            default='placeholder',
+                            help='Одно общее изображение для всех рецептов '
+                                 'или отдельный файл для каждого.')
+
+    def handle(self, *args, **options):
+        if options['scale'] <= 0 or options['batch_size'] < 1:
+            raise CommandError('Масштаб и размер пакета должны быть '
+                               'больше нуля.')
+        workers = options['workers']
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stderr.write('SQLite не поддерживает параллельную запись, '
+                              'используется один процесс.')
+            workers = 1
+        call_command('loadcsvdata', '--noinput', '--skip-existing',
+                     stdout=StringIO())
+        if not Tag.objects.exists() or not Ingredient.objects.exists():
+            raise CommandError('Нет тегов или ингредиентов.')
+        global _generator
+        seed = options['seed']
+        _generator = generator = DatasetGenerator(
+            seed, options['images'], prefix=f'gen{seed}_'
+        )
+        counts = {table: max(1, int(count * options['scale']))
+                  for table, count in self.SCALE.items()}
+        if options['images'] == 'placeholder':
+            save_image(generator.PLACEHOLDER_IMAGE, (240, 240, 240))
+        self.batch_size = options['batch_size']
+        self.workers = workers
+        self.report = []
+        started = time.perf_counter()
+
+        last_user_id = self.get_last_id(User)
+        self.insert('users', counts['users'])
+        generator.user_ids = self.get_new_ids(User, last_user_id)
+        if not generator.user_ids:
+            raise CommandError(f'Данные с seed {seed} уже созданы, '
+                               'укажите другой --seed.')
+        generator.active_users = PowerLaw(generator.user_ids,
+                                          self.POWER_LAW_EXPONENT,
+                                          f'{seed}:active')
+        generator.popular_users = PowerLaw(generator.user_ids,
+                                           self.POWER_LAW_EXPONENT,
+                                           f'{seed}:popular')
+        generator.authors = PowerLaw(generator.user_ids,
+                                     self.POWER_LAW_EXPONENT,
+                                     f'{seed}:authors')
+        generator.ingredients = PowerLaw(
+            Ingredient.objects.values_list('id', flat=True),
+            self.POWER_LAW_EXPONENT, f'{seed}:ingredients'
+        )
+        self.insert('follows', counts['follows'])
+
+        last_recipe_id = self.get_last_id(Recipe)
+        self.insert('recipes', counts['recipes'])
+        generator.recipe_ids = self.get_new_ids(Recipe, last_recipe_id)
+        generator.popular_recipes = PowerLaw(generator.recipe_ids,
+                                             self.POWER_LAW_EXPONENT,
+                                             f'{seed}:recipes')
+        recipes_count = len(generator.recipe_ids)
+        self.insert('recipe_ingredients', recipes_count)
+        self.insert('recipe_tags', recipes_count)
+        self.insert('favorites', counts['favorites'])
+        self.insert('shopping_list', counts['shopping_list'])
+
+        call_command('reconcile_counters', stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        call_command('rebuild_feeds', stdout=StringIO())
+        call_command('refresh_rankings', stdout=StringIO())
+        bump_versions('recipes', 'users')
+        self.report.append(
+            f'Готово за {time.perf_counter() - started:.1f} с.'
+        )
+        return '\n'.join(self.report)
+
+    def insert(self, table, count):
+        """Вставка count строк пакетами, параллельно при workers > 1."""
+        started = time.perf_counter()
+        starts = range(0, count, self.batch_size)
+        tasks = [(table, index, start, min(start + self.batch_size, count))
+                 for index, start in enumerate(starts)]
+        if self.workers > 1:
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(self.workers) as pool:
+                inserted = sum(pool.imap_unordered(insert_batch, tasks))
+        else:
+            inserted = sum(map(insert_batch, tasks))
+        elapsed = time.perf_counter() - started
+        self.report.append(
+            f'{table}: {inserted} строк за {elapsed:.1f} с '
+            f'({inserted / max(elapsed, 1e-9):.0f} строк/с).'
+        )
+
+    @staticmethod
+    def get_last_id(model):
+        return model.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+
+    @staticmethod
+    def get_new_ids(model, last_id):
+        return list(model.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', flat=True))
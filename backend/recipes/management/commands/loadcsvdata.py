@@ -1,41 +1,237 @@
 import csv
-import sys
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from api.cache import bump_versions
 from foodgram_backend.settings import BASE_DIR
 from recipes.models import Ingredient, Tag
 
 
 class Command(BaseCommand):
+    help = ('Загрузка ингредиентов и тегов из CSV или JSON пакетами. '
+            'Повторная загрузка не создает дубликатов.')
 
-    MODEL_PATH = ((Ingredient, 'data/ingredients.csv'),
-                  (Tag, 'data/tags.csv'))
+    BATCH_SIZE = 5000
+    JSON_CHUNK_SIZE = 64 * 1024
+
+    # Модель, аргумент с путем к файлу, путь по умолчанию, ключ записи.
+    MODEL_PATH = ((Ingredient, 'ingredients', 'data/ingredients.csv',
+                   ('name', 'measurement_unit')),
+                  (Tag, 'tags', 'data/tags.csv', ('slug',)))
+    CACHE_SCOPES = {Ingredient: ('ingredients', 'recipes'),
+                    Tag: ('tags', 'recipes')}
+
+    def add_arguments(self, parser):
+        for _, name, path, _ in self.MODEL_PATH:
+            parser.add_argument(
+                f'--{name}',
+                default=BASE_DIR / path,
+                type=Path,
+                help=f'Файл .csv или .json для {name}. По умолчанию {path}.'
+            )
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument(
+            '--upsert',
+            action='store_true',
+            help='Обновить существующие записи по ключу.'
+        )
+        mode.add_argument(
+            '--skip-existing',
+            action='store_true',
+            help='Не загружать таблицы, в которых уже есть данные.'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Не запрашивать подтверждение.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=self.BATCH_SIZE,
+            help='Количество записей в одном запросе.'
+        )
 
     def handle(self, *args, **options):
-        if self.__check_model_object():
-            for model, path in self.MODEL_PATH:
-                with open(BASE_DIR / path) as csv_file:
-                    dict_reader = csv.DictReader(csv_file)
-                    for row in dict_reader:
-                        row: dict = row
-                        model.objects.create(**row)
-                    csv_file.close()
-            return 'Данные успешно загружены.'
-        else:
-            sys.exit()
-
-    def __check_model_object(self):
-        models_with_data = []
-        for model, _ in self.MODEL_PATH:
-            if model.objects.exists():
-                models_with_data.append(model.__name__)
-        if models_with_data:
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пакета должен быть больше нуля.')
+        models_with_data = [model.__name__ for model, *_ in self.MODEL_PATH
+                            if model.objects.exists()]
+        if (models_with_data and options['interactive']
+                and not options['upsert'] and not options['skip_existing']):
             answer = input(
                 f'В {models_with_data} уже есть данные.\n'
-                'Продолжение операции может привести к конфликтам.\n'
+                'Будут добавлены только отсутствующие записи.\n'
                 'Продолжить? y/n: '
             )
             if answer.lower() != 'y':
-                return False
-        return True
+                return 'Загрузка отменена.'
+        report = []
+        for model, name, _, keys in self.MODEL_PATH:
+            if options['skip_existing'] and model.__name__ in models_with_data:
+                report.append(f'{model.__name__}: пропущено.')
+                continue
+            report.append(self.__load(model, options[name], keys,
+                                      options['upsert'],
+                                      options['batch_size']))
+        return '\n'.join(report + ['Данные успешно загружены.'])
+
+    def __load(self, model, path, keys, upsert, batch_size):
+        fields = [field.attname for field in model._meta.concrete_fields
+                  if not field.primary_key]
+        count_before = model.objects.count()
+        processed = 0
+        started = time.perf_counter()
+        with open(path, encoding='utf-8') as file, transaction.atomic():
+            rows = self.__read(file, path, fields, keys)
+            if connection.vendor == 'postgresql':
+                loader = PostgresCopyLoader(model, fields, keys, upsert)
+            else:
+                loader = BulkCreateLoader(model, fields, keys, upsert)
+            while batch := list(islice(rows, batch_size)):
+                loader.load(list({
+                    tuple(row[key] for key in keys): row for row in batch
+                }.values()))
+                processed += len(batch)
+        bump_versions(*self.CACHE_SCOPES[model])
+        elapsed = time.perf_counter() - started
+        created = model.objects.count() - count_before
+        return (f'{model.__name__}: обработано {processed}, '
+                f'добавлено {created} за {elapsed:.2f} с '
+                f'({processed / max(elapsed, 1e-9):.0f} строк/с).')
+
+    def __read(self, file, path, fields, keys):
+        """Потоковое чтение записей с полями модели из CSV или JSON."""
+        if path.suffix == '.json':
+            rows = iter_json_array(file, self.JSON_CHUNK_SIZE)
+        elif path.suffix == '.csv':
+            rows = csv.DictReader(file)
+        else:
+            raise CommandError(f'Неизвестный формат файла {path}.')
+        for number, row in enumerate(rows, start=1):
+            if not isinstance(row, dict) or any(key not in row
+                                                for key in keys):
+                raise CommandError(
+                    f'{path}: в записи {number} нет полей {", ".join(keys)}.'
+                )
+            yield {field: row[field] for field in fields if field in row}
+
+
+class BulkCreateLoader:
+    """Загрузка пакетов через bulk_create с пропуском конфликтов."""
+
+    def __init__(self, model, fields, keys, upsert):
+        self.model = model
+        self.keys = keys
+        self.update_fields = [field for field in fields
+                              if field not in keys] if upsert else []
+
+    def load(self, rows):
+        if self.update_fields:
+            rows = self.__update_existing(rows)
+        self.model.objects.bulk_create(
+            (self.model(**row) for row in rows),
+            ignore_conflicts=True
+        )
+
+    def __update_existing(self, rows):
+        """Обновление существующих записей, возвращает новые записи."""
+        rows_by_key = {tuple(row[key] for key in self.keys): row
+                       for row in rows}
+        existing = self.model.objects.filter(**{
+            f'{self.keys[0]}__in': {key[0] for key in rows_by_key}
+        })
+        changed = []
+        for obj in existing:
+            row = rows_by_key.pop(
+                tuple(getattr(obj, key) for key in self.keys), None
+            )
+            if row is None:
+                continue
+            for field in self.update_fields:
+                setattr(obj, field, row.get(field, getattr(obj, field)))
+            changed.append(obj)
+        self.model.objects.bulk_update(changed, self.update_fields)
+        return list(rows_by_key.values())
+
+
+class PostgresCopyLoader:
+    """
+    Загрузка пакетов через COPY во временную таблицу
+    и INSERT ... ON CONFLICT в основную.
+    """
+
+    def __init__(self, model, fields, keys, upsert):
+        quote = connection.ops.quote_name
+        self.fields = fields
+        self.table = quote(f'load_{model._meta.db_table}')
+        columns = ', '.join(quote(field) for field in fields)
+        update_fields = [field for field in fields if field not in keys]
+        if upsert and update_fields:
+            conflict = 'ON CONFLICT ({}) DO UPDATE SET {}'.format(
+                ', '.join(quote(key) for key in keys),
+                ', '.join(f'{quote(field)} = EXCLUDED.{quote(field)}'
+                          for field in update_fields)
+            )
+        else:
+            conflict = 'ON CONFLICT DO NOTHING'
+        self.copy_sql = (f'COPY {self.table} ({columns}) '
+                         'FROM STDIN WITH (FORMAT csv)')
+        self.insert_sql = (
+            f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+            f'SELECT {columns} FROM {self.table} {conflict}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE {self.table} ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {quote(model._meta.db_table)} '
+                'WITH NO DATA'
+            )
+
+    def load(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row.get(field) for field in self.fields)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(self.copy_sql, buffer)
+            cursor.execute(self.insert_sql)
+            cursor.execute(f'TRUNCATE {self.table}')
+
+
+def iter_json_array(file, chunk_size):
+    """Потоковое чтение элементов JSON-массива без загрузки всего файла."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(chunk_size), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON-массив.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+        buffer = buffer[position:]
+    raise CommandError('Некорректный JSON: массив не завершен.')
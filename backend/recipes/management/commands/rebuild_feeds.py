@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.services import FeedTimeline
+
+
+class Command(BaseCommand):
+    help = ('Перестроение лент подписок по подпискам и рецептам, '
+            'например после загрузки данных в обход сигналов.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            entries = FeedTimeline.rebuild()
+        return f'Ленты подписок перестроены, записей: {entries}.'
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.services import ShoppingListAggregator
+from recipes.models import ShoppingListIngredient
+
+
+class Command(BaseCommand):
+    help = ('Пересчет сумм ингредиентов в списках покупок '
+            'по рецептам из списков.')
+
+    BATCH_SIZE = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить суммы с рассчитанными, без изменений.'
+        )
+
+    def handle(self, *args, **options):
+        expected = ShoppingListAggregator.calculate()
+        if options['verify']:
+            return self.__verify(expected)
+        with transaction.atomic():
+            ShoppingListIngredient.objects.all().delete()
+            ShoppingListIngredient.objects.bulk_create(
+                (ShoppingListIngredient(user_id=user_id,
+                                        ingredient_id=ingredient_id,
+                                        amount=amount)
+                 for (user_id, ingredient_id), amount in expected.items()),
+                batch_size=self.BATCH_SIZE
+            )
+        return f'Списки покупок пересчитаны, записей: {len(expected)}.'
+
+    @staticmethod
+    def __verify(expected: dict):
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListIngredient.objects.exclude(amount=0).values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        mismatches = [key for key in expected.keys() | actual.keys()
+                      if expected.get(key) != actual.get(key)]
+        if mismatches:
+            raise CommandError(
+                f'Суммы не совпадают для {len(mismatches)} записей. '
+                'Запустите команду без --verify для пересчета.'
+            )
+        return 'Суммы списков покупок совпадают.'
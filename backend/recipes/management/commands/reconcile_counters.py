@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorites, Recipe
+from users.models import Follow
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Пересчет счетчиков favorites_count, recipes_count '
+            'и followers_count по данным таблиц.')
+
+    # (модель со счетчиком, поле счетчика, связанная модель, поле связи)
+    COUNTERS = ((Recipe, 'favorites_count', Favorites, 'recipe'),
+                (User, 'recipes_count', Recipe, 'author'),
+                (User, 'followers_count', Follow, 'following'))
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только показать количество расхождений, без изменений.'
+        )
+
+    def handle(self, *args, **options):
+        report = []
+        with transaction.atomic():
+            for model, counter, related_model, related_field in self.COUNTERS:
+                actual = Coalesce(Subquery(
+                    related_model.objects.filter(
+                        **{related_field: OuterRef('pk')}
+                    ).order_by().values(related_field).annotate(
+                        count=Count('pk')
+                    ).values('count')
+                ), 0)
+                drifted = model.objects.annotate(actual=actual).filter(
+                    ~Q(**{counter: F('actual')})
+                ).values_list('pk', flat=True)
+                drifted_ids = list(drifted)
+                if drifted_ids and not options['verify']:
+                    model.objects.filter(pk__in=drifted_ids).update(
+                        **{counter: actual}
+                    )
+                report.append(
+                    f'{model.__name__}.{counter}: {len(drifted_ids)}'
+                )
+        action = 'Найдено' if options['verify'] else 'Исправлено'
+        return f'{action} расхождений: ' + ', '.join(report) + '.'
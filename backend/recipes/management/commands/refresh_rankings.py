@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.rankings import RecipeRanking
+from recipes.models import Recipe, RecipeScore
+
+
+class Command(BaseCommand):
+    help = ('Пересчет рейтингов popular и trending по избранному '
+            'и спискам покупок.')
+
+    BATCH_SIZE = 1000
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            missing = Recipe.objects.filter(
+                score__isnull=True
+            ).values_list('id', flat=True)
+            RecipeScore.objects.bulk_create(
+                (RecipeScore(recipe_id=recipe_id)
+                 for recipe_id in missing.iterator()),
+                batch_size=self.BATCH_SIZE,
+                ignore_conflicts=True
+            )
+            # Изменения рейтингов из запросов ждут окончания пересчета.
+            list(RecipeScore.objects.select_for_update().values_list(
+                'pk', flat=True
+            ))
+            scores = RecipeRanking.calculate()
+            RecipeScore.objects.exclude(pk__in=scores.keys()).update(
+                popular=0, trending=0
+            )
+            RecipeScore.objects.bulk_update(
+                (RecipeScore(recipe_id=recipe_id, popular=popular,
+                             trending=trending)
+                 for recipe_id, (popular, trending) in scores.items()),
+                ('popular', 'trending'),
+                batch_size=self.BATCH_SIZE
+            )
+        return f'Рейтинги пересчитаны, рецептов с добавлениями: {len(scores)}.'
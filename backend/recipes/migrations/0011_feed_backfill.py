@@ -0,0 +1,70 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+from foodgram_backend.constants import FeedConstants
+
+
+def backfill_feeds(apps, schema_editor):
+    # Ленты подписок, оформленных до появления FeedEntry. Дальше ленты
+    # пересобирает команда rebuild_feeds.
+    Follow = apps.get_model('users', 'Follow')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    follows = Follow.objects.filter(
+        following__followers_count__lt=FeedConstants.PULL_FOLLOWERS
+    )
+    author_ids = follows.order_by('following_id').values_list(
+        'following_id', flat=True
+    ).distinct()
+    for author_id in author_ids.iterator():
+        recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', 'pub_date')[:FeedConstants.MAX_ENTRIES])
+        FeedEntry.objects.bulk_create(
+            (FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                       author_id=author_id, pub_date=pub_date)
+             for user_id in follows.filter(
+                 following_id=author_id
+             ).values_list('user_id', flat=True).iterator()
+             for recipe_id, pub_date in recipes),
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+    overflowed = FeedEntry.objects.values('user_id').annotate(
+        entries=models.Count('id')
+    ).filter(entries__gt=FeedConstants.MAX_ENTRIES).values_list(
+        'user_id', flat=True
+    )
+    for user_id in overflowed.iterator():
+        last = FeedEntry.objects.filter(user_id=user_id).order_by(
+            '-pub_date', '-recipe_id'
+        ).values_list('pub_date', 'recipe_id')[FeedConstants.MAX_ENTRIES]
+        FeedEntry.objects.filter(user_id=user_id).filter(
+            models.Q(pub_date__lt=last[0])
+            | models.Q(pub_date=last[0], recipe_id__lte=last[1])
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_counters'),
+        ('recipes', '0010_recipescore'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='feedentry',
+            name='feed_entry__user_pub_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='feed_entry__user_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe__author_pub_date_idx'),
+        ),
+        migrations.RunPython(backfill_feeds, migrations.RunPython.noop),
+    ]
@@ -8,11 +8,12 @@ from foodgram_backend.constants import (RecipeConstants,
                                         IngredientConstants,
                                         RecipeIngredientConstants,
                                         )
+from foodgram_backend.db.models import CountersModelMixin
 
 User = get_user_model()
 
 
-class Recipe(models.Model):
+class Recipe(CountersModelMixin, models.Model):
     """
     Модель рецептов.
     Связи:
@@ -24,6 +25,10 @@ class Recipe(models.Model):
     Ограничения:
         - Автор не может создавать рецепты с одинаковыми именами.
         - Время приготовления ограничено минимальным и максимальными значениями
+    Поле favorites_count обновляется при добавлении и удалении
+    рецепта из избранного и не записывается при сохранении рецепта.
+    Поле updated_at обновляется при любом изменении рецепта, его тегов
+    и ингредиентов и служит версией рецепта для условных запросов.
     """
 
     name = models.CharField(
@@ -68,6 +73,18 @@ class Recipe(models.Model):
         auto_now_add=True,
         editable=False
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в избранное',
+        default=0,
+        editable=False
+    )
+
+    COUNTER_FIELDS = ('favorites_count',)
 
     class Meta:
         constraints = (
@@ -76,6 +93,10 @@ class Recipe(models.Model):
                 name='recipe_name_author_uniq'
             ),
         )
+        indexes = (
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe__author_pub_date_idx'),
+        )
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
@@ -277,3 +298,144 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f'{self.recipe.name} -- {self.user.username}'
+
+
+class ShoppingListIngredient(models.Model):
+    """
+    Модель суммарного количества ингредиентов в списке покупок.
+    Обновляется при добавлении и удалении рецептов из списка покупок
+    и при изменении ингредиентов рецептов из списка.
+    Связи:
+        - user -- Foreign Key c моделью User.
+        - ingredient -- Foreign Key c моделью Ingredient.
+    Ограничения:
+        - Ингредиенты в списке покупок пользователя не должны повторяться.
+    """
+
+    user = models.ForeignKey(
+        to=User,
+        verbose_name='Пользователь',
+        related_name='shop_list_ingredients',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        to=Ingredient,
+        verbose_name='Ингредиент',
+        related_name='shop_list_ingredients',
+        on_delete=models.CASCADE
+    )
+    amount = models.IntegerField(
+        default=0,
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='shop_list_ingredient__user_ingredient_uniq'
+            ),
+        )
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списков покупок'
+
+    def __str__(self):
+        return f'{self.ingredient.name} -- {self.user.username}'
+
+
+class FeedEntry(models.Model):
+    """
+    Модель записи ленты подписок.
+    Запись создается для подписчиков автора при публикации рецепта,
+    при подписке на автора и когда у автора становится меньше
+    FeedConstants.PULL_FOLLOWERS подписчиков, удаляется при отписке
+    и когда подписчиков становится PULL_FOLLOWERS. В ленте
+    пользователя хранится не больше FeedConstants.MAX_ENTRIES записей.
+    Поле pub_date копирует дату публикации рецепта.
+    Связи:
+        - user -- Foreign Key c моделью User, владелец ленты.
+        - recipe -- Foreign Key c моделью Recipe.
+        - author -- Foreign Key c моделью User, автор рецепта.
+    Ограничения:
+        - Рецепты в ленте пользователя не должны повторяться.
+    """
+
+    user = models.ForeignKey(
+        to=User,
+        verbose_name='Пользователь',
+        related_name='feed_entries',
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(
+        to=Recipe,
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+        on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        to=User,
+        verbose_name='Автор',
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='feed_entry__user_recipe_uniq'
+            ),
+        )
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='feed_entry__user_pub_date_idx'),
+        )
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи лент подписок'
+
+    def __str__(self):
+        return f'{self.recipe.name} -- {self.user.username}'
+
+
+class RecipeScore(models.Model):
+    """
+    Модель рейтинга рецепта для сортировки popular и trending.
+    Создается вместе с рецептом, обновляется при добавлении и удалении
+    рецепта из избранного и списка покупок и пересчитывается командой
+    refresh_rankings.
+    Поля:
+        - popular -- Взвешенное число добавлений за все время.
+        - trending -- Логарифм по основанию 2 суммы весов добавлений,
+        затухающих вдвое за RankingConstants.TRENDING_HALF_LIFE, в единицах
+        времени полураспада от RankingConstants.EPOCH. 0 -- нет добавлений.
+    """
+
+    recipe = models.OneToOneField(
+        to=Recipe,
+        verbose_name='Рецепт',
+        related_name='score',
+        primary_key=True,
+        on_delete=models.CASCADE
+    )
+    popular = models.FloatField(
+        default=0,
+        verbose_name='Популярность'
+    )
+    trending = models.FloatField(
+        default=0,
+        verbose_name='Популярность за последнее время'
+    )
+
+    class Meta:
+        indexes = (
+            models.Index(fields=('-popular', '-recipe'),
+                         name='recipe_score__popular_idx'),
+            models.Index(fields=('-trending', '-recipe'),
+                         name='recipe_score__trending_idx'),
+        )
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+
+    def __str__(self):
+        return f'{self.recipe.name}: {self.popular}, {self.trending}'
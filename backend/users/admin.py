@@ -4,7 +4,6 @@ from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
 from rest_framework.authtoken.models import TokenProxy
 
-from recipes.models import Recipe
 from users.models import Follow, FoodgramUser
 
 User = get_user_model()
@@ -41,15 +40,15 @@ class FoodgramUserAdmin(UserAdmin):
         """Булево значение является ли пользователь администратором."""
         return user.role == 'admin'
 
-    @admin.display(description='Подписчиков')
+    @admin.display(description='Подписчиков', ordering='followers_count')
     def followers_count(self, user: FoodgramUser):
         """Счетчик подписчиков пользователя."""
-        return user.following.count()
+        return user.followers_count
 
-    @admin.display(description='Рецептов')
+    @admin.display(description='Рецептов', ordering='recipes_count')
     def recipes_count(self, user: FoodgramUser):
         """Счетчик рецептов пользователя."""
-        return Recipe.objects.filter(author=user).count()
+        return user.recipes_count
 
     def save_model(self, request, obj: FoodgramUser, form, change):
         """
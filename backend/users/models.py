@@ -1,14 +1,18 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from foodgram_backend.constants import FoodgramUserConstants
+from foodgram_backend.db.models import CountersModelMixin
 
 
-class FoodgramUser(AbstractUser):
+class FoodgramUser(CountersModelMixin, AbstractUser):
     """
     Модель пользователя.
     Поле email переопределено для установки уникальности электронных
     почт пользователей.
     Дополнительное поле role - Выбор пользователь или администратор.
+    Поля recipes_count и followers_count обновляются при создании
+    и удалении рецептов и подписок и не записываются при сохранении
+    пользователя.
     """
 
     class Role(models.TextChoices):
@@ -25,6 +29,18 @@ class FoodgramUser(AbstractUser):
         max_length=FoodgramUserConstants.MAX_LEN_ROLE,
         verbose_name='Роль'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков'
+    )
+
+    COUNTER_FIELDS = ('recipes_count', 'followers_count')
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -43,6 +43,8 @@ class UserReadSerializer(serializers.ModelSerializer):
     """
     Представление пользователей.
     Поле is_subscribed получено с помощью дополнительного метода.
+    Если пользователь получен из аннотированной выборки,
+    используется готовое значение без запроса к базе.
     """
 
     is_subscribed = serializers.SerializerMethodField(read_only=True)
@@ -53,6 +55,9 @@ class UserReadSerializer(serializers.ModelSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, following):
+        annotated_value = getattr(following, 'is_subscribed', None)
+        if annotated_value is not None:
+            return annotated_value
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -74,7 +79,12 @@ class FollowRecipeSerializer(serializers.ModelSerializer):
 
 
 class FollowSerializer(serializers.ModelSerializer):
-    """Представление подписок пользователя."""
+    """
+    Представление подписок пользователя.
+    Поле is_subscribed истинно для подписок текущего пользователя.
+    Рецепты авторов берутся из контекста recipes_by_author,
+    если они загружены заранее.
+    """
 
     email = serializers.EmailField(
         source='following.email',
@@ -99,7 +109,7 @@ class FollowSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.ReadOnlyField(
-        source='following.recipes.count'
+        source='following.recipes_count'
     )
 
     class Meta:
@@ -110,21 +120,27 @@ class FollowSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, follow_obj):
         user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Follow.objects.filter(
-            user=follow_obj.user,
-            following=follow_obj.following
-        ).exists()
+        return follow_obj.user_id == user.id
 
     def get_recipes(self, follow_obj):
-        request = self.context.get('request')
-        recipes_limit = request.GET.get('recipes_limit')
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(follow_obj.following_id, [])
+            return FollowRecipeSerializer(recipes, many=True).data
+        recipes_limit = self.get_recipes_limit(self.context.get('request'))
         recipes = Recipe.objects.filter(author=follow_obj.following)
-        if recipes_limit and recipes_limit.isdigit():
-            recipes = recipes[:int(recipes_limit)]
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
         return FollowRecipeSerializer(recipes, many=True).data
 
+    @staticmethod
+    def get_recipes_limit(request):
+        """Значение параметра recipes_limit или None."""
+        recipes_limit = request.GET.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            return int(recipes_limit)
+        return None
+
     def validate(self, data):
         following = self.context.get('following')
         user = self.context.get('request').user
@@ -9,6 +9,7 @@ from rest_framework.response import Response
 
 from api.pagination import CustomPagination
 from api.permissions import IsRequestUserOrAdminOrHigherOrReadonly
+from api.services import annotate_is_subscribed, get_recipes_by_author
 from users.models import Follow
 from users.serializers import (UserCreateSerializer,
                                UserReadSerializer,
@@ -44,13 +45,23 @@ class UserViewSet(viewsets.GenericViewSet,
     Пагинация:
         - page=<int> - Номер страницы
         - limit=<int> - Количество объектов на странице(по умолчанию 6)
+        - cursor=<str> - Курсор следующей страницы вместо page
+    Чтение подписок и рецептов -- из реплики (api.routers), пользователи
+    и токены читаются из основной базы.
     """
 
+    read_from_replica = True
     queryset = User.objects.all()
     permission_classes = [IsRequestUserOrAdminOrHigherOrReadonly, ]
     pagination_class = CustomPagination
     serializer_class = UserCreateSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            return annotate_is_subscribed(queryset, self.request.user)
+        return queryset
+
     def get_serializer_class(self):
         if self.action in ['retrieve', 'list', 'me']:
             return UserReadSerializer
@@ -70,7 +81,9 @@ class UserViewSet(viewsets.GenericViewSet,
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.request.user.set_password(serializer.data['new_password'])
-        self.request.user.save()
+        # request.user может быть копией из кэша токенов (api.authentication),
+        # поэтому записывается только пароль.
+        self.request.user.save(update_fields=['password'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -89,12 +102,24 @@ class UserViewSet(viewsets.GenericViewSet,
         permission_classes=[IsAuthenticated, ]
     )
     def subscriptions(self, request: Request):
-        """Представление всех подписок пользователя."""
-        follows = Follow.objects.filter(user=self.request.user)
+        """
+        Представление всех подписок пользователя.
+        Рецепты всех авторов страницы загружаются одним запросом,
+        количество рецептов берется из счетчика автора.
+        """
+        follows = Follow.objects.filter(
+            user=self.request.user
+        ).select_related('following')
         pages = self.paginate_queryset(follows)
+        context = self.get_serializer_context()
+        context['recipes_by_author'] = get_recipes_by_author(
+            author_ids=[follow.following_id for follow in pages],
+            limit=FollowSerializer.get_recipes_limit(request)
+        )
         serializer = self.get_serializer(
             pages,
             many=True,
+            context=context
         )
         return self.get_paginated_response(serializer.data)
 